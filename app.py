@@ -1,8 +1,32 @@
 import os
 import json
 import logging
-from flask import Flask, render_template, jsonify, request, send_from_directory, abort
+import threading
+from flask import Flask, render_template, jsonify, request, send_from_directory, send_file, abort, Response
 from pathlib import Path
+from werkzeug.http import is_resource_modified
+import numpy as np
+
+from layer_store import LayerStore, encode_json, geometry_filename, version_fingerprint, version_time
+from layer_catalog import LayerCatalog
+from layer_query import build_attribute_index, build_feature_rows, lookup_row, parse_predicates
+from layer_stats import build_layer_schema
+from style_inference import build_layer_profile
+from layer_report import build_columnar_layer_columns, build_layer_columns, summarize
+from classification import (METHODS, DEFAULT_METHOD, DEFAULT_CLASSES, MAX_CLASSES, build_classification,
+                            build_columnar_classification)
+from columnar import ColumnarStore
+from geojson_stream import (iter_features, join_geometry_stream, read_members, stream_feature_collection,
+                            stream_geojsonseq)
+from spatial_index import build_spatial_index, geometry_contains_point
+from vector_tiles import TileCache, render_tile, MAX_ZOOM
+from simplification import level_filename, select_level
+from jobs import JobConflictError, JobRunner
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, RequestMetrics
+import geobuf
+import geojson_writer
+import geopackage
+import compression
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, 
@@ -17,12 +41,36 @@ app.secret_key = os.environ.get("SESSION_SECRET", "homs-map-app-secret")
 GEOJSON_DIR = os.path.join(app.static_folder, 'data')
 STYLE_DIR = os.path.join(app.static_folder, 'styles')
 IMAGE_DIR = os.path.join(app.static_folder, 'images')
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", os.path.join(app.root_path, 'cache', 'tiles'))
 
 # Ensure directories exist
 os.makedirs(GEOJSON_DIR, exist_ok=True)
 os.makedirs(STYLE_DIR, exist_ok=True)
 os.makedirs(IMAGE_DIR, exist_ok=True)
 
+# Layer index kept in memory and refreshed when layer or style files change
+layer_catalog = LayerCatalog(GEOJSON_DIR, STYLE_DIR)
+
+# Latency, size, cache and parse metrics per route and catalogued layer, served at /metrics
+request_metrics = RequestMetrics(known_layer=layer_catalog.has_layer)
+request_metrics.init_app(app)
+
+# Parsed layers are shared across requests and reloaded when their files change
+layer_store = LayerStore(GEOJSON_DIR, quantize=geojson_writer.quantize, metrics=request_metrics)
+
+# Memory-mapped columnar copies of layer attributes, when the ETL wrote them
+columnar_store = ColumnarStore(GEOJSON_DIR, metrics=request_metrics)
+
+# Indexed GeoPackage copy of the layers (LAYER_GEOPACKAGE=1), read-only
+layer_geopackage = (geopackage.GeoPackageLayers(geopackage.geopackage_path(GEOJSON_DIR))
+                    if geopackage.ENABLED else None)
+
+# Rendered vector tiles, keyed by layer version
+tile_cache = TileCache(TILE_CACHE_DIR, metrics=request_metrics)
+
+# Long-running tasks (MPK extraction) run in the background, one at a time
+job_runner = JobRunner()
+
 # Load map info if available
 MAP_INFO_PATH = os.path.join(GEOJSON_DIR, 'map_info.json')
 MAP_INFO = {
@@ -44,6 +92,184 @@ if os.path.exists(MAP_INFO_PATH):
     except Exception as e:
         logger.error(f"Error loading map info: {e}")
 
+# Style of layers without a style file
+DEFAULT_LAYER_STYLE = {
+    "type": "default",
+    "default_style": {
+        "color": "#3388ff",
+        "weight": 2,
+        "opacity": 1,
+        "fillOpacity": 0.2
+    }
+}
+
+def read_layer_style(layer_id):
+    """Return the parsed style file of a layer, or the default style"""
+    style_path = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
+    try:
+        with open(style_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return DEFAULT_LAYER_STYLE
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable style {style_path}: {e}")
+        return DEFAULT_LAYER_STYLE
+
+def summarize_schema(schema):
+    """Reduce a layer schema to its property names and types"""
+    return {
+        'featureCount': schema['featureCount'],
+        'geometryTypes': schema['geometryTypes'],
+        'properties': [{'name': prop['name'], 'type': prop['type']} for prop in schema['properties']]
+    }
+
+def build_bootstrap():
+    """Collect everything the map needs at startup: map info, layers, styles and schemas"""
+    layers = layer_catalog.layers()
+    styles = {}
+    schemas = {}
+    for layer in layers:
+        layer_id = layer['id']
+        styles[layer_id] = read_layer_style(layer_id)
+        try:
+            schema = layer_store.derive(layer.get('filename', f"{layer_id}.geojson"), 'schema', build_layer_schema)
+            schemas[layer_id] = summarize_schema(schema)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping schema of layer {layer_id}: {e}")
+            schemas[layer_id] = None
+    return {'mapInfo': MAP_INFO, 'layers': layers, 'styles': styles, 'schemas': schemas}
+
+# Bootstrap response, rebuilt when any file it depends on changes
+_bootstrap = {'fingerprint': None}
+_bootstrap_lock = threading.Lock()
+
+def current_bootstrap():
+    """Return the memoized bootstrap response, rebuilding it if a file changed"""
+    fingerprint = layer_catalog.fingerprint
+    with _bootstrap_lock:
+        if _bootstrap['fingerprint'] == fingerprint:
+            return dict(_bootstrap)
+    
+    # Build outside the lock; loading the layer schemas can take a while
+    body = encode_json(build_bootstrap())
+    memo = {
+        'fingerprint': fingerprint,
+        'body': body,
+        'etag': fingerprint,
+        'last_modified': layer_catalog.last_modified,
+        'compressed': {}
+    }
+    with _bootstrap_lock:
+        _bootstrap.clear()
+        _bootstrap.update(memo)
+    return dict(memo)
+
+def geopackage_layer(filename):
+    """Return the GeoPackage table of a layer if it is enabled and current, else None"""
+    if layer_geopackage is None:
+        return None
+    return layer_geopackage.layer(filename, layer_store.file_version)
+
+def feature_collection_body(feature_texts, total):
+    """Encode a query result from features that are already JSON text"""
+    return (f'{{"type":"FeatureCollection","features":[{",".join(feature_texts)}],'
+            f'"numberMatched":{len(feature_texts)},"totalFeatures":{total}}}').encode('utf-8')
+
+# Endpoints whose response encoding depends on the Accept header
+NEGOTIATED_ENDPOINTS = {'get_geojson', 'get_geometry_store'}
+
+def wants_geobuf():
+    """Return True if the client asked for Geobuf (format=geobuf or the Accept header)"""
+    if request.args.get('format') == 'geobuf':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', geobuf.GEOBUF_MIMETYPE])
+    return best == geobuf.GEOBUF_MIMETYPE
+
+def current_geobuf(filepath):
+    """Return the path of the Geobuf copy of a layer file if it is up to date, else None"""
+    path = geobuf.geobuf_path(filepath)
+    try:
+        if os.stat(path).st_mtime_ns >= os.stat(filepath).st_mtime_ns:
+            return path
+    except FileNotFoundError:
+        pass
+    return None
+
+def geobuf_file_response(path):
+    """Send a precomputed Geobuf copy with the validators of its current version"""
+    fingerprint, last_modified = file_validators(path)
+    return cached_response(None, geobuf.GEOBUF_MIMETYPE, f"{fingerprint}.geobuf", last_modified, source_path=path)
+
+def encode_stored_geobuf(entry):
+    """Encode a layer as stored on disk (attribute-only for shared-geometry layers)"""
+    if entry.attributes_body is not None:
+        return geobuf.encode(json.loads(entry.attributes_body))
+    return geobuf.encode(entry.data)
+
+def file_validators(path):
+    """Return the (fingerprint, last modified time) of a file's current version"""
+    stat = os.stat(path)
+    version = [(stat.st_mtime_ns, stat.st_size)]
+    return version_fingerprint(version), version_time(version)
+
+def accepted_variant(source_path):
+    """Return (encoding, path) of a current precompressed variant the client accepts, or None"""
+    variants = {}
+    for encoding in compression.SUFFIXES:
+        variant = compression.current_variant(source_path, encoding)
+        if variant:
+            variants[encoding] = variant
+    encoding = request.accept_encodings.best_match(list(variants)) if variants else None
+    return (encoding, variants[encoding]) if encoding else None
+
+def compressed_layer(filename, key, build):
+    """Return a compress(encoding) callback that compresses build(entry) once per layer version"""
+    return lambda encoding: layer_store.derive(
+        filename, (key, encoding), lambda entry: compression.compress(build(entry), encoding))
+
+def cached_response(body, mimetype, etag, last_modified, compress=None, source_path=None):
+    """Return a body with strong validators, compressed when the client accepts it
+
+    The ETag and Last-Modified come from the version of the files the body
+    was built from, and requests whose validators still match get a 304. A
+    current precompressed variant of source_path (the file the body was
+    read from) is sent when the client accepts one; otherwise
+    compress(encoding) supplies the compressed body. Pass body=None to send
+    source_path itself.
+    """
+    variant = accepted_variant(source_path) if source_path else None
+    if variant:
+        encoding, variant_path = variant
+    else:
+        offered = compression.available_encodings() if compress else ()
+        encoding = request.accept_encodings.best_match(offered) if offered else None
+    if encoding:
+        etag = f"{etag}.{encoding}"
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    elif variant:
+        response = send_file(variant_path, mimetype=mimetype, etag=False, conditional=False)
+    elif body is None:
+        response = send_file(source_path, mimetype=mimetype, etag=False, conditional=False)
+    else:
+        response = Response(compress(encoding) if encoding else body, mimetype=mimetype)
+    if encoding:
+        response.content_encoding = encoding
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Clients keep their copy but check it is still current on each use
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+def add_vary_header(response):
+    """Let caches keep the JSON and Geobuf encodings of a layer apart"""
+    if request.endpoint in NEGOTIATED_ENDPOINTS:
+        response.vary.add('Accept')
+    return response
+
 @app.route('/')
 def index():
     """Render the main map page"""
@@ -59,52 +285,51 @@ def get_map_info():
     """Return map information"""
     return jsonify(MAP_INFO)
 
+@app.route('/api/bootstrap')
+def get_bootstrap():
+    """Return map info, the layer index, every layer style and schema summaries in one response
+
+    The response is memoized until any layer, geometry or style file
+    changes, and is compressed and revalidated like the layer endpoints.
+    """
+    try:
+        memo = current_bootstrap()
+        
+        def compress(encoding):
+            compressed = memo['compressed'].get(encoding)
+            if compressed is None:
+                compressed = memo['compressed'][encoding] = compression.compress(memo['body'], encoding)
+            return compressed
+        
+        return cached_response(memo['body'], 'application/json', memo['etag'], memo['last_modified'],
+                               compress=compress)
+    except Exception as e:
+        logger.error(f"Error building bootstrap data: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/geojson-layers')
 def get_geojson_layers():
     """Return a list of available GeoJSON layers"""
-    # First check if we have a layers.json index file
-    index_path = os.path.join(GEOJSON_DIR, 'layers.json')
-    if os.path.exists(index_path):
-        try:
-            with open(index_path, 'r', encoding='utf-8') as f:
-                layers = json.load(f)
-                return jsonify(layers)
-        except Exception as e:
-            logger.error(f"Error reading layers index: {e}")
-    
-    # Fall back to scanning the directory
-    layers = []
-    
-    # Get all GeoJSON files in the data directory
-    for file_path in Path(GEOJSON_DIR).glob('*.geojson'):
-        layer_id = file_path.stem
-        
-        # Check if we have style information for this layer
-        style_path = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
-        has_style = os.path.exists(style_path)
-        
-        # Count features in the GeoJSON file
-        feature_count = 0
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                feature_count = len(data.get('features', []))
-        except Exception as e:
-            logger.error(f"Error counting features in {file_path}: {e}")
-        
-        layers.append({
-            'id': layer_id,
-            'name': layer_id.replace('_', ' ').title(),
-            'filename': file_path.name,
-            'feature_count': feature_count,
-            'has_style': has_style
-        })
-    
-    return jsonify(layers)
+    try:
+        body, fingerprint, last_modified = layer_catalog.snapshot()
+        return cached_response(body, 'application/json', fingerprint, last_modified)
+    except Exception as e:
+        logger.error(f"Error listing layers: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/geojson/<filename>')
 def get_geojson(filename):
-    """Serve a specific GeoJSON file"""
+    """Serve a specific GeoJSON file
+
+    Pass stream=1 to stream the FeatureCollection feature by feature, or
+    format=geojsonseq for a GeoJSON text sequence (RFC 8142). Layers too
+    large for the layer store are always streamed from disk. A zoom or
+    tolerance (in degrees) argument selects a precomputed simplified copy
+    when one exists.
+    Pass join=0 to get shared-geometry layers without their geometry.
+    Clients accepting application/vnd.geobuf (or passing format=geobuf)
+    get the layer encoded as Geobuf.
+    """
     try:
         # Ensure filename only contains valid characters and ends with .geojson
         if not filename.endswith('.geojson') or '..' in filename:
@@ -114,15 +339,122 @@ def get_geojson(filename):
         
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
+        
+        # Serve a simplified copy when the client asks for a zoom or tolerance
+        level = select_level(zoom=request.args.get('zoom', type=float),
+                             tolerance=request.args.get('tolerance', type=float))
+        if level is not None:
+            level_file = level_filename(Path(filename).stem, level)
+            level_path = os.path.join(GEOJSON_DIR, level_file)
+            if os.path.exists(level_path):
+                filename, filepath = level_file, level_path
+        
+        # Layers too large for the store are streamed from disk. Copies on
+        # disk of a shared-geometry layer lack its geometry, so unless join=0
+        # they are joined to their geometry store as they stream.
+        streamed = os.path.getsize(filepath) > layer_store.budget_bytes
+        geometry_source = None
+        if streamed and request.args.get('join') != '0':
+            geometry_source = read_members(filepath).get('geometry_source')
+        
+        # Geobuf copies are written at ingest and sent as-is while current;
+        # otherwise the layer is encoded once per version. Layers too large
+        # for the store without a usable copy fall back to streamed JSON.
+        if wants_geobuf():
+            precomputed = current_geobuf(filepath)
+            if not streamed:
+                try:
+                    entry = layer_store.get(filename)
+                except FileNotFoundError:
+                    return jsonify({'error': 'File not found'}), 404
+                if entry.attributes_body is not None and request.args.get('join') != '0':
+                    body = layer_store.derive(filename, 'geobuf_joined', lambda e: geobuf.encode(e.data))
+                elif precomputed:
+                    return geobuf_file_response(precomputed)
+                else:
+                    body = layer_store.derive(filename, 'geobuf', encode_stored_geobuf)
+                return cached_response(body, geobuf.GEOBUF_MIMETYPE, f"{entry.fingerprint}.geobuf", entry.last_modified)
+            if precomputed and not geometry_source:
+                return geobuf_file_response(precomputed)
+        
+        encode_stream = None
+        if request.args.get('format') == 'geojsonseq':
+            encode_stream, mimetype = stream_geojsonseq, 'application/geo+json-seq'
+        elif request.args.get('stream') == '1':
+            encode_stream, mimetype = stream_feature_collection, 'application/json'
+        
+        # Stream layers too large for the store straight from disk so peak
+        # memory does not grow with the layer, unless a precompressed copy
+        # can be sent as-is
+        if streamed:
+            if encode_stream is None and not geometry_source and accepted_variant(filepath):
+                fingerprint, last_modified = file_validators(filepath)
+                return cached_response(None, 'application/json', f"{fingerprint}.json", last_modified,
+                                       source_path=filepath)
+            if encode_stream is None:
+                encode_stream, mimetype = stream_feature_collection, 'application/json'
+            features = iter_features(filepath)
+            if geometry_source:
+                geometry_path = layer_store.path_for(geometry_filename(geometry_source))
+                if not os.path.exists(geometry_path):
+                    return jsonify({'error': 'Geometry source not found'}), 404
+                features = join_geometry_stream(features, iter_features(geometry_path))
+            features = map(geojson_writer.quantize_feature, features)
+            return Response(encode_stream(features), mimetype=mimetype)
             
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        return jsonify(data)
+        try:
+            entry = layer_store.get(filename)
+        except FileNotFoundError:
+            return jsonify({'error': 'File not found'}), 404
+        
+        # Shared-geometry layers can be sent without geometry (join=0) so the
+        # client downloads the geometry store once for all of them
+        if request.args.get('join') == '0' and entry.attributes_body is not None:
+            return cached_response(
+                entry.attributes_body, 'application/json', f"{entry.fingerprint}.json", entry.last_modified,
+                compress=compressed_layer(filename, 'attributes_body', lambda e: e.attributes_body),
+                source_path=filepath)
+        if encode_stream is not None:
+            return Response(encode_stream(entry.data.get('features', [])), mimetype=mimetype)
+        
+        # Precompressed copies on disk lack the joined geometry of shared layers
+        return cached_response(
+            entry.body, 'application/json', f"{entry.fingerprint}.json", entry.last_modified,
+            compress=compressed_layer(filename, 'body', lambda e: e.body),
+            source_path=filepath if entry.attributes_body is None else None)
     except Exception as e:
         logger.error(f"Error loading GeoJSON: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/geometry/<source>')
+def get_geometry_store(source):
+    """Serve a shared geometry store referenced by attribute-only layers"""
+    try:
+        # Ensure source doesn't contain directory traversal
+        if '..' in source:
+            return jsonify({'error': 'Invalid geometry source'}), 400
+        
+        filename = geometry_filename(source)
+        try:
+            entry = layer_store.get(filename)
+        except FileNotFoundError:
+            return jsonify({'error': 'Geometry source not found'}), 404
+        
+        if wants_geobuf():
+            precomputed = current_geobuf(layer_store.path_for(filename))
+            if precomputed:
+                return geobuf_file_response(precomputed)
+            body = layer_store.derive(filename, 'geobuf', encode_stored_geobuf)
+            return cached_response(body, geobuf.GEOBUF_MIMETYPE, f"{entry.fingerprint}.geobuf", entry.last_modified)
+        
+        return cached_response(
+            entry.body, 'application/json', f"{entry.fingerprint}.json", entry.last_modified,
+            compress=compressed_layer(filename, 'body', lambda e: e.body),
+            source_path=layer_store.path_for(filename))
+    except Exception as e:
+        logger.error(f"Error loading geometry store: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/layer-style/<layer_id>')
 def get_layer_style(layer_id):
     """Return style information for a layer"""
@@ -135,20 +467,16 @@ def get_layer_style(layer_id):
         
         if not os.path.exists(style_path):
             # Return default styling if no specific style exists
-            return jsonify({
-                "type": "default",
-                "default_style": {
-                    "color": "#3388ff",
-                    "weight": 2,
-                    "opacity": 1,
-                    "fillOpacity": 0.2
-                }
-            })
+            return jsonify(DEFAULT_LAYER_STYLE)
             
-        with open(style_path, 'r', encoding='utf-8') as f:
-            style_data = json.load(f)
-            
-        return jsonify(style_data)
+        fingerprint, last_modified = file_validators(style_path)
+        with open(style_path, 'rb') as f:
+            style_data = f.read()
+        
+        return cached_response(
+            style_data, 'application/json', f"{fingerprint}.json", last_modified,
+            compress=lambda encoding: compression.compress(style_data, encoding),
+            source_path=style_path)
     except Exception as e:
         logger.error(f"Error loading layer style: {e}")
         return jsonify({'error': str(e)}), 500
@@ -161,73 +489,391 @@ def get_layer_properties(filename):
         if not filename.endswith('.geojson') or '..' in filename:
             return jsonify({'error': 'Invalid filename'}), 400
             
-        filepath = os.path.join(GEOJSON_DIR, filename)
-        
-        if not os.path.exists(filepath):
+        try:
+            schema = layer_store.derive(filename, 'schema', build_layer_schema)
+        except FileNotFoundError:
             return jsonify({'error': 'File not found'}), 404
-            
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        properties = set()
-        for feature in data.get('features', []):
-            if feature.get('properties'):
-                properties.update(feature['properties'].keys())
                 
-        return jsonify(list(properties))
+        return jsonify([prop['name'] for prop in schema['properties']])
     except Exception as e:
         logger.error(f"Error extracting properties: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/layers/<layer_id>/schema')
+def get_layer_schema(layer_id):
+    """Return the cached property schema and statistics for a layer"""
+    try:
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
+        try:
+            schema = layer_store.derive(f"{layer_id}.geojson", 'schema', build_layer_schema)
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        return Response(encode_json(schema), mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error building layer schema: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/layers/<layer_id>/features')
+def query_layer_features(layer_id):
+    """Return the features of a layer matching attribute predicates
+
+    Predicates are passed as min.<property>, max.<property>, eq.<property>
+    and contains.<property> query arguments and combined with AND.
+    """
+    try:
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
+        try:
+            predicates = parse_predicates(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        filename = f"{layer_id}.geojson"
+        gpkg_layer = geopackage_layer(filename)
+        if gpkg_layer is not None and gpkg_layer.covers(prop for _, prop, _ in predicates):
+            body = feature_collection_body(gpkg_layer.select(predicates), gpkg_layer.feature_count)
+            return Response(body, mimetype='application/json')
+        
+        try:
+            columnar = columnar_store.get(filename)
+            if columnar is not None and columnar.covers(prop for _, prop, _ in predicates):
+                # Filter the mapped columns; only matching features are looked up
+                matched = columnar.select(predicates)
+                features = layer_store.get(filename).data.get('features', []) if matched else []
+            else:
+                index = layer_store.derive(filename, 'attribute_index', build_attribute_index)
+                matched = index.select(predicates)
+                features = index.features
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        result = {
+            'type': 'FeatureCollection',
+            'features': [features[fid] for fid in matched],
+            'numberMatched': len(matched),
+            'totalFeatures': columnar.num_rows if columnar is not None else len(features)
+        }
+        return Response(encode_json(result), mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error querying layer features: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/layers/<layer_id>/features/<feature_id>')
+def get_layer_feature(layer_id, feature_id):
+    """Return one feature of a layer by its id (or its position, for features without one)"""
+    try:
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
+        filename = f"{layer_id}.geojson"
+        gpkg_layer = geopackage_layer(filename)
+        if gpkg_layer is not None:
+            text = gpkg_layer.feature(feature_id)
+            if text is None:
+                return jsonify({'error': 'Feature not found'}), 404
+            return Response(text.encode('utf-8'), mimetype='application/json')
+        
+        try:
+            rows = layer_store.derive(filename, 'feature_rows', build_feature_rows)
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        row = lookup_row(rows, feature_id)
+        if row is None:
+            return jsonify({'error': 'Feature not found'}), 404
+        feature = layer_store.get(filename).data['features'][row]
+        return Response(encode_json(feature), mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error looking up feature: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/layers/<layer_id>/classify')
+def classify_layer(layer_id):
+    """Return the class breaks of a numeric property and the class of every feature
+
+    Takes the field, method (one of classification.METHODS) and k (number
+    of classes) query arguments. Classes are listed in feature order along
+    with the feature ids; features without a numeric value get class -1.
+    Fields without any numeric value are rejected.
+    """
+    try:
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
+        field = request.args.get('field')
+        if not field:
+            return jsonify({'error': 'field is required'}), 400
+        method = request.args.get('method', DEFAULT_METHOD)
+        if method not in METHODS:
+            return jsonify({'error': f"method must be one of {', '.join(METHODS)}"}), 400
+        try:
+            k = int(request.args.get('k', DEFAULT_CLASSES))
+        except ValueError:
+            k = 0
+        if not 1 <= k <= MAX_CLASSES:
+            return jsonify({'error': f"k must be an integer between 1 and {MAX_CLASSES}"}), 400
+        
+        filename = f"{layer_id}.geojson"
+        try:
+            key = ('classify', field, method, k)
+            columnar = columnar_store.get(filename)
+            if columnar is not None and columnar.covers([field]):
+                numeric = not np.isnan(columnar.numeric(field)).all()
+            else:
+                columnar = None
+                # The cached column profile answers this without a pass over the features
+                column = layer_store.derive(filename, 'profile', build_layer_profile).columns.get(field)
+                numeric = column is not None and len(column.numbers) > 0
+            if not numeric:
+                return jsonify({'error': f"Field {field} has no numeric values"}), 400
+            if columnar is not None:
+                result = columnar.derive(key, lambda layer: build_columnar_classification(layer, field, method, k))
+            else:
+                result = layer_store.derive(
+                    filename, key, lambda entry: build_classification(entry, field, method, k))
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        return Response(encode_json({'layerId': layer_id, **result}), mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error classifying layer: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/layers/<layer_id>/bbox')
+def query_layer_bbox(layer_id):
+    """Return the features of a layer whose bounds intersect an extent
+
+    The extent is given as xmin, ymin, xmax and ymax query arguments in
+    lon/lat degrees.
+    """
+    try:
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
+        try:
+            xmin, ymin, xmax, ymax = (float(request.args[name]) for name in ('xmin', 'ymin', 'xmax', 'ymax'))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'xmin, ymin, xmax and ymax must be numbers'}), 400
+        if xmin > xmax or ymin > ymax:
+            return jsonify({'error': 'Invalid extent'}), 400
+        
+        filename = f"{layer_id}.geojson"
+        gpkg_layer = geopackage_layer(filename)
+        if gpkg_layer is not None:
+            body = feature_collection_body(gpkg_layer.bbox(xmin, ymin, xmax, ymax), gpkg_layer.feature_count)
+            return Response(body, mimetype='application/json')
+        
+        try:
+            entry = layer_store.get(filename)
+            index = layer_store.derive(filename, 'spatial_index', build_spatial_index)
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        features = entry.data.get('features', [])
+        matched = index.query(xmin, ymin, xmax, ymax)
+        result = {
+            'type': 'FeatureCollection',
+            'features': [features[fid] for fid in matched],
+            'numberMatched': len(matched),
+            'totalFeatures': len(features)
+        }
+        return Response(encode_json(result), mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error querying layer extent: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/identify')
+def identify_features():
+    """Return the features under a point, grouped by layer
+
+    Polygons are matched exactly; points and lines match within the optional
+    tolerance argument (degrees). The layers argument takes a comma-separated
+    list of layer IDs and defaults to every layer in the data directory.
+    """
+    try:
+        try:
+            lon = float(request.args['lon'])
+            lat = float(request.args['lat'])
+            tolerance = float(request.args.get('tolerance', 0))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'lon and lat must be numbers'}), 400
+        if tolerance < 0:
+            return jsonify({'error': 'tolerance must not be negative'}), 400
+        
+        if request.args.get('layers'):
+            layer_ids = [layer_id for layer_id in request.args['layers'].split(',') if layer_id]
+        else:
+            layer_ids = sorted(path.stem for path in Path(GEOJSON_DIR).glob('*.geojson'))
+        if any('..' in layer_id for layer_id in layer_ids):
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
+        results = []
+        for layer_id in layer_ids:
+            filename = f"{layer_id}.geojson"
+            try:
+                entry = layer_store.get(filename)
+                index = layer_store.derive(filename, 'spatial_index', build_spatial_index)
+            except FileNotFoundError:
+                return jsonify({'error': f'Layer not found: {layer_id}'}), 404
+            except ValueError as e:
+                # One malformed file should not break identify for the others
+                logger.warning(f"Skipping unreadable layer {layer_id} in identify: {e}")
+                continue
+            
+            features = entry.data.get('features', [])
+            candidates = index.query(lon - tolerance, lat - tolerance, lon + tolerance, lat + tolerance)
+            matched = [
+                features[fid] for fid in candidates
+                if geometry_contains_point(features[fid].get('geometry'), lon, lat, tolerance)
+            ]
+            if matched:
+                results.append({'layer': layer_id, 'features': matched})
+        
+        return Response(encode_json({'lon': lon, 'lat': lat, 'results': results}), mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error identifying features: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/tiles/<layer_id>/<int:z>/<int:x>/<int:y>.pbf')
+def get_vector_tile(layer_id, z, x, y):
+    """Return a Mapbox Vector Tile for a layer"""
+    try:
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            return jsonify({'error': 'Invalid tile coordinates'}), 400
+        
+        filename = f"{layer_id}.geojson"
+        try:
+            entry = layer_store.get(filename)
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        tile = tile_cache.get(layer_id, entry.fingerprint, z, x, y)
+        if tile is None:
+            index = layer_store.derive(filename, 'spatial_index', build_spatial_index)
+            tile = render_tile(layer_id, entry.data.get('features', []), index, z, x, y)
+            tile_cache.put(layer_id, entry.fingerprint, z, x, y, tile)
+        
+        return Response(tile, mimetype='application/vnd.mapbox-vector-tile')
+    except Exception as e:
+        logger.error(f"Error rendering vector tile: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/generate-report', methods=['POST'])
 def generate_report():
-    """Generate a report based on selected features"""
+    """Generate report aggregates for the selected features of a layer
+
+    Features are identified by featureIds: their GeoJSON id, or their
+    position in the layer for features without one.
+    """
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         layer_id = data.get('layerId')
-        selected_features = data.get('features', [])
+        feature_ids = data.get('featureIds')
+        if feature_ids is None:
+            # Older clients post the features themselves
+            feature_ids = [feature.get('id') for feature in data.get('features', []) if isinstance(feature, dict)]
         
-        if not layer_id or not selected_features:
+        if not layer_id or not feature_ids or not isinstance(feature_ids, list):
             return jsonify({'error': 'Missing required data'}), 400
         
-        # Get the layer name from the layers list if available
-        layer_name = layer_id.replace('_', ' ').title()
+        # Ensure layer_id doesn't contain directory traversal
+        if '..' in layer_id:
+            return jsonify({'error': 'Invalid layer ID'}), 400
+        
         try:
-            index_path = os.path.join(GEOJSON_DIR, 'layers.json')
-            if os.path.exists(index_path):
-                with open(index_path, 'r', encoding='utf-8') as f:
-                    layers = json.load(f)
-                    for layer in layers:
-                        if layer.get('id') == layer_id and layer.get('name'):
-                            layer_name = layer['name']
-                            break
-        except Exception as e:
-            logger.error(f"Error getting layer name: {e}")
-            
-        # Process the features and generate report data
+            filename = f"{layer_id}.geojson"
+            columnar = columnar_store.get(filename)
+            # Reports list every property, so the copy must hold them all
+            if columnar is not None and not columnar.untyped:
+                columns = columnar.derive('report_columns', build_columnar_layer_columns)
+            else:
+                columns = layer_store.derive(filename, 'report_columns', build_layer_columns)
+        except FileNotFoundError:
+            return jsonify({'error': 'Layer not found'}), 404
+        
+        rows, missing = columns.resolve(feature_ids)
+        if not len(rows):
+            return jsonify({'error': 'None of the selected features were found'}), 404
+        
+        # Get the layer name from the layer index if available
+        layer_name = layer_id.replace('_', ' ').title()
+        for layer in layer_catalog.layers():
+            if isinstance(layer, dict) and layer.get('id') == layer_id and layer.get('name'):
+                layer_name = layer['name']
+                break
+        
         report_data = {
             'layerName': layer_name,
-            'featureCount': len(selected_features),
-            'features': selected_features,
+            'featureCount': len(rows),
+            'missingIds': missing,
+            'features': [
+                {'id': columns.ids[row], 'properties': properties}
+                for row, properties in zip(rows, columns.properties(rows))
+            ],
             'mapTitle': MAP_INFO.get('title', 'Homs Map'),
             'mapDescription': MAP_INFO.get('description', 'Map of Homs, Syria')
         }
+        report_data.update(summarize(columns, rows))
         
-        return jsonify(report_data)
+        return Response(encode_json(report_data), mimetype='application/json')
     except Exception as e:
         logger.error(f"Error generating report: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/extract-mpk', methods=['POST'])
 def api_extract_mpk():
-    """API endpoint to trigger MPK extraction"""
+    """API endpoint to start MPK extraction as a background job"""
     try:
-        from extract_mpk import main as extract_main
-        extract_main()
-        return jsonify({"status": "success", "message": "MPK file extracted successfully"})
+        def extract(progress):
+            from extract_mpk import main as extract_main
+            layers = extract_main(progress=progress)
+            if layers is None:
+                raise RuntimeError("MPK extraction failed")
+            return {'layerCount': len(layers)}
+        
+        try:
+            job = job_runner.submit('extract-mpk', extract)
+        except JobConflictError as e:
+            return jsonify({"status": "error", "message": str(e), "jobId": e.job.id}), 409
+        
+        return jsonify({
+            "status": "accepted",
+            "message": "MPK extraction started",
+            "jobId": job.id,
+            "statusUrl": f"/api/jobs/{job.id}"
+        }), 202
     except Exception as e:
-        logger.error(f"Error extracting MPK: {e}")
+        logger.error(f"Error starting MPK extraction: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Return the status and per-step progress of a background job"""
+    try:
+        job = job_runner.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job.to_dict())
+    except Exception as e:
+        logger.error(f"Error reading job status: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def get_metrics():
+    """Return request, cache and parse metrics in the Prometheus text format"""
+    return Response(request_metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
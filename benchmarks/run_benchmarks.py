@@ -0,0 +1,348 @@
+"""
+Benchmark the layer endpoints and ETL steps on synthetic data.
+
+For each scale a workspace is set up with a copy of the app and a
+synthetic neighborhood layer (see synthetic_data.py), and every case runs
+in a fresh process of its own, so peak RSS belongs to that case alone:
+
+    create_thematic_layers   create_thematic_layers.main(), forced rebuild
+    extract_style_info       style of the neighborhood layer as the extractors
+                             infer it (needs geopandas, else skipped)
+    api_geojson              GET /api/geojson for the source and a thematic layer
+    api_layer_properties     GET /api/layer-properties for the source layer
+    api_generate_report      POST /api/generate-report for every 10th feature
+
+Each case records the wall time of its first (cold) run and the median of
+the repeated warm runs, the peak RSS of its process, and the bytes the
+endpoints send (plain and gzip-encoded). Results are saved as JSON; pass
+--compare with an earlier result to print the ratios against it.
+
+    python benchmarks/run_benchmarks.py --scales 1x,100x
+    python benchmarks/run_benchmarks.py --scales 10000x --repeat 3 --compare old.json
+"""
+import os
+import sys
+import json
+import time
+import gzip
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic_data  # noqa: E402
+
+# Scales run by default; 10000x writes several hundred MB and is opt-in
+DEFAULT_SCALES = ['1x', '100x']
+
+# Source layer, under the name create_thematic_layers reads
+SOURCE_LAYER = 'nieghborhood.geojson'
+
+# Thematic layer served and reported on by the endpoint cases
+THEMATIC_LAYER = 'housing'
+
+# Every n-th feature is selected for /api/generate-report
+REPORT_STRIDE = 10
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+
+def _rss_bytes():
+    # Peak RSS of this process so far (ru_maxrss is in KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _timed(run, repeat):
+    # Wall time of the first run and of the repeated runs after it
+    start = time.perf_counter()
+    result = run()
+    cold = time.perf_counter() - start
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        warm.append(time.perf_counter() - start)
+    return result, {
+        'cold': cold,
+        'warm_median': statistics.median(warm) if warm else None,
+        'warm_min': min(warm) if warm else None,
+        'repeat': repeat,
+    }
+
+
+def _output_bytes(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def case_create_thematic_layers(repeat):
+    """Build the thematic layers and their copies from the synthetic source"""
+    # Every run rebuilds, whatever the build manifest says
+    os.environ['FORCE_REBUILD'] = '1'
+    import create_thematic_layers
+
+    _, wall = _timed(create_thematic_layers.main, repeat)
+    return {'wall_seconds': wall, 'output_bytes': _output_bytes(create_thematic_layers.OUTPUT_DIR)}
+
+
+def case_extract_style_info(repeat):
+    """Infer the style of the source layer as extract_additional_layers does"""
+    try:
+        import geopandas as gpd
+    except ImportError:
+        return {'skipped': 'geopandas is not installed'}
+    import extract_additional_layers
+
+    gdf = gpd.read_file(os.path.join('static', 'data', SOURCE_LAYER))
+    _, wall = _timed(lambda: extract_additional_layers.extract_style_info('neighborhood', gdf), repeat)
+    return {'wall_seconds': wall, 'features': len(gdf)}
+
+
+def _app_client():
+    from app import app
+    return app.test_client()
+
+
+def _measure_requests(requests, repeat):
+    # Time each request and record the size of its body, plain and gzip-encoded
+    client = _app_client()
+    results = {}
+    for name, (method, url, payload) in requests.items():
+        def run():
+            response = client.open(url, method=method, json=payload)
+            body = response.get_data()
+            response.close()
+            return response.status_code, body
+
+        (status, body), wall = _timed(run, repeat)
+        if status != 200:
+            raise RuntimeError(f"{method} {url} returned {status}: {body[:200]!r}")
+        gzip_headers = {'Accept-Encoding': 'gzip'}
+        response = client.open(url, method=method, json=payload, headers=gzip_headers)
+        encoded = response.get_data()
+        if response.headers.get('Content-Encoding') != 'gzip':
+            # The app sent it uncompressed; this is what a proxy would send
+            encoded = gzip.compress(encoded, compresslevel=6)
+        response.close()
+        results[name] = {
+            'wall_seconds': wall,
+            'bytes_on_wire': {'identity': len(body), 'gzip': len(encoded)},
+        }
+    return {'requests': results}
+
+
+def case_api_geojson(repeat):
+    """Serve the source layer and a thematic layer joined to the shared geometry"""
+    return _measure_requests({
+        'source': ('GET', f'/api/geojson/{SOURCE_LAYER}', None),
+        'thematic': ('GET', f'/api/geojson/{THEMATIC_LAYER}.geojson', None),
+    }, repeat)
+
+
+def case_api_layer_properties(repeat):
+    """List the properties of the source layer"""
+    return _measure_requests({
+        'source': ('GET', f'/api/layer-properties/{SOURCE_LAYER}', None),
+    }, repeat)
+
+
+def case_api_generate_report(repeat):
+    """Report on every REPORT_STRIDE-th feature of the thematic layer"""
+    # Thematic features are numbered by their position in the source layer
+    with open(os.path.join('static', 'data', SOURCE_LAYER), 'rb') as f:
+        count = len(json.load(f)['features'])
+    payload = {'layerId': THEMATIC_LAYER, 'featureIds': list(range(0, count, REPORT_STRIDE))}
+    return _measure_requests({
+        'selection': ('POST', '/api/generate-report', payload),
+    }, repeat)
+
+
+# Cases in the order they run; the ETL case first, as the others read its output
+CASES = {
+    'create_thematic_layers': case_create_thematic_layers,
+    'extract_style_info': case_extract_style_info,
+    'api_geojson': case_api_geojson,
+    'api_layer_properties': case_api_layer_properties,
+    'api_generate_report': case_api_generate_report,
+}
+
+
+def run_case(name, workspace, repeat):
+    """Run one case inside a workspace (in the current process) and return its result"""
+    os.chdir(workspace)
+    sys.path.insert(0, workspace)
+    # Per-request and per-file logging would be timed along with the work
+    logging.disable(logging.INFO)
+    baseline = _rss_bytes()
+    result = CASES[name](repeat)
+    result['peak_rss_bytes'] = _rss_bytes()
+    result['baseline_rss_bytes'] = baseline
+    return result
+
+
+def prepare_workspace(workspace, scale, seed=0):
+    """Copy the app into a workspace and write the synthetic source layer"""
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+    os.makedirs(workspace)
+    for name in os.listdir(REPO_DIR):
+        if name.endswith('.py'):
+            shutil.copy2(os.path.join(REPO_DIR, name), workspace)
+    shutil.copytree(os.path.join(REPO_DIR, 'templates'), os.path.join(workspace, 'templates'))
+    data_dir = os.path.join(workspace, 'static', 'data')
+    os.makedirs(data_dir)
+    os.makedirs(os.path.join(workspace, 'static', 'styles'))
+    map_info = os.path.join(REPO_DIR, 'static', 'data', 'map_info.json')
+    if os.path.exists(map_info):
+        shutil.copy2(map_info, data_dir)
+    return synthetic_data.write_neighborhoods(scale, os.path.join(data_dir, SOURCE_LAYER), seed)
+
+
+def _spawn_case(name, workspace, repeat):
+    # A fresh interpreter per case keeps imports, caches and peak RSS separate
+    command = [sys.executable, os.path.abspath(__file__), '--case', name,
+               '--workspace', workspace, '--repeat', str(repeat)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else
+                f"exit status {completed.returncode}"}
+    # The result is the last line; scripts may print before it
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales, repeat, workdir, seed=0, keep_workspace=False):
+    """Run every case at every scale and return the results"""
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'seed': seed,
+        'scales': {},
+    }
+    for scale in scales:
+        workspace = os.path.join(workdir, scale)
+        print(f"[{scale}] writing synthetic layer...", file=sys.stderr)
+        start = time.perf_counter()
+        features = prepare_workspace(workspace, scale, seed)
+        source_bytes = os.path.getsize(os.path.join(workspace, 'static', 'data', SOURCE_LAYER))
+        print(f"[{scale}] {features} features, {source_bytes} bytes in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+        cases = {}
+        for name in CASES:
+            print(f"[{scale}] {name}...", file=sys.stderr)
+            cases[name] = _spawn_case(name, workspace, repeat)
+            if 'error' in cases[name]:
+                print(f"[{scale}] {name} failed: {cases[name]['error']}", file=sys.stderr)
+        results['scales'][scale] = {'features': features, 'source_bytes': source_bytes, 'cases': cases}
+        if not keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+
+def _metrics(case):
+    # Flatten a case result into metric name -> value
+    metrics = {}
+    runs = case.get('requests', {'': case})
+    for request, run in runs.items():
+        prefix = f"{request}." if request else ''
+        wall = run.get('wall_seconds') or {}
+        for key in ('cold', 'warm_median'):
+            if wall.get(key) is not None:
+                metrics[f"{prefix}{key}_s"] = wall[key]
+        for encoding, size in (run.get('bytes_on_wire') or {}).items():
+            metrics[f"{prefix}{encoding}_bytes"] = size
+    if 'peak_rss_bytes' in case:
+        metrics['peak_rss_bytes'] = case['peak_rss_bytes']
+    return metrics
+
+
+def compare(old, new):
+    """Print new / old for every metric both results share"""
+    for scale, scale_result in new['scales'].items():
+        old_scale = old.get('scales', {}).get(scale)
+        if not old_scale:
+            continue
+        print(f"\n{scale} ({scale_result['features']} features), new / old:")
+        for name, case in scale_result['cases'].items():
+            old_metrics = _metrics(old_scale['cases'].get(name, {}))
+            for metric, value in _metrics(case).items():
+                if old_metrics.get(metric):
+                    print(f"  {name:24} {metric:28} {value / old_metrics[metric]:6.2f}x")
+
+
+def _summary(results):
+    for scale, scale_result in results['scales'].items():
+        print(f"\n{scale} ({scale_result['features']} features, {scale_result['source_bytes']} bytes)")
+        for name, case in scale_result['cases'].items():
+            if 'skipped' in case or 'error' in case:
+                print(f"  {name:24} {case.get('skipped') or 'error: ' + case['error']}")
+                continue
+            for metric, value in _metrics(case).items():
+                shown = f"{value * 1000:10.1f} ms" if metric.endswith('_s') else f"{value:13,d}"
+                print(f"  {name:24} {metric:28} {shown}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the layer endpoints and ETL steps on synthetic data")
+    parser.add_argument('--scales', default=','.join(DEFAULT_SCALES),
+                        help=f"comma-separated scales, from {', '.join(synthetic_data.SCALES)} "
+                             f"(default {','.join(DEFAULT_SCALES)})")
+    parser.add_argument('--repeat', type=int, default=5, help="warm runs per case (default 5)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="result file (default benchmarks/results/benchmark-<time>.json)")
+    parser.add_argument('--workdir', help="directory for the workspaces (default a temporary directory)")
+    parser.add_argument('--keep-workspace', action='store_true', help="keep the workspaces afterwards")
+    parser.add_argument('--compare', metavar='RESULT', help="earlier result file to compare against")
+    # Used by the runner to run a single case in a child process
+    parser.add_argument('--case', choices=list(CASES), help=argparse.SUPPRESS)
+    parser.add_argument('--workspace', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.workspace, args.repeat)))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='layer-benchmarks-')
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    results = run_benchmarks(scales, args.repeat, workdir, args.seed, args.keep_workspace)
+
+    output = args.output
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(RESULTS_DIR, f"benchmark-{stamp}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    _summary(results)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), results)
+    if not args.workdir and not args.keep_workspace:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Synthetic neighborhood layers at a multiple of the Homs data volume.
+
+The generated layer has the schema of the neighborhood layer the thematic
+layers are built from (ADM4 names, the power, SMW, waterSupply, housing,
+telecom and swage indicators with their costs, OverAllIndicator and
+Budget), with SCALE x 58 features tiling the Homs extent. Larger scales
+stand in for parcels rather than neighborhoods, so their polygons get
+fewer vertices. Values come from a seeded generator, so every run at a
+scale produces the same file.
+
+    python benchmarks/synthetic_data.py 100x static/data/nieghborhood.geojson
+"""
+import os
+import sys
+import math
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geojson_writer import write_features  # noqa: E402
+
+# Scale name -> multiple of the real neighborhood count
+SCALES = {'1x': 1, '100x': 100, '10000x': 10000}
+
+# Neighborhoods in the real layer
+BASE_FEATURES = 58
+
+# Extent of the Homs map (see map_info.json)
+EXTENT = (36.5880878006287, 34.6799548134312, 36.7711339108812, 34.7896548639074)
+
+# Indicator property -> cost property, as in the neighborhood layer
+INDICATORS = {
+    'power': 'powerCost',
+    'SMW': 'SMWCost',
+    'waterSupply': 'waterCost',
+    'housing': 'housingCost',
+    'telecom': 'telecomCost',
+    'swage': 'swageCost',
+}
+
+ADM4_TYPES = ['Residential Area', 'Informal Settlement', 'Commercial Area', 'Industrial Area']
+
+# Features generated per batch
+BATCH_SIZE = 10000
+
+
+def scale_factor(scale):
+    """Return the multiple of a scale name (1x, 100x, ...) or number"""
+    return SCALES[scale] if scale in SCALES else int(str(scale).rstrip('x'))
+
+
+def vertex_count(factor):
+    """Vertices per polygon: about 128 for neighborhoods, down to 8 for parcels"""
+    return max(8, int(128 / math.sqrt(factor)))
+
+
+def _rings(rng, rows, cols, cells, vertices):
+    # One jittered star-shaped ring per grid cell, closed
+    xmin, ymin, xmax, ymax = EXTENT
+    width, height = (xmax - xmin) / cols, (ymax - ymin) / rows
+    cx = xmin + (cells % cols + 0.5) * width
+    cy = ymin + (cells // cols + 0.5) * height
+    # Counter-clockwise, as GeoJSON exterior rings
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radius = 0.45 * (0.8 + 0.2 * rng.random((len(cells), vertices)))
+    x = cx[:, None] + radius * width * np.cos(angles)
+    y = cy[:, None] + radius * height * np.sin(angles)
+    rings = np.stack([x, y], axis=2)
+    return np.concatenate([rings, rings[:, :1]], axis=1)
+
+
+def _areas(rings):
+    x, y = rings[:, :, 0], rings[:, :, 1]
+    return np.abs(np.sum(x[:, :-1] * y[:, 1:] - x[:, 1:] * y[:, :-1], axis=1)) / 2
+
+
+def _lengths(rings):
+    return np.sum(np.hypot(*np.diff(rings, axis=1).transpose(2, 0, 1)), axis=1)
+
+
+def iter_neighborhoods(factor, seed=0):
+    """Yield the features of a synthetic neighborhood layer at a scale factor"""
+    count = BASE_FEATURES * factor
+    cols = math.ceil(math.sqrt(count * 1.6))
+    rows = math.ceil(count / cols)
+    vertices = vertex_count(factor)
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, BATCH_SIZE):
+        cells = np.arange(start, min(start + BATCH_SIZE, count))
+        rings = _rings(rng, rows, cols, cells, vertices)
+        areas, lengths = _areas(rings), _lengths(rings)
+        indicators = {name: rng.integers(0, 101, len(cells)).astype(float) for name in INDICATORS}
+        costs = {cost: rng.integers(1000, 100000, len(cells)) for cost in INDICATORS.values()}
+        overall = np.mean(list(indicators.values()), axis=0)
+        budget = np.sum(list(costs.values()), axis=0)
+        types = rng.integers(0, len(ADM4_TYPES), len(cells))
+        coordinates = rings.tolist()
+        for row, cell in enumerate(cells.tolist()):
+            properties = {
+                "ADM4_NAME": f"Neighborhood {cell + 1}",
+                "ADM4_NAME_": f"حي {cell + 1}",
+                "ADM4_TYPE": ADM4_TYPES[types[row]],
+                "SOURCE": "Synthetic",
+                "Urban_Type": "City",
+                "Gov_AR": "حمص",
+                "Gov_EN": "Homs",
+                "Gov_ID": "SY08",
+                "District_A": "مركز حمص",
+                "District_E": "Homs",
+                "County_AR": "مركز حمص",
+                "County_EN": "Homs",
+                "District_I": "SY0804",
+                "County_ID": f"SY0804{cell % 100:02d}",
+                "Shape_Length": float(lengths[row]),
+                "Shape_Area": float(areas[row]),
+            }
+            for name in INDICATORS:
+                properties[name] = float(indicators[name][row])
+            for cost in INDICATORS.values():
+                properties[cost] = int(costs[cost][row])
+            properties["OverAllIndicator"] = round(float(overall[row]), 6)
+            properties["Budget"] = int(budget[row])
+            yield {
+                "type": "Feature",
+                "properties": properties,
+                "geometry": {"type": "MultiPolygon", "coordinates": [[coordinates[row]]]}
+            }
+
+
+def write_neighborhoods(scale, path, seed=0):
+    """Write a synthetic neighborhood layer and return its feature count"""
+    return write_features(iter_neighborhoods(scale_factor(scale), seed), path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic neighborhood layer")
+    parser.add_argument("scale", help=f"one of {', '.join(SCALES)} or a multiple such as 10x")
+    parser.add_argument("output", help="GeoJSON file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    count = write_neighborhoods(args.scale, args.output, args.seed)
+    print(f"Wrote {count} features to {args.output}")
@@ -0,0 +1,143 @@
+"""
+Build manifest for the ETL scripts.
+
+Every output (a converted layer with its style and simplified levels, a
+thematic layer, ...) is recorded with a content hash of each source it was
+built from and a hash of the settings used, including the source code of
+the modules that produced it. On the next run an output whose sources and
+settings hash the same, and whose files all still exist, is skipped.
+
+Pass --force to a script (or set FORCE_REBUILD=1) to rebuild everything.
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Manifest location, shared by all ETL scripts
+MANIFEST_PATH = os.environ.get("BUILD_MANIFEST", "static/data/.build_manifest.json")
+
+# Bytes read at a time when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_directory(path, memo=None):
+    """Return a SHA-256 hex digest over the names and contents of a directory tree
+
+    Used for file geodatabases, which are directories. Pass a memo dict to
+    hash each directory once per build (see BuildManifest.hash_gdb_source),
+    since all layers of a geodatabase share its digest.
+    """
+    if memo is not None and path in memo:
+        return memo[path]
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode('utf-8') + b'\0')
+            digest.update(hash_file(file_path).encode('ascii'))
+    if memo is not None:
+        memo[path] = digest.hexdigest()
+    return digest.hexdigest()
+
+
+def hash_gdb_source(gdb_path, layer_name, memo=None):
+    """Return the source hash of a layer read from a file geodatabase
+
+    The whole geodatabase is hashed together with the layer name, as its
+    files are not split by layer: an edit to any layer makes every layer
+    read from it stale.
+    """
+    return hash_settings({'gdb': hash_directory(os.path.realpath(gdb_path), memo), 'layer': layer_name})
+
+
+def hash_settings(settings):
+    """Return a stable SHA-256 hex digest of a JSON-serialisable settings value"""
+    encoded = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def hash_code(*modules):
+    """Return a hash of the source files of modules (or paths), so code changes rebuild"""
+    paths = [module if isinstance(module, str) else module.__file__ for module in modules]
+    return hash_settings({os.path.basename(path): hash_file(path) for path in paths})
+
+
+class BuildManifest:
+    """Records the inputs of each build output and decides what is stale"""
+
+    def __init__(self, path=MANIFEST_PATH, force=None):
+        self.path = path
+        if force is None:
+            force = '--force' in sys.argv or os.environ.get('FORCE_REBUILD') == '1'
+        self.force = force
+        self.outputs = self._read()
+        self._updated = {}
+        # Directory digests of this build; a new manifest hashes them afresh,
+        # so a long-lived process sees geodatabases edited between builds
+        self._directory_hashes = {}
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('outputs', {})
+        except FileNotFoundError:
+            return {}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable build manifest {self.path}: {e}")
+            return {}
+
+    def is_fresh(self, key, sources, settings):
+        """Return True if output key was built from these sources and settings
+
+        sources maps source names to content hashes; settings is a hash
+        from hash_settings(). The output's recorded files must still exist.
+        """
+        if self.force:
+            return False
+        record = self.outputs.get(key)
+        if not record or record.get('sources') != sources or record.get('settings') != settings:
+            return False
+        return all(os.path.exists(path) for path in record.get('files', []))
+
+    def hash_gdb_source(self, gdb_path, layer_name):
+        """Return the source hash of a layer read from a file geodatabase, hashing each geodatabase once"""
+        return hash_gdb_source(gdb_path, layer_name, self._directory_hashes)
+
+    def info(self, key):
+        """Return the metadata stored with an output (e.g. its layer index entry)"""
+        return self.outputs.get(key, {}).get('info')
+
+    def record(self, key, sources, settings, files, info=None):
+        """Record a freshly built output"""
+        record = {'sources': sources, 'settings': settings, 'files': sorted(files), 'info': info}
+        self.outputs[key] = record
+        self._updated[key] = record
+
+    def save(self):
+        """Write the manifest, merging with outputs recorded by other scripts meanwhile"""
+        if not self._updated:
+            return
+        outputs = self._read()
+        outputs.update(self._updated)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'outputs': outputs}, f, indent=2, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.outputs = outputs
+        self._updated = {}
+        logger.info(f"Build manifest updated: {self.path}")
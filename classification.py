@@ -0,0 +1,189 @@
+"""
+Classification of numeric layer properties into classes for thematic maps.
+
+Breaks are computed with one of METHODS and values are assigned to classes
+with a vectorized bin search. Every class is closed on its upper break, so
+a value equal to a break belongs to the lower class. The web app caches
+results per layer version, field, method and class count (see
+LayerStore.derive), reading the layer's columnar copy when it has a
+current one; the ETL scripts use the same engine for their styles.
+"""
+import numpy as np
+
+from layer_query import is_number
+
+METHODS = ('equal_interval', 'quantile', 'jenks', 'std_dev')
+
+DEFAULT_METHOD = 'equal_interval'
+DEFAULT_CLASSES = 5
+MAX_CLASSES = 12
+
+
+def equal_interval(values, k):
+    """Breaks splitting the value range into k classes of equal width"""
+    min_value, max_value = values[0], values[-1]
+    range_value = max_value - min_value
+    return [min_value + (range_value * i / k) for i in range(k + 1)]
+
+
+def quantile(values, k):
+    """Breaks putting (about) the same number of values in each class"""
+    return list(np.quantile(values, np.linspace(0, 1, k + 1)))
+
+
+def std_dev(values, k):
+    """Breaks one standard deviation wide, centred on the mean"""
+    mean, sigma = values.mean(), values.std()
+    inner = mean + sigma * (np.arange(1, k) - k / 2)
+    inner = np.clip(inner, values[0], values[-1])
+    return [values[0]] + list(inner) + [values[-1]]
+
+
+def jenks(values, k):
+    """Natural breaks (Fisher-Jenks): minimise the within-class sum of squares
+
+    Optimal classes of sorted data are found by dynamic programming over
+    the class count. The best split point is monotone in the class end, so
+    each level is solved by divide and conquer in O(n log n), for
+    O(k n log n) overall instead of O(k n^2).
+    """
+    n = len(values)
+    k = min(k, n)
+    # Prefix sums give the sum of squared deviations of any run in O(1);
+    # centring first keeps them from losing precision
+    centred = values - values.mean()
+    sums = np.concatenate(([0.0], np.cumsum(centred)))
+    squares = np.concatenate(([0.0], np.cumsum(centred * centred)))
+
+    def ssd(starts, end):
+        # Sum of squared deviations of values[start:end] for each start
+        count = end - starts
+        total = sums[end] - sums[starts]
+        return squares[end] - squares[starts] - total * total / count
+
+    # cost[j] = best cost of splitting values[:j] into the current number of classes
+    ends = np.arange(n + 1)
+    cost = np.full(n + 1, np.inf)
+    cost[1:] = ssd(np.zeros(n, dtype=np.intp), ends[1:])
+    split = [np.zeros(n + 1, dtype=np.intp)]
+
+    for classes in range(2, k + 1):
+        previous = cost
+        cost = np.full(n + 1, np.inf)
+        best = np.zeros(n + 1, dtype=np.intp)
+        # Ranges of class ends still to solve with the range of splits
+        # allowed for them; all ranges of one recursion depth are solved
+        # in a single vectorized pass
+        low = np.array([classes])
+        high = np.array([n])
+        split_low = np.array([classes - 1])
+        split_high = np.array([n - 1])
+        while len(low):
+            mid = (low + high) // 2
+            lengths = np.minimum(mid - 1, split_high) - split_low + 1
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            total = int(lengths.sum())
+            positions = np.arange(total)
+            starts = np.repeat(split_low - offsets, lengths) + positions
+            candidates = previous[starts] + ssd(starts, np.repeat(mid, lengths))
+            # First position of the minimum of each range
+            minimum = np.minimum.reduceat(candidates, offsets)
+            first = np.where(candidates == np.repeat(minimum, lengths), positions, total)
+            choice = starts[np.minimum.reduceat(first, offsets)]
+            cost[mid] = minimum
+            best[mid] = choice
+
+            low, high, split_low, split_high = (
+                np.concatenate(pair) for pair in (
+                    (low, mid + 1), (mid - 1, high), (split_low, choice), (choice, split_high)))
+            keep = low <= high
+            low, high, split_low, split_high = low[keep], high[keep], split_low[keep], split_high[keep]
+        split.append(best)
+
+    # Walk the split points back from the end
+    uppers = []
+    end = n
+    for classes in range(k, 0, -1):
+        uppers.append(values[end - 1])
+        end = split[classes - 1][end]
+    return [values[0]] + uppers[::-1]
+
+
+_BREAKS = {
+    'equal_interval': equal_interval,
+    'quantile': quantile,
+    'jenks': jenks,
+    'std_dev': std_dev,
+}
+
+
+def compute_breaks(values, method=DEFAULT_METHOD, k=DEFAULT_CLASSES):
+    """Return the k + 1 class breaks of the non-missing values
+
+    Raises ValueError for an unknown method or class count.
+    """
+    if method not in _BREAKS:
+        raise ValueError(f"Unknown classification method: {method}")
+    if not 1 <= k <= MAX_CLASSES:
+        raise ValueError(f"Number of classes must be between 1 and {MAX_CLASSES}")
+    values = np.sort(values[~np.isnan(values)])
+    if not len(values):
+        return []
+    return [float(b) for b in _BREAKS[method](values, k)]
+
+
+def assign_classes(values, breaks):
+    """Return the class index of each value (-1 for missing values)"""
+    k = len(breaks) - 1
+    if k < 1:
+        return np.full(len(values), -1, dtype=np.intp)
+    # The first class whose upper break is >= the value
+    classes = np.searchsorted(np.asarray(breaks[1:]), values, side='left')
+    classes = np.minimum(classes, k - 1)
+    classes[np.isnan(values)] = -1
+    return classes
+
+
+def classify(values, method=DEFAULT_METHOD, k=DEFAULT_CLASSES):
+    """Classify a column of values, returning breaks, class counts and classes"""
+    breaks = compute_breaks(values, method, k)
+    classes = assign_classes(values, breaks)
+    counts = np.bincount(classes[classes >= 0], minlength=max(len(breaks) - 1, 0))
+    return {
+        'method': method,
+        'k': len(breaks) - 1 if breaks else 0,
+        'breaks': breaks,
+        'counts': [int(c) for c in counts],
+        'classes': [int(c) for c in classes],
+    }
+
+
+def property_column(features, field):
+    """Return a float column of a property of features (NaN where not numeric)"""
+    values = np.full(len(features), np.nan)
+    for row, feature in enumerate(features):
+        value = (feature.get('properties') or {}).get(field)
+        if is_number(value):
+            values[row] = float(value)
+    return values
+
+
+def build_classification(entry, field, method, k):
+    """Classify a property of a LayerStore entry, with the feature id of each class"""
+    features = entry.data.get('features', [])
+    result = classify(property_column(features, field), method, k)
+    result['field'] = field
+    # Features without an id are addressed by position, as in reports
+    result['featureIds'] = [
+        feature.get('id') if feature.get('id') is not None else position
+        for position, feature in enumerate(features)
+    ]
+    return result
+
+
+def build_columnar_classification(layer, field, method, k):
+    """Classify a property of a mapped columnar layer (see columnar.ColumnarStore)"""
+    result = classify(layer.numeric(field), method, k)
+    result['field'] = field
+    result['featureIds'] = layer.feature_ids()
+    return result
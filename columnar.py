@@ -0,0 +1,312 @@
+"""
+Columnar (Arrow IPC) copies of layer attributes.
+
+The ETL scripts write a .arrow file next to each layer's GeoJSON, holding
+one column per property plus the feature id and WKB geometry. The web app
+memory-maps the file, so attribute filtering, classification and report
+aggregation run as vectorized operations over the mapped columns instead
+of walks over parsed GeoJSON. The copy is only used while it is at least
+as new as the GeoJSON; pyarrow is optional, and without it (or without a
+current copy) the app works from the GeoJSON as before.
+
+Properties whose values cannot share one Arrow type (mixed numbers and
+text, nested objects) are left out of the table and listed in its schema
+metadata, so callers know to fall back to the GeoJSON for them.
+"""
+import os
+import json
+import math
+import logging
+import threading
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+logger = logging.getLogger(__name__)
+
+# Reserved column names; properties are stored under their own names
+ID_COLUMN = '__id'
+GEOMETRY_COLUMN = '__geometry'
+
+# Schema metadata key listing the properties left out of the table
+UNTYPED_KEY = b'untyped_properties'
+
+# Schema metadata key set when feature ids are stored JSON-encoded
+IDS_JSON_KEY = b'ids_json'
+
+# Largest magnitude at which every integer is exactly representable as a float
+_MAX_EXACT_FLOAT = 2 ** 53
+
+
+def available():
+    """Return True if this process can read and write columnar copies"""
+    return pa is not None
+
+
+def arrow_path(geojson_path):
+    """Return the path of the columnar copy of a .geojson file"""
+    return f"{os.path.splitext(geojson_path)[0]}.arrow"
+
+
+def columnar_paths(geojson_path):
+    """Return the paths write_arrow writes for a .geojson file"""
+    return [arrow_path(geojson_path)] if pa is not None else []
+
+
+def _typed_array(values):
+    # One Arrow array for a property, or None if its values do not share a
+    # scalar type
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return None
+    kind = array.type
+    if not (pa.types.is_null(kind) or pa.types.is_boolean(kind) or pa.types.is_integer(kind)
+            or pa.types.is_floating(kind) or pa.types.is_string(kind)):
+        return None
+    return array
+
+
+def _wkb(geometry):
+    if not geometry:
+        return None
+    # Shapely is only needed for layers that carry their own geometry
+    from shapely.geometry import shape
+    return shape(geometry).wkb
+
+
+def build_table(geojson):
+    """Convert a GeoJSON FeatureCollection to an Arrow table"""
+    features = geojson.get('features', [])
+    properties = [feature.get('properties') or {} for feature in features]
+    names = list(dict.fromkeys(name for props in properties for name in props))
+
+    # Features are addressed by their id, or by position when they have none
+    ids = [feature.get('id') if feature.get('id') is not None else position
+           for position, feature in enumerate(features)]
+    columns = {ID_COLUMN: _typed_array(ids)}
+    ids_json = columns[ID_COLUMN] is None
+    if ids_json:
+        # Mixed numeric and text ids are kept as JSON to round-trip exactly
+        columns[ID_COLUMN] = pa.array([json.dumps(fid) for fid in ids])
+
+    untyped = []
+    for name in names:
+        if name in (ID_COLUMN, GEOMETRY_COLUMN):
+            untyped.append(name)
+            continue
+        array = _typed_array([props.get(name) for props in properties])
+        if array is None:
+            untyped.append(name)
+        else:
+            columns[name] = array
+    columns[GEOMETRY_COLUMN] = pa.array([_wkb(feature.get('geometry')) for feature in features],
+                                        type=pa.binary())
+
+    metadata = {UNTYPED_KEY: json.dumps(untyped).encode('utf-8')}
+    if ids_json:
+        metadata[IDS_JSON_KEY] = b'1'
+    return pa.table(columns).replace_schema_metadata(metadata)
+
+
+def write_arrow(geojson, geojson_path):
+    """Write the columnar copy of a GeoJSON file next to it and return its path
+
+    Returns None when pyarrow is not installed.
+    """
+    if pa is None:
+        logger.debug(f"pyarrow is not installed, not writing a columnar copy of {geojson_path}")
+        return None
+    path = arrow_path(geojson_path)
+    table = build_table(geojson)
+    # Replace the file rather than rewrite it: the app may have it mapped
+    temp_path = f"{path}.tmp"
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+    logger.debug(f"Wrote {path} ({table.num_rows} rows, {table.num_columns} columns)")
+    return path
+
+
+class ColumnarLayer:
+    """A memory-mapped columnar copy of one layer version
+
+    Derived columns (numeric views, formatted text) are computed lazily and
+    kept for the life of the mapping.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.num_rows = table.num_rows
+        metadata = table.schema.metadata or {}
+        self.untyped = frozenset(json.loads(metadata.get(UNTYPED_KEY, b'[]')))
+        self._ids_json = IDS_JSON_KEY in metadata
+        # Structures computed from this version of the layer (classifications, ...)
+        self.derived = {}
+        self._numeric = {}
+        self._text = {}
+
+    def derive(self, key, build):
+        """Return build(self), computing it once for this version of the layer"""
+        try:
+            return self.derived[key]
+        except KeyError:
+            value = build(self)
+            self.derived[key] = value
+            return value
+
+    def covers(self, names):
+        """Return True if every named property can be answered from the table"""
+        return not any(name in self.untyped for name in names)
+
+    def has_property(self, name):
+        """Return True if some feature has a (typed) value for a property"""
+        return name in self.table.column_names and name not in (ID_COLUMN, GEOMETRY_COLUMN)
+
+    def feature_ids(self):
+        """Return the feature ids in row order"""
+        ids = self.table.column(ID_COLUMN).to_pylist()
+        return [json.loads(fid) for fid in ids] if self._ids_json else ids
+
+    def properties(self, rows):
+        """Return the property dicts of the given row positions"""
+        names = [name for name in self.table.column_names if name not in (ID_COLUMN, GEOMETRY_COLUMN)]
+        return self.table.select(names).take(rows).to_pylist()
+
+    def values(self, name):
+        """Return the Python values of a property in row order (None where missing)"""
+        if not self.has_property(name):
+            return [None] * self.num_rows
+        return self.table.column(name).to_pylist()
+
+    def numeric(self, name):
+        """Return a float64 column of a property, NaN where missing or not a number"""
+        column = self._numeric.get(name)
+        if column is None:
+            column = np.full(self.num_rows, np.nan)
+            if self.has_property(name):
+                array = self.table.column(name)
+                kind = array.type
+                if pa.types.is_integer(kind) or pa.types.is_floating(kind):
+                    column = pc.fill_null(pc.cast(array, pa.float64()), math.nan).to_numpy()
+            self._numeric[name] = column
+        return column
+
+    def text(self, name):
+        """Return (formatted, lower-cased) text columns of a property
+
+        Values are formatted as layer_query.format_value does; missing
+        values are null.
+        """
+        column = self._text.get(name)
+        if column is None:
+            column = self._formatted(name)
+            self._text[name] = (column, pc.utf8_lower(column))
+        return self._text[name]
+
+    def select(self, predicates):
+        """Return the sorted row positions matching every (op, property, value) predicate
+
+        Has the semantics of AttributeIndex.select: range bounds apply to
+        numeric values only, eq compares formatted values and contains is a
+        case-insensitive substring match.
+        """
+        mask = np.ones(self.num_rows, dtype=bool)
+        for op, prop, value in predicates:
+            if op in ('min', 'max'):
+                column = self.numeric(prop)
+                with np.errstate(invalid='ignore'):
+                    mask &= column >= value if op == 'min' else column <= value
+            elif op == 'eq':
+                formatted, _ = self.text(prop)
+                mask &= _to_mask(pc.equal(formatted, str(value)))
+            else:
+                _, lowered = self.text(prop)
+                mask &= _to_mask(pc.match_substring(lowered, str(value).lower()))
+            if not mask.any():
+                break
+        return [int(row) for row in np.flatnonzero(mask)]
+
+    def _formatted(self, name):
+        if not self.has_property(name):
+            return pa.nulls(self.num_rows, pa.string())
+        array = self.table.column(name).combine_chunks()
+        kind = array.type
+        if pa.types.is_null(kind):
+            return pa.nulls(self.num_rows, pa.string())
+        if pa.types.is_string(kind):
+            return array
+        if pa.types.is_boolean(kind):
+            return pc.if_else(array, 'true', 'false')
+        if pa.types.is_floating(kind):
+            # Whole numbers print without a decimal point, as in JavaScript
+            values = array.to_numpy(zero_copy_only=False)
+            whole = np.isfinite(values) & (np.floor(values) == values) & (np.abs(values) < _MAX_EXACT_FLOAT)
+            as_int = pc.cast(pc.if_else(pa.array(whole), array, 0), pa.int64()).cast(pa.string())
+            return pc.if_else(pa.array(whole), as_int, pc.cast(array, pa.string()))
+        return pc.cast(array, pa.string())
+
+
+def _to_mask(result):
+    return np.asarray(pc.fill_null(result, False).to_numpy(zero_copy_only=False), dtype=bool)
+
+
+def open_layer(path):
+    """Memory-map a columnar copy; columns are read straight from the page cache"""
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    return ColumnarLayer(table)
+
+
+class ColumnarStore:
+    """Process-wide cache of mapped columnar copies, keyed by layer filename"""
+
+    def __init__(self, data_dir, metrics=None):
+        self.data_dir = data_dir
+        # Told of cache hits and misses (see metrics.RequestMetrics)
+        self.metrics = metrics
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """Return the columnar copy of a layer, or None if it has no current one
+
+        Raises FileNotFoundError if the layer file does not exist.
+        """
+        geojson_path = os.path.join(self.data_dir, filename)
+        geojson_mtime = os.stat(geojson_path).st_mtime_ns
+        if pa is None:
+            return None
+        path = arrow_path(geojson_path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if stat.st_mtime_ns < geojson_mtime:
+            return None
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._layers.get(filename)
+        hit = cached is not None and cached[0] == version
+        if self.metrics is not None:
+            self.metrics.cache_lookup('columnar', filename, hit)
+        if hit:
+            return cached[1]
+
+        try:
+            layer = open_layer(path)
+        except (OSError, pa.ArrowInvalid) as e:
+            logger.warning(f"Ignoring unreadable columnar copy {path}: {e}")
+            return None
+        with self._lock:
+            self._layers[filename] = (version, layer)
+        logger.debug(f"Mapped columnar copy of {filename} ({layer.num_rows} rows)")
+        return layer
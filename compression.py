@@ -0,0 +1,74 @@
+"""
+Precompressed variants of layer and style files.
+
+The ETL scripts write a gzip (.gz) and, when the brotli package is
+installed, a brotli (.br) copy next to every GeoJSON and style file. The
+web app sends the copy matching the client's Accept-Encoding while it is
+current, and compresses other responses itself (once per layer version).
+"""
+import os
+import gzip
+import logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Content codings in order of preference, with the suffix of their files
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def available_encodings():
+    """Return the content codings this process can produce"""
+    return tuple(encoding for encoding in SUFFIXES if encoding != 'br' or brotli is not None)
+
+
+def compress(data, encoding):
+    """Compress bytes with a content coding ('gzip' or 'br')"""
+    if encoding == 'gzip':
+        # A fixed mtime keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+def variant_path(path, encoding):
+    """Return the path of the precompressed variant of a file"""
+    return path + SUFFIXES[encoding]
+
+
+def compressed_paths(path):
+    """Return the paths of the variants write_compressed writes for a file"""
+    return [variant_path(path, encoding) for encoding in available_encodings()]
+
+
+def current_variant(path, encoding):
+    """Return the path of a file's variant if it exists and is not older than the file"""
+    variant = variant_path(path, encoding)
+    try:
+        if os.stat(variant).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return variant
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def write_compressed(path):
+    """Write the precompressed variants of a file next to it and return their paths"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    for encoding in available_encodings():
+        target = variant_path(path, encoding)
+        with open(target, 'wb') as f:
+            f.write(compress(data, encoding))
+        written.append(target)
+    logger.debug(f"Wrote compressed variants of {path}")
+    return written
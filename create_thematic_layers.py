@@ -7,6 +7,20 @@ import logging
 import sys
 import colorsys
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import classification
+import columnar
+import compression
+import geobuf
+import geojson_writer
+from geobuf import geobuf_path, write_geobuf
+from layer_store import geometry_filename
+import simplification
+from build_manifest import BuildManifest, hash_code, hash_file, hash_settings
+from simplification import ZOOM_LEVELS, level_filename, write_simplified_copies
 
 # Configure logging with UTF-8 support
 logging.basicConfig(level=logging.INFO, 
@@ -19,6 +33,12 @@ INPUT_GEOJSON = "static/data/nieghborhood.geojson"
 OUTPUT_DIR = "static/data"
 STYLE_DIR = "static/styles"
 
+# Name of the geometry store shared by all thematic layers
+GEOMETRY_SOURCE = "neighborhoods"
+
+# Properties used as the neighborhood ID when present (else the feature index)
+FEATURE_ID_FIELDS = ['OBJECTID', 'FID']
+
 # Ensure directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(STYLE_DIR, exist_ok=True)
@@ -69,112 +89,207 @@ THEMATIC_LAYERS = {
     }
 }
 
-def create_thematic_layer(layer_id, layer_config):
-    """Create a thematic layer based on the neighborhood data"""
-    try:
-        # Read the input GeoJSON file
-        with open(INPUT_GEOJSON, 'r', encoding='utf-8') as f:
-            neighborhoods = json.load(f)
-        
-        if 'features' not in neighborhoods:
-            logger.error("Invalid GeoJSON: no features found")
-            return None
-        
-        # Create a new GeoJSON with the same features but include thematic property
-        thematic_geojson = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-        
-        property_name = layer_config['property']
-        arabic_name = layer_config['arabic_name']
-        cost_property = layer_config.get('cost_property', None)
-        label_property = layer_config.get('label_property', 'ADM4_NAME_')
-        
-        # Create bins for classification
-        values = []
-        for feature in neighborhoods['features']:
-            value = feature['properties'].get(property_name)
-            if value is not None:
-                values.append(float(value))
-        
-        if not values:
-            logger.error(f"No values found for property {property_name}")
-            return None
-        
-        min_value = min(values)
-        max_value = max(values)
-        range_value = max_value - min_value
-        
-        # Create bins
-        num_bins = len(layer_config['color_scale'])
-        bins = []
-        for i in range(num_bins):
-            bin_min = min_value + (range_value * i / num_bins)
-            bin_max = min_value + (range_value * (i + 1) / num_bins)
-            bins.append((bin_min, bin_max, layer_config['color_scale'][i]))
-        
-        # Process each feature
-        for feature in neighborhoods['features']:
-            # Create a copy of the feature
-            new_feature = {
+def feature_id(feature, index):
+    """Return the neighborhood ID used to join thematic attributes to geometry"""
+    properties = feature.get('properties') or {}
+    for field in FEATURE_ID_FIELDS:
+        if properties.get(field) is not None:
+            return properties[field]
+    return index
+
+def write_geometry_store(neighborhoods):
+    """Write the neighborhood geometry once, keyed by ID, plus simplified copies
+    
+    Returns the zoom levels that have a simplified geometry store.
+    """
+    geometry_geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {
                 "type": "Feature",
+                "id": feature_id(feature, index),
                 "properties": {},
                 "geometry": feature['geometry']
             }
-            
-            # Add Arabic label
-            arabic_label = feature['properties'].get(label_property, '')
-            new_feature['properties']['arabic_label'] = arabic_label
-            
-            # Add neighborhood name
-            new_feature['properties']['neighborhood'] = feature['properties'].get('ADM4_NAME', '')
-            
-            # Add the thematic property
-            value = feature['properties'].get(property_name)
+            for index, feature in enumerate(neighborhoods['features'])
+        ]
+    }
+    
+    output_file = os.path.join(OUTPUT_DIR, geometry_filename(GEOMETRY_SOURCE))
+    geometry_geojson = geojson_writer.write_geojson(geometry_geojson, output_file)
+    write_geobuf(geometry_geojson, output_file)
+    compression.write_compressed(output_file)
+    
+    # Simplify the shared geometry once rather than once per theme
+    levels = write_simplified_copies(
+        geometry_geojson,
+        lambda zoom: os.path.join(OUTPUT_DIR, geometry_filename(f"{GEOMETRY_SOURCE}.z{zoom}")))
+    logger.info(f"Wrote geometry store {GEOMETRY_SOURCE} with {len(geometry_geojson['features'])} features")
+    return levels
+
+def load_columns(features, names):
+    """Pull numeric properties of all features into NumPy columns (NaN where missing)"""
+    columns = {}
+    for name in names:
+        values = np.full(len(features), np.nan)
+        for row, feature in enumerate(features):
+            value = feature['properties'].get(name)
             if value is not None:
-                new_feature['properties'][property_name] = value
-                
-                # Add bin and color
-                for bin_min, bin_max, color in bins:
-                    if bin_min <= float(value) <= bin_max:
-                        new_feature['properties']['bin'] = f"{bin_min:.1f}-{bin_max:.1f}"
-                        new_feature['properties']['color'] = color
-                        break
-            
-            # Add cost if available
-            if cost_property and cost_property in feature['properties']:
-                new_feature['properties']['cost'] = feature['properties'][cost_property]
-            
-            thematic_geojson['features'].append(new_feature)
+                try:
+                    values[row] = float(value)
+                except (TypeError, ValueError):
+                    pass
+        columns[name] = values
+    return columns
+
+def build_thematic_geojson(layer_config, features, ids, edges, classes):
+    """Build the attribute-only FeatureCollection of one theme"""
+    property_name = layer_config['property']
+    cost_property = layer_config.get('cost_property', None)
+    label_property = layer_config.get('label_property', 'ADM4_NAME_')
+    color_scale = layer_config['color_scale']
+    labels = [f"{edges[i]:.1f}-{edges[i + 1]:.1f}" for i in range(len(edges) - 1)]
+    
+    thematic_features = []
+    for row, feature in enumerate(features):
+        source = feature['properties']
+        properties = {
+            'arabic_label': source.get(label_property, ''),
+            'neighborhood': source.get('ADM4_NAME', '')
+        }
         
-        # Save the thematic GeoJSON
-        output_file = os.path.join(OUTPUT_DIR, f"{layer_id}.geojson")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(thematic_geojson, f, ensure_ascii=False)
+        # Add the thematic property with its bin and color
+        value = source.get(property_name)
+        if value is not None:
+            properties[property_name] = value
+            class_index = classes[row]
+            if class_index >= 0:
+                properties['bin'] = labels[class_index]
+                properties['color'] = color_scale[class_index]
         
-        # Create style information
-        style_info = create_style_info(layer_id, layer_config, bins)
+        # Add cost if available
+        if cost_property and cost_property in source:
+            properties['cost'] = source[cost_property]
         
-        # Save style information
-        style_file = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
-        with open(style_file, 'w', encoding='utf-8') as f:
-            json.dump(style_info, f, ensure_ascii=False, indent=2)
+        # Features carry only attributes and the neighborhood ID; the server
+        # (or the client, with join=0) joins them to the geometry store
+        thematic_features.append({
+            "type": "Feature",
+            "id": ids[row],
+            "properties": properties,
+            "geometry": None
+        })
+    
+    return {
+        "type": "FeatureCollection",
+        "geometry_source": GEOMETRY_SOURCE,
+        "features": thematic_features
+    }
+
+def write_thematic_layer(layer_id, layer_config, thematic_geojson, bins, geometry_levels):
+    """Write a theme's GeoJSON, simplified level pointers and style"""
+    output_file = os.path.join(OUTPUT_DIR, f"{layer_id}.geojson")
+    geojson_writer.write_geojson(thematic_geojson, output_file)
+    write_geobuf(thematic_geojson, output_file)
+    columnar.write_arrow(thematic_geojson, output_file)
+    compression.write_compressed(output_file)
+    
+    # Simplified levels only point at the simplified geometry stores
+    for zoom in geometry_levels:
+        level_geojson = dict(thematic_geojson, geometry_source=f"{GEOMETRY_SOURCE}.z{zoom}")
+        level_file = os.path.join(OUTPUT_DIR, level_filename(layer_id, zoom))
+        geojson_writer.write_geojson(level_geojson, level_file)
+        write_geobuf(level_geojson, level_file)
+        compression.write_compressed(level_file)
+    
+    # Save style information
+    style_info = create_style_info(layer_id, layer_config, bins)
+    style_file = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
+    with open(style_file, 'w', encoding='utf-8') as f:
+        json.dump(style_info, f, ensure_ascii=False, indent=2)
+    compression.write_compressed(style_file)
+
+def create_thematic_layers(layer_ids, neighborhoods, geometry_levels=ZOOM_LEVELS):
+    """Create attribute-only thematic layers over the shared neighborhood geometry
+    
+    The source is walked once: every theme property is pulled into a NumPy
+    column, classified with the classification engine, and the outputs of all
+    themes are written in parallel. Returns a dict of layer information by
+    layer ID, with None for themes that failed.
+    """
+    features = neighborhoods['features']
+    ids = [feature_id(feature, index) for index, feature in enumerate(features)]
+    columns = load_columns(features, {THEMATIC_LAYERS[layer_id]['property'] for layer_id in layer_ids})
+    
+    results = {}
+    pending = []
+    for layer_id in layer_ids:
+        layer_config = THEMATIC_LAYERS[layer_id]
+        property_name = layer_config['property']
+        values = columns[property_name]
+        if np.isnan(values).all():
+            logger.error(f"No values found for property {property_name}")
+            results[layer_id] = None
+            continue
         
-        # Return layer information
-        return {
+        # One class per color; themes may pick another method than equal intervals
+        method = layer_config.get('classification', classification.DEFAULT_METHOD)
+        edges = classification.compute_breaks(values, method, len(layer_config['color_scale']))
+        classes = classification.assign_classes(values, edges)
+        num_bins = len(edges) - 1
+        bins = [(float(edges[i]), float(edges[i + 1]), layer_config['color_scale'][i]) for i in range(num_bins)]
+        thematic_geojson = build_thematic_geojson(layer_config, features, ids, edges, classes)
+        pending.append((layer_id, layer_config, thematic_geojson, bins))
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(len(pending), os.cpu_count() or 1))) as executor:
+        futures = {
+            executor.submit(write_thematic_layer, layer_id, layer_config, thematic_geojson, bins, geometry_levels): layer_id
+            for layer_id, layer_config, thematic_geojson, bins in pending
+        }
+        for future in as_completed(futures):
+            layer_id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error creating thematic layer {layer_id}: {e}")
+                results[layer_id] = None
+    
+    for layer_id, layer_config, thematic_geojson, _ in pending:
+        if layer_id in results:
+            continue
+        property_name = layer_config['property']
+        cost_property = layer_config.get('cost_property', None)
+        results[layer_id] = {
             "id": layer_id,
-            "name": arabic_name,
+            "name": layer_config['arabic_name'],
             "filename": f"{layer_id}.geojson",
             "feature_count": len(thematic_geojson['features']),
             "has_style": True,
             "geometry_type": "MultiPolygon",
-            "properties": ["arabic_label", "neighborhood", property_name, "bin", "color"] + (["cost"] if cost_property else [])
+            "properties": ["arabic_label", "neighborhood", property_name, "bin", "color"] + (["cost"] if cost_property else []),
+            "geometry_source": GEOMETRY_SOURCE,
+            "simplified_levels": list(geometry_levels)
         }
-    
-    except Exception as e:
-        logger.error(f"Error creating thematic layer {layer_id}: {e}")
-        return None
+    return results
+
+def thematic_output_files(layer_id, geometry_levels):
+    """Return the paths of every file written for a thematic layer"""
+    files = [
+        os.path.join(OUTPUT_DIR, f"{layer_id}.geojson"),
+        os.path.join(STYLE_DIR, f"{layer_id}_style.json")
+    ]
+    arrow_files = columnar.columnar_paths(files[0])
+    files.extend(os.path.join(OUTPUT_DIR, level_filename(layer_id, zoom)) for zoom in geometry_levels)
+    files += [geobuf_path(path) for path in files if path.endswith('.geojson')]
+    return files + arrow_files + [variant for path in files if path.endswith('.json') or path.endswith('.geojson')
+                    for variant in compression.compressed_paths(path)]
+
+def geometry_output_files(geometry_levels):
+    """Return the paths of the shared geometry store and its simplified copies"""
+    names = [GEOMETRY_SOURCE] + [f"{GEOMETRY_SOURCE}.z{zoom}" for zoom in geometry_levels]
+    files = [os.path.join(OUTPUT_DIR, geometry_filename(name)) for name in names]
+    return (files + [geobuf_path(path) for path in files]
+            + [variant for path in files for variant in compression.compressed_paths(path)])
 
 def create_style_info(layer_id, layer_config, bins):
     """Create style information for the thematic layer"""
@@ -269,17 +384,67 @@ def main():
         logger.error(f"Input file not found: {INPUT_GEOJSON}")
         return
     
-    # Create each thematic layer
+    # Outputs are rebuilt when the input, their configuration or this code changes
+    manifest = BuildManifest()
+    sources = {INPUT_GEOJSON: hash_file(INPUT_GEOJSON)}
+    code = hash_code(__file__, simplification, classification, geobuf, columnar, compression, geojson_writer)
+    geometry_key = f"create_thematic_layers/geometry/{GEOMETRY_SOURCE}"
+    geometry_settings = hash_settings({'code': code})
+    layer_settings = {
+        layer_id: hash_settings({'code': code, 'config': layer_config})
+        for layer_id, layer_config in THEMATIC_LAYERS.items()
+    }
+    
+    geometry_fresh = manifest.is_fresh(geometry_key, sources, geometry_settings)
+    stale_layers = [
+        layer_id for layer_id in THEMATIC_LAYERS
+        if not geometry_fresh
+        or not manifest.is_fresh(f"create_thematic_layers/{layer_id}", sources, layer_settings[layer_id])
+        or not manifest.info(f"create_thematic_layers/{layer_id}")
+    ]
+    
+    # Read the input GeoJSON file once for all layers, and only if needed
+    neighborhoods = None
+    if stale_layers or not geometry_fresh:
+        with open(INPUT_GEOJSON, 'r', encoding='utf-8') as f:
+            neighborhoods = json.load(f)
+        
+        if 'features' not in neighborhoods:
+            logger.error("Invalid GeoJSON: no features found")
+            return
+    
+    if geometry_fresh:
+        geometry_levels = manifest.info(geometry_key)['levels']
+        logger.info(f"Geometry store {GEOMETRY_SOURCE} is up to date, skipping")
+    else:
+        geometry_levels = write_geometry_store(neighborhoods)
+        manifest.record(geometry_key, sources, geometry_settings,
+                        geometry_output_files(geometry_levels), info={'levels': geometry_levels})
+    
+    # Create all stale thematic layers in one pass over the source
+    if stale_layers:
+        logger.info(f"Creating thematic layers: {', '.join(stale_layers)}")
+        created = create_thematic_layers(stale_layers, neighborhoods, geometry_levels)
+    
     created_layers = []
-    for layer_id, layer_config in THEMATIC_LAYERS.items():
-        logger.info(f"Creating thematic layer: {layer_id}")
-        layer_info = create_thematic_layer(layer_id, layer_config)
+    for layer_id in THEMATIC_LAYERS:
+        key = f"create_thematic_layers/{layer_id}"
+        if layer_id not in stale_layers:
+            logger.info(f"Thematic layer {layer_id} is up to date, skipping")
+            created_layers.append(manifest.info(key))
+            continue
+        
+        layer_info = created[layer_id]
         if layer_info:
             created_layers.append(layer_info)
+            manifest.record(key, sources, layer_settings[layer_id],
+                            thematic_output_files(layer_id, geometry_levels), info=layer_info)
             logger.info(f"Created thematic layer: {layer_id} with {layer_info['feature_count']} features")
         else:
             logger.error(f"Failed to create thematic layer: {layer_id}")
     
+    manifest.save()
+    
     # Update layer index
     if created_layers:
         update_layer_index(created_layers)
@@ -7,9 +7,18 @@ import logging
 import subprocess
 import sys
 import glob
-import colorsys
 from pathlib import Path
 
+import columnar
+import compression
+import geobuf
+import geojson_writer
+import geopackage
+import simplification
+import style_inference
+from build_manifest import BuildManifest, hash_code, hash_gdb_source, hash_settings
+from simplification import level_filename, write_simplified_levels
+
 # Configure logging with UTF-8 support
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(levelname)s - %(message)s',
@@ -64,9 +73,32 @@ def list_gdb_layers():
         logger.error(f"Error listing layers: {e}")
         return []
 
-def extract_layer(layer_name):
-    """Extract a layer from the geodatabase and convert to GeoJSON"""
+def layer_output_files(layer_info):
+    """Return the paths of every file written for an extracted layer"""
+    files = [os.path.join(OUTPUT_DIR, layer_info["filename"])]
+    arrow_files = columnar.columnar_paths(files[0])
+    if layer_info["has_style"]:
+        files.append(os.path.join(STYLE_DIR, f"{layer_info['id']}_style.json"))
+    files.extend(os.path.join(OUTPUT_DIR, level_filename(layer_info["id"], zoom))
+                 for zoom in layer_info["simplified_levels"])
+    files += [geobuf.geobuf_path(path) for path in files if path.endswith('.geojson')]
+    return files + arrow_files + [variant for path in files if path.endswith('.json') or path.endswith('.geojson')
+                    for variant in compression.compressed_paths(path)]
+
+def extract_layer(layer_name, manifest=None, settings=None):
+    """Extract a layer from the geodatabase and convert to GeoJSON
+    
+    The layer is skipped when the manifest shows its source and settings
+    are unchanged since it was last extracted.
+    """
     try:
+        key = f"extract_additional_layers/{layer_name.replace(' ', '_').lower()}"
+        hash_source = manifest.hash_gdb_source if manifest is not None else hash_gdb_source
+        sources = {layer_name: hash_source(GDB_PATH, layer_name)}
+        if manifest is not None and manifest.is_fresh(key, sources, settings) and manifest.info(key):
+            logger.info(f"Layer {layer_name} is up to date, skipping")
+            return manifest.info(key)
+        
         import fiona
         import geopandas as gpd
         from shapely.geometry import mapping
@@ -98,9 +130,16 @@ def extract_layer(layer_name):
             style_path = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
             with open(style_path, "w", encoding="utf-8") as f:
                 json.dump(style_info, f, indent=2, ensure_ascii=False)
+            compression.write_compressed(style_path)
+        
+        # Save as GeoJSON, with its Geobuf and columnar copies
+        geojson = geojson_writer.write_geojson(json.loads(gdf.to_json()), geojson_path)
+        geobuf.write_geobuf(geojson, geojson_path)
+        columnar.write_arrow(geojson, geojson_path)
+        compression.write_compressed(geojson_path)
         
-        # Save as GeoJSON
-        gdf.to_file(geojson_path, driver="GeoJSON")
+        # Write simplified copies for lower zoom levels
+        simplified_levels = write_simplified_levels(layer_id, geojson, OUTPUT_DIR)
         
         # Add layer to the list
         layer_info = {
@@ -110,10 +149,13 @@ def extract_layer(layer_name):
             "feature_count": len(gdf),
             "has_style": bool(style_info),
             "geometry_type": gdf.geometry.iloc[0].geom_type if not gdf.empty else None,
-            "properties": list(gdf.columns)
+            "properties": list(gdf.columns),
+            "simplified_levels": simplified_levels
         }
         
         logger.info(f"Converted layer {layer_name} to GeoJSON with {len(gdf)} features")
+        if manifest is not None:
+            manifest.record(key, sources, settings, layer_output_files(layer_info), info=layer_info)
         return layer_info
     except Exception as e:
         logger.error(f"Error processing layer {layer_name}: {e}")
@@ -129,48 +171,31 @@ def extract_style_info(layer_name, gdf):
     # Clean layer name for mapping
     layer_id = layer_name.replace(' ', '_').lower()
     
-    # Set default styles based on geometry type
-    default_style = {
-        "weight": 2,
-        "opacity": 1,
-        "fillOpacity": 0.5
-    }
-    
     # Determine color based on layer name
-    layer_color = LAYER_COLORS.get(layer_id, None)
+    layer_color = LAYER_COLORS.get(layer_id) or style_inference.fallback_color(geometry_type)
     
-    if not layer_color:
-        # Default colors if layer name not recognized
-        if geometry_type == 'Polygon' or geometry_type == 'MultiPolygon':
-            layer_color = '#3388ff'  # Blue for polygons
-        elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
-            layer_color = '#ff7800'  # Orange for lines
-        elif geometry_type == 'Point' or geometry_type == 'MultiPoint':
-            layer_color = '#e41a1c'  # Red for points
-        else:
-            layer_color = '#808080'  # Gray for unknown types
+    # Predefined color schemes for specific feature types
+    preset_colors = {
+        'road': ['#999999', '#666666', '#333333', '#FF7F00', '#E31A1C'],
+        'building': ['#A8A8A8', '#CCCCCC', '#666666', '#333333', '#DFDFDF'],
+        'water': ['#3B7AB8', '#6BAED6', '#9ECAE1', '#C6DBEF', '#2171B5'],
+        'electricity': ['#FFD700', '#FFC125', '#DAA520', '#B8860B', '#8B6914'],
+        'waste': ['#6A5ACD', '#483D8B', '#7B68EE', '#9370DB', '#8A2BE2'],
+        'telecom': ['#9932CC', '#BF3EFF', '#9F79EE', '#8B7B8B', '#8968CD'],
+    }
+    color_scheme = next((scheme for key, scheme in preset_colors.items() if key in layer_id), None)
     
-    # Adjust defaults based on geometry type
-    if geometry_type == 'Polygon' or geometry_type == 'MultiPolygon':
-        default_style["fillColor"] = layer_color
-        default_style["color"] = "#000000"
-        default_style["weight"] = 1
-        default_style["fillOpacity"] = 0.7
-    elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
-        default_style["color"] = layer_color
-        default_style["weight"] = 3 
-    elif geometry_type == 'Point' or geometry_type == 'MultiPoint':
-        default_style["radius"] = 6
-        default_style["fillColor"] = layer_color
-        default_style["color"] = "#000000"
-        default_style["weight"] = 1
-        default_style["fillOpacity"] = 0.8
+    # One profile of every column drives the categorical styles
+    profile = style_inference.profile_frame(gdf)
+    property_styles = style_inference.property_styles(
+        profile, geometry_type, color_scheme,
+        excluded=style_inference.EXCLUDED_COLUMNS + ('arabic_label',))
     
     style_info = {
         "type": "default",
         "geometry_type": geometry_type,
-        "property_styles": {},
-        "default_style": default_style,
+        "property_styles": property_styles,
+        "default_style": style_inference.default_style(geometry_type, layer_color),
         "layer_name": ARABIC_LABELS.get(layer_id, layer_name),
         "original_name": layer_name
     }
@@ -187,112 +212,6 @@ def extract_style_info(layer_name, gdf):
         "default_field": "arabic_label"
     }
     
-    # Check for styling attributes in the dataframe
-    style_columns = []
-    
-    # Common style-related column names
-    style_attrs = [
-        'COLOR', 'SYMBOL', 'WIDTH', 'STYLE', 'FILL', 'STROKE', 'OUTLINE', 
-        'TYPE', 'CATEGORY', 'CLASS', 'CODE', 'STATUS', 'KIND', 'FUNCTION', 
-        'USE', 'LEVEL', 'IMPORTANCE'
-    ]
-    
-    # Find columns that might contain style info (more lenient matching)
-    for col in gdf.columns:
-        col_upper = col.upper()
-        if any(attr in col_upper for attr in style_attrs):
-            style_columns.append(col)
-    
-    # If no style columns found, try to use columns with few unique values
-    if not style_columns:
-        for col in gdf.columns:
-            if col.lower() not in ['geometry', 'shape', 'objectid', 'fid', 'id', 'arabic_label']:
-                try:
-                    unique_count = gdf[col].nunique()
-                    if 1 < unique_count <= min(10, len(gdf) / 5):
-                        style_columns.append(col)
-                except:
-                    continue
-    
-    # If we found potential style columns, analyze them
-    if style_columns:
-        for col in style_columns:
-            try:
-                # Get unique values and their counts
-                value_counts = gdf[col].value_counts()
-                
-                # Only use for styling if there's more than one value 
-                # and less than 30% of the total features
-                if 1 < len(value_counts) <= min(20, len(gdf) * 0.3):
-                    unique_values = value_counts.index.tolist()
-                    
-                    # Create a style entry for this property
-                    style_info["property_styles"][col] = {
-                        "type": "categorical",
-                        "field": col,
-                        "values": {}
-                    }
-                    
-                    # Predefined color schemes for specific feature types
-                    preset_colors = {
-                        'road': ['#999999', '#666666', '#333333', '#FF7F00', '#E31A1C'],
-                        'building': ['#A8A8A8', '#CCCCCC', '#666666', '#333333', '#DFDFDF'],
-                        'water': ['#3B7AB8', '#6BAED6', '#9ECAE1', '#C6DBEF', '#2171B5'],
-                        'electricity': ['#FFD700', '#FFC125', '#DAA520', '#B8860B', '#8B6914'],
-                        'waste': ['#6A5ACD', '#483D8B', '#7B68EE', '#9370DB', '#8A2BE2'],
-                        'telecom': ['#9932CC', '#BF3EFF', '#9F79EE', '#8B7B8B', '#8968CD'],
-                    }
-                    
-                    # Determine which color scheme to use
-                    color_scheme = None
-                    for key, scheme in preset_colors.items():
-                        if key in layer_id:
-                            color_scheme = scheme
-                            break
-                    
-                    # Generate or select colors for each unique value
-                    for i, val in enumerate(unique_values):
-                        if val is not None:
-                            # Determine color
-                            if color_scheme and i < len(color_scheme):
-                                color = color_scheme[i]
-                            else:
-                                # Generate a color using golden ratio method for visual distinction
-                                hue = (i * 137.508) % 360
-                                r, g, b = colorsys.hsv_to_rgb(hue / 360, 0.7, 0.9)
-                                color = f"#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}"
-                            
-                            # Create a style for this value
-                            value_style = {}
-                            
-                            if geometry_type == 'Polygon' or geometry_type == 'MultiPolygon':
-                                value_style["fillColor"] = color
-                                value_style["color"] = "#000000"
-                                value_style["weight"] = 1
-                                value_style["fillOpacity"] = 0.7
-                            elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
-                                value_style["color"] = color
-                                # Adjust line width based on importance if possible
-                                if 'type' in col.lower() or 'class' in col.lower() or 'importance' in col.lower():
-                                    try:
-                                        # Try to convert value to number for width
-                                        if isinstance(val, (int, float)):
-                                            width = min(max(val, 1), 8)  # Constrain between 1-8
-                                            value_style["weight"] = width
-                                        # For text categories, use position in the list
-                                        else:
-                                            normalized_pos = (i / len(unique_values)) * 5 + 1
-                                            value_style["weight"] = normalized_pos
-                                    except:
-                                        pass
-                            elif geometry_type == 'Point' or geometry_type == 'MultiPoint':
-                                value_style["fillColor"] = color
-                                value_style["radius"] = 6 + i % 4  # Vary radius slightly
-                            
-                            style_info["property_styles"][col]["values"][str(val)] = value_style
-            except Exception as e:
-                logger.warning(f"Error processing style column {col}: {e}")
-    
     return style_info
 
 def update_layer_index(layers):
@@ -340,6 +259,11 @@ def main():
         "housing", "clean_water", "swm", "electricity", "nieghborhood"
     ]
     
+    # Outputs are rebuilt when their source layer or this code changes
+    manifest = BuildManifest()
+    code = hash_code(__file__, simplification, geobuf, columnar, compression, style_inference, geojson_writer)
+    settings = hash_settings({'code': code})
+    
     # Extract each requested layer if available
     extracted_layers = []
     for layer_name in available_layers:
@@ -347,14 +271,19 @@ def main():
         clean_name = layer_name.replace(' ', '_').lower()
         for target in target_layers:
             if target in clean_name or clean_name in target:
-                layer_info = extract_layer(layer_name)
+                layer_info = extract_layer(layer_name, manifest, settings)
                 if layer_info:
                     extracted_layers.append(layer_info)
                 break
     
+    manifest.save()
+    
     # Update layer index with new layers
     if extracted_layers:
         update_layer_index(extracted_layers)
+        # Load every indexed layer into the GeoPackage backend
+        if geopackage.ENABLED:
+            geopackage.build_geopackage(OUTPUT_DIR)
     else:
         logger.warning("No layers were extracted!")
     
@@ -1,17 +1,29 @@
 import os
 import json
 import logging
+import multiprocessing
 import subprocess
 import xml.etree.ElementTree as ET
 from pathlib import Path
-import colorsys
 import glob
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import fiona
 import geopandas as gpd
 from arcgis2geojson import arcgis2geojson
 from shapely.geometry import mapping
 
+import columnar
+import compression
+import geobuf
+import geojson_writer
+import geopackage
+import simplification
+import style_inference
+from build_manifest import BuildManifest, hash_code, hash_settings
+from simplification import level_filename, write_simplified_levels
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,6 +41,14 @@ MXD_PATH = os.path.join(EXTRACT_DIR, "v105/homs.mxd")
 THUMBNAIL_PATH = os.path.join(EXTRACT_DIR, "esriinfo/thumbnail/thumbnail.png")
 MAP_INFO_PATH = os.path.join(EXTRACT_DIR, "esriinfo/iteminfo.xml")
 
+# Worker processes used to convert layers (defaults to one per core)
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", 0)) or os.cpu_count() or 1
+
+# Workers are spawned, not forked: extractions also run from a thread of
+# the multithreaded web app, and a forked child can inherit locks (logging,
+# GDAL, sqlite) held by other threads and deadlock on them
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
 # Ensure directories exist
 os.makedirs(EXTRACT_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -134,10 +154,165 @@ def find_all_geodatabases():
     
     return gdbs
 
-def extract_layers_from_gdb():
-    """Extract layers from the geodatabase and convert to GeoJSON"""
-    all_layers = []
+def _no_progress(step, status, **details):
+    pass
+
+def find_layer_tasks(gdbs):
+    """List the (gdb_path, layer_name) pairs to convert, without duplicates
+    
+    Geodatabases are compared by real path, so GDB_PATH and its entry from
+    find_all_geodatabases() are only read once. Order is preserved, which
+    makes the merge of the results deterministic.
+    """
+    tasks = []
+    seen_gdbs = set()
+    for gdb_path in gdbs:
+        real_path = os.path.realpath(gdb_path)
+        if real_path in seen_gdbs:
+            continue
+        seen_gdbs.add(real_path)
+        
+        try:
+            layer_names = fiona.listlayers(gdb_path)
+        except Exception as e:
+            logger.error(f"Error listing layers in geodatabase {gdb_path}: {e}")
+            continue
+        logger.info(f"Found {len(layer_names)} layers in geodatabase {gdb_path}: {', '.join(layer_names)}")
+        
+        for layer_name in layer_names:
+            # Skip system tables which often start with 'a0'
+            if not layer_name.startswith('a0'):
+                tasks.append((gdb_path, layer_name))
+    return tasks
+
+def clean_layer_id(layer_name):
+    """Generate a clean layer ID from a geodatabase layer name"""
+    return layer_name.replace(' ', '_').lower()
+
+def convert_layer(gdb_path, layer_name, work_dir):
+    """Convert one geodatabase layer to GeoJSON, style and simplified levels
+    
+    Runs in a worker process. Outputs are written below work_dir, using the
+    same layout as DATA_DIR, and only moved into place by
+    merge_converted_layers(). Returns the layer index entry, or None if the
+    layer is empty.
+    """
+    # Read the layer with GeoPandas
+    gdf = gpd.read_file(gdb_path, layer=layer_name)
+    
+    if len(gdf) == 0:
+        logger.warning(f"Layer {layer_name} is empty, skipping")
+        return None
     
+    # Generate a clean layer ID
+    layer_id = clean_layer_id(layer_name)
+    
+    # Try to extract styling information
+    style_info = extract_style_info(layer_name, gdf)
+    
+    # Try to extract label information if it's a point or polygon layer
+    geometry_type = None
+    if not gdf.empty:
+        geometry_type = gdf.geometry.iloc[0].geom_type
+    
+    # Save style information if available
+    if style_info:
+        style_path = os.path.join(work_dir, f"{layer_id}_style.json")
+        with open(style_path, "w", encoding="utf-8") as f:
+            json.dump(style_info, f, indent=2)
+        compression.write_compressed(style_path)
+    
+    # Save as GeoJSON, with its Geobuf and columnar copies
+    geojson_path = os.path.join(work_dir, f"{layer_id}.geojson")
+    geojson = geojson_writer.write_geojson(json.loads(gdf.to_json()), geojson_path)
+    geobuf.write_geobuf(geojson, geojson_path)
+    columnar.write_arrow(geojson, geojson_path)
+    compression.write_compressed(geojson_path)
+    
+    # Write simplified copies for lower zoom levels
+    simplified_levels = write_simplified_levels(layer_id, geojson, work_dir)
+    
+    logger.info(f"Converted layer {layer_name} to GeoJSON with {len(gdf)} features")
+    return {
+        "id": layer_id,
+        "name": layer_name,
+        "filename": f"{layer_id}.geojson",
+        "feature_count": len(gdf),
+        "has_style": bool(style_info),
+        "geometry_type": geometry_type,
+        "properties": list(gdf.columns),
+        "simplified_levels": simplified_levels
+    }
+
+def _convert_task(index, gdb_path, layer_name, work_root):
+    work_dir = os.path.join(work_root, str(index))
+    os.makedirs(work_dir, exist_ok=True)
+    return convert_layer(gdb_path, layer_name, work_dir)
+
+def _move_output(source, target):
+    """Move an output file into place, followed by its Geobuf, columnar and compressed copies"""
+    # The file goes first: until its copies follow, the old copies are
+    # older than it and the app does not serve them
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(source, target)
+    companions = [(compression.variant_path(source, encoding), compression.variant_path(target, encoding))
+                  for encoding in compression.SUFFIXES]
+    if source.endswith('.geojson'):
+        companions.append((geobuf.geobuf_path(source), geobuf.geobuf_path(target)))
+        companions.append((columnar.arrow_path(source), columnar.arrow_path(target)))
+    for companion, companion_target in companions:
+        if os.path.exists(companion):
+            os.replace(companion, companion_target)
+
+def merge_converted_layers(results, work_root):
+    """Pick one result per layer ID and move its outputs into place
+    
+    results maps task index to layer entry. When several geodatabases
+    provide the same layer, the one with more features wins, and ties go to
+    the earlier task, whatever order the workers finished in.
+    """
+    winners = {}
+    for index in sorted(results):
+        entry = results[index]
+        current = winners.get(entry["id"])
+        if current is None or entry["feature_count"] > results[current]["feature_count"]:
+            winners[entry["id"]] = index
+    
+    layers = []
+    for index in sorted(winners.values()):
+        entry = results[index]
+        layer_id = entry["id"]
+        work_dir = os.path.join(work_root, str(index))
+        
+        data_files = [entry["filename"]] + [level_filename(layer_id, zoom) for zoom in entry["simplified_levels"]]
+        for filename in data_files:
+            _move_output(os.path.join(work_dir, filename), os.path.join(DATA_DIR, filename))
+        if entry["has_style"]:
+            _move_output(os.path.join(work_dir, f"{layer_id}_style.json"),
+                         os.path.join(STYLE_DIR, f"{layer_id}_style.json"))
+        layers.append(entry)
+    return layers
+
+def layer_output_files(entry):
+    """Return the paths of every file written for a converted layer"""
+    files = [os.path.join(DATA_DIR, entry["filename"])]
+    arrow_files = columnar.columnar_paths(files[0])
+    if entry["has_style"]:
+        files.append(os.path.join(STYLE_DIR, f"{entry['id']}_style.json"))
+    files.extend(os.path.join(DATA_DIR, level_filename(entry["id"], zoom))
+                 for zoom in entry["simplified_levels"])
+    files += [geobuf.geobuf_path(path) for path in files if path.endswith('.geojson')]
+    return files + arrow_files + [variant for path in files if path.endswith('.json') or path.endswith('.geojson')
+                    for variant in compression.compressed_paths(path)]
+
+def extract_layers_from_gdb(progress=_no_progress, workers=None, manifest=None):
+    """Extract layers from the geodatabases and convert them to GeoJSON
+    
+    Layers are converted in parallel across worker processes (ETL_WORKERS,
+    default one per core). Layers whose sources and settings are unchanged
+    since the last run (see build_manifest) are not converted again.
+    progress(step, status, **details) is called as each layer is processed.
+    """
     # Try to find all geodatabases
     gdbs = find_all_geodatabases()
     if not gdbs:
@@ -148,83 +323,82 @@ def extract_layers_from_gdb():
     if os.path.exists(GDB_PATH):
         gdbs.insert(0, GDB_PATH)  # Make sure it's processed first
     
-    # Process each geodatabase
-    for gdb_path in gdbs:
-        logger.info(f"Extracting layers from geodatabase: {gdb_path}")
-        
-        try:
-            # List all layers in the geodatabase
-            layer_names = fiona.listlayers(gdb_path)
-            logger.info(f"Found {len(layer_names)} layers in geodatabase: {', '.join(layer_names)}")
-            
-            # Process each layer
-            for layer_name in layer_names:
-                try:
-                    # Skip system tables which often start with 'a0'
-                    if layer_name.startswith('a0'):
+    tasks = find_layer_tasks(gdbs)
+    steps = [f"{os.path.relpath(gdb_path, EXTRACT_DIR)}:{layer_name}" for gdb_path, layer_name in tasks]
+    
+    # Every task providing a layer ID is an input of that layer's outputs,
+    # so a layer is rebuilt when any of its geodatabases changes
+    groups = {}
+    for index, (_, layer_name) in enumerate(tasks):
+        groups.setdefault(clean_layer_id(layer_name), []).append(index)
+    
+    manifest = manifest or BuildManifest()
+    code = hash_code(__file__, simplification, geobuf, columnar, compression, style_inference, geojson_writer)
+    settings = hash_settings({'code': code})
+    group_sources = {
+        layer_id: {steps[index]: manifest.hash_gdb_source(*tasks[index]) for index in indexes}
+        for layer_id, indexes in groups.items()
+    }
+    
+    up_to_date = {}
+    stale = []
+    for layer_id, indexes in groups.items():
+        key = f"extract_mpk/{layer_id}"
+        if manifest.is_fresh(key, group_sources[layer_id], settings):
+            # Layers that were empty are recorded without info
+            if manifest.info(key):
+                up_to_date[layer_id] = manifest.info(key)
+            for index in indexes:
+                progress(steps[index], "skipped", message="Up to date")
+        else:
+            stale.extend(indexes)
+    if up_to_date:
+        logger.info(f"Skipping {len(up_to_date)} up-to-date layers: {', '.join(up_to_date)}")
+    
+    workers = workers or ETL_WORKERS
+    results = {}
+    errors = set()
+    converted = {}
+    if stale:
+        os.makedirs(EXTRACT_DIR, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="layers-", dir=EXTRACT_DIR) as work_root:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT) as executor:
+                futures = {}
+                for index in sorted(stale):
+                    gdb_path, layer_name = tasks[index]
+                    logger.info(f"Processing layer: {layer_name} from {gdb_path}")
+                    futures[executor.submit(_convert_task, index, gdb_path, layer_name, work_root)] = index
+                    progress(steps[index], "queued", layer=layer_name)
+                
+                for future in as_completed(futures):
+                    index = futures[future]
+                    layer_name = tasks[index][1]
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing layer {layer_name}: {e}")
+                        progress(steps[index], "failed", message=str(e))
+                        errors.add(index)
                         continue
-                        
-                    logger.info(f"Processing layer: {layer_name}")
-                    
-                    # Read the layer with GeoPandas
-                    gdf = gpd.read_file(gdb_path, layer=layer_name)
-                    
-                    if len(gdf) == 0:
-                        logger.warning(f"Layer {layer_name} is empty, skipping")
+                    if entry is None:
+                        progress(steps[index], "skipped", message="Layer is empty")
                         continue
-                    
-                    # Generate a clean layer ID
-                    layer_id = layer_name.replace(' ', '_').lower()
-                    
-                    # Convert to GeoJSON
-                    geojson_path = os.path.join(DATA_DIR, f"{layer_id}.geojson")
-                    
-                    # Try to extract styling information
-                    style_info = extract_style_info(layer_name, gdf)
-                    
-                    # Try to extract label information if it's a point or polygon layer
-                    geometry_type = None
-                    if not gdf.empty:
-                        geometry_type = gdf.geometry.iloc[0].geom_type
-                    
-                    # Save style information if available
-                    if style_info:
-                        style_path = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
-                        with open(style_path, "w", encoding="utf-8") as f:
-                            json.dump(style_info, f, indent=2)
-                    
-                    # Save as GeoJSON
-                    gdf.to_file(geojson_path, driver="GeoJSON")
-                    
-                    # Add layer to the list
-                    layers_entry = {
-                        "id": layer_id,
-                        "name": layer_name,
-                        "filename": f"{layer_id}.geojson",
-                        "feature_count": len(gdf),
-                        "has_style": bool(style_info),
-                        "geometry_type": geometry_type,
-                        "properties": list(gdf.columns)
-                    }
-                    
-                    # If this layer ID already exists in the all_layers list,
-                    # keep the one with more features
-                    existing_layer = next((l for l in all_layers if l["id"] == layer_id), None)
-                    if existing_layer:
-                        if len(gdf) > existing_layer["feature_count"]:
-                            # Replace the existing entry
-                            all_layers.remove(existing_layer)
-                            all_layers.append(layers_entry)
-                    else:
-                        all_layers.append(layers_entry)
-                    
-                    logger.info(f"Converted layer {layer_name} to GeoJSON with {len(gdf)} features")
-                except Exception as e:
-                    logger.error(f"Error processing layer {layer_name}: {e}")
-        except Exception as e:
-            logger.error(f"Error listing layers in geodatabase {gdb_path}: {e}")
-    
-    return all_layers
+                    results[index] = entry
+                    progress(steps[index], "done", layer_id=entry["id"], feature_count=entry["feature_count"])
+            
+            converted = {entry["id"]: entry for entry in merge_converted_layers(results, work_root)}
+    
+    # Only record layers where every task succeeded, so failures are retried
+    failed = {clean_layer_id(tasks[index][1]) for index in errors}
+    for layer_id in {clean_layer_id(tasks[index][1]) for index in stale} - failed:
+        entry = converted.get(layer_id)
+        manifest.record(f"extract_mpk/{layer_id}", group_sources[layer_id], settings,
+                        layer_output_files(entry) if entry else [], info=entry)
+    manifest.save()
+    
+    # Keep the discovery order of the layers
+    return [converted.get(layer_id) or up_to_date[layer_id]
+            for layer_id in groups if layer_id in converted or layer_id in up_to_date]
 
 def extract_style_info(layer_name, gdf):
     """Extract styling information from the layer"""
@@ -254,54 +428,30 @@ def extract_style_info(layer_name, gdf):
         'waterbody': '#3B7AB8',      # Alternative name
     }
     
-    # Set default styles based on geometry type
-    default_style = {
-        "weight": 2,
-        "opacity": 1,
-        "fillOpacity": 0.5
+    # Predefined color schemes for specific feature types
+    preset_colors = {
+        'road': ['#999999', '#666666', '#333333', '#FF7F00', '#E31A1C'],
+        'building': ['#A8A8A8', '#CCCCCC', '#666666', '#333333', '#DFDFDF'],
+        'landuse': ['#2BAB45', '#66C266', '#B3E3B3', '#78AB46', '#ADFA96'],
+        'water': ['#3B7AB8', '#6BAED6', '#9ECAE1', '#C6DBEF', '#2171B5'],
+        'landmark': ['#E63A24', '#FC4E2A', '#FD8D3C', '#FDBB84', '#E6550D']
     }
     
-    # Determine color based on layer name
+    # Determine color and color scheme based on layer name
     layer_name_lower = layer_name.lower()
-    layer_color = None
-    
-    for name_part, color in layer_specific_colors.items():
-        if name_part in layer_name_lower:
-            layer_color = color
-            break
-    
-    if not layer_color:
-        # Default colors if layer name not recognized
-        if geometry_type == 'Polygon' or geometry_type == 'MultiPolygon':
-            layer_color = '#3388ff'  # Blue for polygons
-        elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
-            layer_color = '#ff7800'  # Orange for lines
-        elif geometry_type == 'Point' or geometry_type == 'MultiPoint':
-            layer_color = '#e41a1c'  # Red for points
-        else:
-            layer_color = '#808080'  # Gray for unknown types
-    
-    # Adjust defaults based on geometry type
-    if geometry_type == 'Polygon' or geometry_type == 'MultiPolygon':
-        default_style["fillColor"] = layer_color
-        default_style["color"] = "#000000"
-        default_style["weight"] = 1
-        default_style["fillOpacity"] = 0.7
-    elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
-        default_style["color"] = layer_color
-        default_style["weight"] = 3 
-    elif geometry_type == 'Point' or geometry_type == 'MultiPoint':
-        default_style["radius"] = 6
-        default_style["fillColor"] = layer_color
-        default_style["color"] = "#000000"
-        default_style["weight"] = 1
-        default_style["fillOpacity"] = 0.8
+    layer_color = next((color for name_part, color in layer_specific_colors.items()
+                        if name_part in layer_name_lower), None)
+    color_scheme = next((scheme for key, scheme in preset_colors.items()
+                         if key in layer_name_lower), None)
     
+    # One profile of every column drives the categorical styles
+    profile = style_inference.profile_frame(gdf)
     style_info = {
         "type": "default",
         "geometry_type": geometry_type,
-        "property_styles": {},
-        "default_style": default_style,
+        "property_styles": style_inference.property_styles(profile, geometry_type, color_scheme),
+        "default_style": style_inference.default_style(
+            geometry_type, layer_color or style_inference.fallback_color(geometry_type)),
         "layer_name": layer_name
     }
     
@@ -325,111 +475,6 @@ def extract_style_info(layer_name, gdf):
             "haloWidth": 2
         }
     
-    # Check for styling attributes in the dataframe
-    style_columns = []
-    
-    # Common style-related column names
-    style_attrs = [
-        'COLOR', 'SYMBOL', 'WIDTH', 'STYLE', 'FILL', 'STROKE', 'OUTLINE', 
-        'TYPE', 'CATEGORY', 'CLASS', 'CODE', 'STATUS', 'KIND', 'FUNCTION', 
-        'USE', 'LEVEL', 'IMPORTANCE'
-    ]
-    
-    # Find columns that might contain style info (more lenient matching)
-    for col in gdf.columns:
-        col_upper = col.upper()
-        if any(attr in col_upper for attr in style_attrs):
-            style_columns.append(col)
-    
-    # If no style columns found, try to use columns with few unique values
-    if not style_columns:
-        for col in gdf.columns:
-            if col.lower() not in ['geometry', 'shape', 'objectid', 'fid', 'id']:
-                try:
-                    unique_count = gdf[col].nunique()
-                    if 1 < unique_count <= min(10, len(gdf) / 5):
-                        style_columns.append(col)
-                except:
-                    continue
-    
-    # If we found potential style columns, analyze them
-    if style_columns:
-        for col in style_columns:
-            try:
-                # Get unique values and their counts
-                value_counts = gdf[col].value_counts()
-                
-                # Only use for styling if there's more than one value 
-                # and less than 30% of the total features
-                if 1 < len(value_counts) <= min(20, len(gdf) * 0.3):
-                    unique_values = value_counts.index.tolist()
-                    
-                    # Create a style entry for this property
-                    style_info["property_styles"][col] = {
-                        "type": "categorical",
-                        "field": col,
-                        "values": {}
-                    }
-                    
-                    # Predefined color schemes for specific feature types
-                    preset_colors = {
-                        'road': ['#999999', '#666666', '#333333', '#FF7F00', '#E31A1C'],
-                        'building': ['#A8A8A8', '#CCCCCC', '#666666', '#333333', '#DFDFDF'],
-                        'landuse': ['#2BAB45', '#66C266', '#B3E3B3', '#78AB46', '#ADFA96'],
-                        'water': ['#3B7AB8', '#6BAED6', '#9ECAE1', '#C6DBEF', '#2171B5'],
-                        'landmark': ['#E63A24', '#FC4E2A', '#FD8D3C', '#FDBB84', '#E6550D']
-                    }
-                    
-                    # Determine which color scheme to use
-                    color_scheme = None
-                    for key, scheme in preset_colors.items():
-                        if key in layer_name.lower():
-                            color_scheme = scheme
-                            break
-                    
-                    # Generate or select colors for each unique value
-                    for i, val in enumerate(unique_values):
-                        if val is not None:
-                            # Determine color
-                            if color_scheme and i < len(color_scheme):
-                                color = color_scheme[i]
-                            else:
-                                # Generate a color using golden ratio method for visual distinction
-                                hue = (i * 137.508) % 360
-                                r, g, b = colorsys.hsv_to_rgb(hue / 360, 0.7, 0.9)
-                                color = f"#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}"
-                            
-                            # Create a style for this value
-                            value_style = {}
-                            
-                            if geometry_type == 'Polygon' or geometry_type == 'MultiPolygon':
-                                value_style["fillColor"] = color
-                                value_style["color"] = "#000000"
-                                value_style["weight"] = 1
-                                value_style["fillOpacity"] = 0.7
-                            elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
-                                value_style["color"] = color
-                                # Adjust line width based on importance if possible
-                                if 'type' in col.lower() or 'class' in col.lower() or 'importance' in col.lower():
-                                    try:
-                                        # Try to convert value to number for width
-                                        if isinstance(val, (int, float)):
-                                            width = min(max(val, 1), 8)  # Constrain between 1-8
-                                            value_style["weight"] = width
-                                        # For text categories, use position in the list
-                                        else:
-                                            normalized_pos = (i / len(unique_values)) * 5 + 1
-                                            value_style["weight"] = normalized_pos
-                                    except:
-                                        pass
-                            elif geometry_type == 'Point' or geometry_type == 'MultiPoint':
-                                value_style["fillColor"] = color
-                                value_style["radius"] = 6 + i % 4  # Vary radius slightly
-                            
-                            style_info["property_styles"][col]["values"][str(val)] = value_style
-            except Exception as e:
-                logger.warning(f"Error processing style column {col}: {e}")
-    
     return style_info
 
 def create_layer_index(layers):
@@ -446,19 +491,26 @@ def create_layer_index(layers):
     
     logger.info(f"Layer index created with {len(layers)} layers")
 
-def main():
-    """Main function to extract and convert MPK file"""
+def main(progress=_no_progress):
+    """Main function to extract and convert MPK file
+    
+    Returns the extracted layers, or None if the MPK could not be extracted.
+    progress(step, status, **details) is called as each step is processed.
+    """
     logger.info("=== MPK Extraction and Conversion Tool ===")
     
     # Extract the MPK file
+    progress("extract", "running")
     if not extract_mpk():
-        return
+        progress("extract", "failed")
+        return None
+    progress("extract", "done")
     
     # Get map information
     map_info = get_map_info()
     
     # Extract layers from geodatabase
-    layers = extract_layers_from_gdb()
+    layers = extract_layers_from_gdb(progress)
     
     if not layers:
         logger.warning("No layers were extracted from the geodatabase")
@@ -470,9 +522,18 @@ def main():
         logger.info("No alternative JSON files process implemented yet")
     
     # Create layer index
+    progress("index", "running")
     create_layer_index(layers)
+    progress("index", "done", layer_count=len(layers))
+    
+    # Load every indexed layer into the GeoPackage backend
+    if geopackage.ENABLED and layers:
+        progress("geopackage", "running")
+        geopackage.build_geopackage(DATA_DIR)
+        progress("geopackage", "done")
     
     logger.info("Processing complete!")
+    return layers
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
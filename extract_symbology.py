@@ -8,6 +8,9 @@ import sys
 import xml.etree.ElementTree as ET
 from pathlib import Path
 
+import classification
+import compression
+
 # Configure logging with UTF-8 support
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(levelname)s - %(message)s',
@@ -19,6 +22,10 @@ MPK_EXTRACT_DIR = "mpk_extract"
 OUTPUT_DIR = "static/data"
 STYLE_DIR = "static/styles"
 
+# Classes of generated range styles (ArcMap's default: natural breaks, 5 classes)
+THEMATIC_METHOD = "jenks"
+THEMATIC_CLASSES = 5
+
 # Ensure directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(STYLE_DIR, exist_ok=True)
@@ -133,6 +140,7 @@ def create_detailed_style(layer_id, layer_info):
     style_file = os.path.join(STYLE_DIR, f"{layer_id}_style.json")
     with open(style_file, 'w', encoding='utf-8') as f:
         json.dump(style_info, f, ensure_ascii=False, indent=2)
+    compression.write_compressed(style_file)
     
     logger.info(f"Created detailed style for layer: {layer_id}")
     return style_info
@@ -150,11 +158,22 @@ def get_thematic_property(layer_id):
     }
     return property_mapping.get(layer_id, "value")
 
+def thematic_breaks(layer_id, property_name):
+    """Compute class breaks of a property from the layer's GeoJSON, or None"""
+    geojson_path = os.path.join(OUTPUT_DIR, f"{layer_id}.geojson")
+    try:
+        with open(geojson_path, 'r', encoding='utf-8') as f:
+            features = json.load(f).get('features', [])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read {geojson_path} for classification: {e}")
+        return None
+    values = classification.property_column(features, property_name)
+    return classification.compute_breaks(values, THEMATIC_METHOD, THEMATIC_CLASSES) or None
+
 def create_thematic_styles(layer_id):
     """Create thematic styles based on property values"""
-    # In a real implementation, this would look at the actual MXD classification
-    # and use proper breaks and colors
-    
     # Define color scales for different thematic maps
     color_scales = {
         "electricity": ["#FFFFCC", "#FFEDA0", "#FED976", "#FEB24C", "#FD8D3C", "#FC4E2A", "#E31A1C", "#B10026"],
@@ -179,10 +198,15 @@ def create_thematic_styles(layer_id):
         }
     }
     
-    # Create 5 ranges
-    for i in range(5):
-        min_val = i * 20
-        max_val = (i + 1) * 20
+    # Classify the layer's own values, falling back to 0-100 in steps of 20
+    # for indicator scores when the layer has not been extracted yet
+    breaks = thematic_breaks(layer_id, property_name)
+    if not breaks:
+        breaks = [i * 20 for i in range(THEMATIC_CLASSES + 1)]
+    
+    for i in range(len(breaks) - 1):
+        min_val = breaks[i]
+        max_val = breaks[i + 1]
         color_idx = min(i, len(colors) - 1)
         
         style = {
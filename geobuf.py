@@ -0,0 +1,222 @@
+"""
+Geobuf encoding of GeoJSON layers.
+
+Geobuf is a compact protobuf encoding of GeoJSON: coordinates are quantized
+to a fixed number of decimals and delta-encoded as zigzag varints, and
+property names are stored once per file. The ETL scripts write a .geobuf
+copy next to every .geojson output, and the web app serves it to clients
+that ask for it (see GEOBUF_MIMETYPE).
+
+Follows version 3 of the Geobuf format (https://github.com/mapbox/geobuf).
+"""
+import os
+import json
+import math
+import logging
+
+import protobuf as pb
+
+logger = logging.getLogger(__name__)
+
+GEOBUF_MIMETYPE = 'application/vnd.geobuf'
+
+# Decimal digits kept of each coordinate (6 digits is about 0.1 m)
+DEFAULT_PRECISION = 6
+
+# Geometry types
+GEOMETRY_TYPES = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 2,
+    'MultiLineString': 3,
+    'Polygon': 4,
+    'MultiPolygon': 5,
+    'GeometryCollection': 6,
+}
+
+# Members that are encoded as fields rather than custom properties
+_SPECIAL_KEYS = {
+    'FeatureCollection': {'type', 'features'},
+    'Feature': {'type', 'id', 'properties', 'geometry'},
+    'GeometryCollection': {'type', 'geometries'},
+}
+_GEOMETRY_KEYS = {'type', 'coordinates'}
+
+# Largest integer stored as a varint; larger ones are written as doubles
+_MAX_VARINT = 2 ** 64 - 1
+
+
+def geobuf_path(geojson_path):
+    """Return the path of the Geobuf copy of a .geojson file"""
+    return f"{os.path.splitext(geojson_path)[0]}.geobuf"
+
+
+def _dimensions(geometry):
+    # Largest number of values per position in a geometry
+    if not geometry:
+        return 0
+    if geometry.get('type') == 'GeometryCollection':
+        return max((_dimensions(g) for g in geometry.get('geometries', [])), default=0)
+    coords = geometry.get('coordinates')
+    while coords and isinstance(coords[0], list):
+        coords = coords[0]
+    return len(coords) if coords else 0
+
+
+class _Encoder:
+    def __init__(self, precision, dimensions):
+        self.factor = 10 ** precision
+        self.dimensions = dimensions
+        self.keys = {}
+
+    def key_index(self, key):
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys[key] = len(self.keys)
+        return index
+
+    def value(self, value):
+        if value is None:
+            return b''
+        if isinstance(value, str):
+            return pb.field_string(1, value)
+        if isinstance(value, bool):
+            return pb.field_varint(5, int(value))
+        if isinstance(value, (int, float)):
+            if isinstance(value, float) and not (math.isfinite(value) and value.is_integer()):
+                return pb.field_double(2, value)
+            value = int(value)
+            if abs(value) > _MAX_VARINT:
+                return pb.field_double(2, float(value))
+            return pb.field_varint(3, value) if value >= 0 else pb.field_varint(4, -value)
+        return pb.field_string(6, json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+
+    def properties(self, props, values, skip=()):
+        # Appends the values to the message's values list and returns the
+        # (key index, value index) pairs; a message has one values list for
+        # its properties and custom properties alike
+        indexes = []
+        for key, value in props.items():
+            if key in skip:
+                continue
+            indexes.extend((self.key_index(key), len(values)))
+            values.append(pb.field_bytes(13, self.value(value)))
+        return indexes
+
+    def property_fields(self, values, *fields):
+        # Values come first so decoders can resolve the indexes as they read them
+        out = list(values)
+        for field, indexes in fields:
+            if indexes:
+                out.append(pb.field_packed(field, indexes))
+        return b''.join(out)
+
+    def line(self, coords, points, closed=False):
+        # Positions are delta-encoded within each line; a closed ring drops
+        # its repeated last position
+        factor = self.factor
+        dimensions = self.dimensions
+        previous = [0] * dimensions
+        for point in points[:len(points) - 1] if closed else points:
+            for d in range(dimensions):
+                n = math.floor((point[d] if d < len(point) else 0) * factor + 0.5)
+                coords.append(n - previous[d])
+                previous[d] = n
+
+    def geometry(self, geometry):
+        gtype = geometry['type']
+        out = [pb.field_varint(1, GEOMETRY_TYPES[gtype])]
+        coordinates = geometry.get('coordinates')
+        lengths = None
+        coords = []
+        if gtype == 'Point':
+            # Padded like the positions of lines, so every position has all dimensions
+            coords = [math.floor((coordinates[d] if d < len(coordinates) else 0) * self.factor + 0.5)
+                      for d in range(self.dimensions)]
+        elif gtype in ('MultiPoint', 'LineString'):
+            self.line(coords, coordinates)
+        elif gtype in ('MultiLineString', 'Polygon'):
+            closed = gtype == 'Polygon'
+            if len(coordinates) != 1:
+                lengths = [len(line) - closed for line in coordinates]
+            for line in coordinates:
+                self.line(coords, line, closed)
+        elif gtype == 'MultiPolygon':
+            if len(coordinates) != 1 or len(coordinates[0]) != 1:
+                lengths = [len(coordinates)]
+                for polygon in coordinates:
+                    lengths.append(len(polygon))
+                    lengths.extend(len(ring) - 1 for ring in polygon)
+            for polygon in coordinates:
+                for ring in polygon:
+                    self.line(coords, ring, closed=True)
+        elif gtype == 'GeometryCollection':
+            for member in geometry.get('geometries', []):
+                out.append(pb.field_bytes(4, self.geometry(member)))
+
+        if lengths is not None:
+            out.append(pb.field_packed(2, lengths))
+        if coords:
+            out.append(pb.field_packed_sint(3, coords))
+        values = []
+        custom = self.properties(geometry, values, _SPECIAL_KEYS.get(gtype, _GEOMETRY_KEYS))
+        out.append(self.property_fields(values, (15, custom)))
+        return b''.join(out)
+
+    def feature(self, feature):
+        out = []
+        if feature.get('geometry'):
+            out.append(pb.field_bytes(1, self.geometry(feature['geometry'])))
+        fid = feature.get('id')
+        if fid is not None:
+            if isinstance(fid, int) and not isinstance(fid, bool):
+                out.append(pb.field_sint(12, fid))
+            else:
+                out.append(pb.field_string(11, str(fid)))
+        values = []
+        props = self.properties(feature.get('properties') or {}, values)
+        custom = self.properties(feature, values, _SPECIAL_KEYS['Feature'])
+        out.append(self.property_fields(values, (14, props), (15, custom)))
+        return b''.join(out)
+
+
+def encode(geojson, precision=DEFAULT_PRECISION):
+    """Encode a GeoJSON FeatureCollection, Feature or geometry as Geobuf bytes"""
+    gtype = geojson.get('type')
+    if gtype == 'FeatureCollection':
+        features = geojson.get('features', [])
+        dimensions = max((_dimensions(f.get('geometry')) for f in features), default=0)
+    elif gtype == 'Feature':
+        dimensions = _dimensions(geojson.get('geometry'))
+    else:
+        dimensions = _dimensions(geojson)
+    encoder = _Encoder(precision, max(dimensions, 2))
+
+    if gtype == 'FeatureCollection':
+        body = b''.join(pb.field_bytes(1, encoder.feature(f)) for f in features)
+        values = []
+        custom = encoder.properties(geojson, values, _SPECIAL_KEYS['FeatureCollection'])
+        body += encoder.property_fields(values, (15, custom))
+        data = pb.field_bytes(4, body)
+    elif gtype == 'Feature':
+        data = pb.field_bytes(5, encoder.feature(geojson))
+    else:
+        data = pb.field_bytes(6, encoder.geometry(geojson))
+
+    # Keys come first so decoders can resolve properties as they read them
+    header = b''.join(pb.field_string(1, key) for key in encoder.keys)
+    if encoder.dimensions != 2:
+        header += pb.field_varint(2, encoder.dimensions)
+    if precision != DEFAULT_PRECISION:
+        header += pb.field_varint(3, precision)
+    return header + data
+
+
+def write_geobuf(geojson, geojson_path, precision=DEFAULT_PRECISION):
+    """Write the Geobuf copy of a GeoJSON file next to it and return its path"""
+    path = geobuf_path(geojson_path)
+    encoded = encode(geojson, precision)
+    with open(path, 'wb') as f:
+        f.write(encoded)
+    logger.debug(f"Wrote {path} ({len(encoded)} bytes)")
+    return path
@@ -0,0 +1,187 @@
+"""
+Incremental reading and writing of GeoJSON FeatureCollections.
+
+Features are parsed from disk one at a time and encoded as they are sent,
+so memory use stays flat regardless of the size of the layer.
+"""
+import json
+
+from layer_store import encode_json
+
+# Bytes read from disk per refill
+READ_CHUNK_SIZE = 64 * 1024
+
+# Approximate bytes buffered before a chunk is handed to the server
+WRITE_CHUNK_SIZE = 64 * 1024
+
+# Starts every record of a GeoJSON text sequence (RFC 8142)
+RECORD_SEPARATOR = b'\x1e'
+
+_WHITESPACE = ' \t\n\r'
+
+# Characters that may follow a complete value (or key) inside an object or array
+_DELIMITERS = _WHITESPACE + ',:]}'
+
+
+class _Reader:
+    """Buffered text reader that decodes one JSON value at a time"""
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop consumed text so the buffer only ever holds a value or two
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character, or '' at end of input"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of the read buffer")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number cut off by the end of the buffer ("12" of "12.5") also
+                # decodes, so only accept values followed by a delimiter
+                if self.eof or (end < len(self.buf) and self.buf[end] in _DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_array(fp, key='features', chunk_size=READ_CHUNK_SIZE):
+    """Yield the items of the array stored under key in a top-level JSON object
+
+    Other top-level members are skipped. Yields nothing if key is missing.
+    """
+    reader = _Reader(fp, chunk_size)
+    reader.expect('{')
+    while reader.peek() not in ('}', ''):
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.expect('[')
+            while reader.peek() != ']':
+                yield reader.value()
+                if reader.peek() == ',':
+                    reader.expect(',')
+            return
+        reader.value()
+        if reader.peek() == ',':
+            reader.expect(',')
+
+
+def read_members(path, stop='features', chunk_size=READ_CHUNK_SIZE):
+    """Return the top-level members of a JSON file that come before the stop member
+
+    Only the start of the file is read when, as in the files the ETL
+    writes, the large features array comes last.
+    """
+    members = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f, chunk_size)
+        reader.expect('{')
+        while reader.peek() not in ('}', ''):
+            name = reader.value()
+            if name == stop:
+                break
+            reader.expect(':')
+            members[name] = reader.value()
+            if reader.peek() == ',':
+                reader.expect(',')
+    return members
+
+
+def join_geometry_stream(features, geometry_features):
+    """Yield features with their geometry joined by id from a stream of geometry features
+
+    The geometry store lists features in the order the layers sharing it
+    do, so geometries are usually met just in time. Geometries read ahead
+    of their feature are held until it comes, so other orders still join,
+    at the cost of memory.
+    """
+    geometry_features = iter(geometry_features)
+    pending = {}
+    for feature in features:
+        fid = feature.get('id')
+        geometry = None
+        if fid in pending:
+            geometry = pending.pop(fid)
+        else:
+            for candidate in geometry_features:
+                if candidate.get('id') == fid:
+                    geometry = candidate.get('geometry')
+                    break
+                pending[candidate.get('id')] = candidate.get('geometry')
+        yield dict(feature, geometry=geometry)
+
+
+def iter_features(path, chunk_size=READ_CHUNK_SIZE):
+    """Yield the features of a GeoJSON file one at a time"""
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_array(f, 'features', chunk_size)
+
+
+def stream_feature_collection(features, chunk_size=WRITE_CHUNK_SIZE):
+    """Yield a FeatureCollection as encoded chunks"""
+    parts = [b'{"type":"FeatureCollection","features":[']
+    size = 0
+    separator = b''
+    for feature in features:
+        encoded = encode_json(feature)
+        parts.append(separator)
+        parts.append(encoded)
+        separator = b','
+        size += len(encoded)
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts, size = [], 0
+    parts.append(b']}')
+    yield b''.join(parts)
+
+
+def stream_geojsonseq(features, chunk_size=WRITE_CHUNK_SIZE):
+    """Yield features as a GeoJSON text sequence (RFC 8142)
+
+    Each record is a record separator (RS, 0x1E), the feature and a newline.
+    """
+    parts = []
+    size = 0
+    for feature in features:
+        encoded = encode_json(feature)
+        parts.append(RECORD_SEPARATOR)
+        parts.append(encoded)
+        parts.append(b'\n')
+        size += len(encoded) + 2
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b''.join(parts)
@@ -0,0 +1,226 @@
+"""
+Precision-controlled GeoJSON output.
+
+Coordinates in degrees with 15 or more significant digits resolve well
+below a millimetre, which no map can show. Every GeoJSON file the ETL
+scripts write goes through write_geojson (or write_features for streamed
+conversions), which rounds coordinates to a number of decimals chosen by
+geometry type (PRECISION), or fewer for simplified copies whose tolerance
+makes extra digits meaningless. Vertices equal to the one before them
+after rounding are dropped, together with lines and rings that collapse.
+Files are written compactly and atomically, and their size is logged.
+Set GEOJSON_REPORT_SAVINGS=1 to also log the bytes saved against the
+full-precision encoding; measuring them encodes everything a second
+time, so it is off by default.
+
+The web app applies the same rounding to the layers it loads (see
+LayerStore), so responses it encodes itself match the written files.
+"""
+import os
+import math
+import logging
+
+import numpy as np
+
+from geobuf import DEFAULT_PRECISION
+from layer_store import encode_json
+from style_inference import geometry_family
+
+logger = logging.getLogger(__name__)
+
+# Decimals kept per geometry family (6 decimals of a degree is about 0.1 m,
+# the precision of the Geobuf copies); override with GEOJSON_PRECISION_<FAMILY>
+PRECISION = {
+    family: int(os.environ.get(f"GEOJSON_PRECISION_{family.upper()}", DEFAULT_PRECISION))
+    for family in ('point', 'line', 'polygon')
+}
+
+# Framing of the FeatureCollections written by write_features
+_HEADER = b'{"type":"FeatureCollection","features":['
+_FOOTER = b']}'
+
+# Log the bytes saved by rounding (costs a second, full-precision encoding)
+REPORT_SAVINGS = os.environ.get("GEOJSON_REPORT_SAVINGS") == "1"
+
+# Decimals finer than the tolerance of a simplified copy kept by tolerance_precision
+TOLERANCE_DIGITS = 1
+
+
+def tolerance_precision(tolerance):
+    """Return the decimals worth keeping for geometry simplified with a tolerance (in degrees)"""
+    return max(0, math.ceil(-math.log10(tolerance)) + TOLERANCE_DIGITS)
+
+
+def geometry_precision(geometry_type, tolerance=None):
+    """Return the decimals kept for a geometry type, capped for simplified copies"""
+    precision = PRECISION.get(geometry_family(geometry_type), DEFAULT_PRECISION)
+    if tolerance:
+        precision = min(precision, tolerance_precision(tolerance))
+    return precision
+
+
+def _round_paths(paths, precision):
+    # Round a list of paths in one vectorized pass and drop the vertices that
+    # repeat the one before them; returns the paths in the same order
+    lengths = np.array([len(path) for path in paths], dtype=np.intp)
+    if not lengths.sum():
+        return [[] for _ in paths]
+    try:
+        points = np.array([point for path in paths for point in path], dtype=np.float64)
+    except ValueError:
+        # Points of different dimensions
+        return [_round_path(path, precision) for path in paths]
+    points = np.round(points, precision)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (points[1:] != points[:-1]).any(axis=1)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    keep[starts[lengths > 0]] = True
+    path_index = np.repeat(np.arange(len(paths)), lengths)
+    kept_lengths = np.bincount(path_index[keep], minlength=len(paths))
+    rows = points[keep].tolist()
+    rounded = []
+    start = 0
+    for length in kept_lengths:
+        rounded.append(rows[start:start + length])
+        start += length
+    return rounded
+
+
+def _round_path(path, precision):
+    rounded = []
+    for point in path:
+        point = [round(value, precision) for value in point]
+        if not rounded or point != rounded[-1]:
+            rounded.append(point)
+    return rounded
+
+
+def _round_polygons(polygons, precision):
+    # Polygons whose exterior collapses are dropped, as are collapsed holes
+    rings = _round_paths([ring for polygon in polygons for ring in polygon], precision)
+    result = []
+    start = 0
+    for polygon in polygons:
+        polygon_rings = rings[start:start + len(polygon)]
+        start += len(polygon)
+        if polygon_rings and len(polygon_rings[0]) >= 4:
+            result.append([ring for ring in polygon_rings if len(ring) >= 4])
+    return result
+
+
+def quantize_geometry(geometry, tolerance=None):
+    """Return a copy of a GeoJSON geometry with rounded coordinates
+
+    Returns None when nothing of the geometry is left.
+    """
+    if not geometry:
+        return geometry
+    gtype = geometry.get('type')
+    if gtype == 'GeometryCollection':
+        members = [quantize_geometry(member, tolerance) for member in geometry.get('geometries', [])]
+        return dict(geometry, geometries=[member for member in members if member])
+
+    coords = geometry.get('coordinates')
+    if not coords:
+        return geometry
+    precision = geometry_precision(gtype, tolerance)
+    if gtype == 'Point':
+        coords = [round(value, precision) for value in coords]
+    elif gtype == 'MultiPoint':
+        coords = [[round(value, precision) for value in point] for point in coords]
+    elif gtype == 'LineString':
+        coords = _round_paths([coords], precision)[0]
+        if len(coords) < 2:
+            return None
+    elif gtype == 'MultiLineString':
+        coords = [line for line in _round_paths(coords, precision) if len(line) >= 2]
+        if not coords:
+            return None
+    elif gtype == 'Polygon':
+        polygons = _round_polygons([coords], precision)
+        if not polygons:
+            return None
+        coords = polygons[0]
+    elif gtype == 'MultiPolygon':
+        coords = _round_polygons(coords, precision)
+        if not coords:
+            return None
+    else:
+        return geometry
+    return dict(geometry, coordinates=coords)
+
+
+def quantize_feature(feature, tolerance=None):
+    """Return a copy of a feature with rounded coordinates"""
+    if not feature.get('geometry'):
+        return feature
+    return dict(feature, geometry=quantize_geometry(feature['geometry'], tolerance))
+
+
+def quantize(geojson, tolerance=None):
+    """Return a copy of a FeatureCollection with rounded coordinates"""
+    if not isinstance(geojson, dict) or 'features' not in geojson:
+        return geojson
+    return dict(geojson, features=[quantize_feature(feature, tolerance) for feature in geojson['features']])
+
+
+def _report(path, size, full_size=None):
+    if full_size is None:
+        logger.info(f"Wrote {path}: {size} bytes")
+        return
+    saved = full_size - size
+    share = saved / full_size * 100 if full_size else 0.0
+    logger.info(f"Wrote {path}: {size} bytes, {saved} bytes ({share:.1f}%) saved by coordinate rounding")
+
+
+def write_geojson(geojson, path, tolerance=None):
+    """Write a FeatureCollection with rounded coordinates and return the rounded copy
+
+    Pass the tolerance of simplified copies so they keep fewer decimals.
+    The returned copy is what the Geobuf and columnar copies should encode.
+    """
+    quantized = quantize(geojson, tolerance)
+    body = encode_json(quantized)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Replace the file rather than rewrite it: the app may be reading it
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(body)
+    os.replace(temp_path, path)
+    full_size = len(encode_json(geojson)) if REPORT_SAVINGS else None
+    _report(path, len(body), full_size)
+    return quantized
+
+
+def write_features(features, path, tolerance=None, keep=None):
+    """Stream features to a FeatureCollection file with rounded coordinates
+
+    Features are rounded, encoded and written one at a time. The rounded
+    features are appended to keep when it is a list. Returns the number of
+    features written.
+    """
+    count = 0
+    size = full_size = len(_HEADER) + len(_FOOTER)
+    measure = REPORT_SAVINGS
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER)
+        for feature in features:
+            rounded = quantize_feature(feature, tolerance)
+            if keep is not None:
+                keep.append(rounded)
+            encoded = encode_json(rounded)
+            if count:
+                f.write(b',')
+            f.write(encoded)
+            count += 1
+            size += len(encoded)
+            if measure:
+                full_size += len(encode_json(feature))
+        f.write(_FOOTER)
+    os.replace(temp_path, path)
+    # Both sizes include the commas between features
+    separators = max(count - 1, 0)
+    _report(path, size + separators, full_size + separators if measure else None)
+    return count
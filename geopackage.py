@@ -0,0 +1,461 @@
+"""
+GeoPackage storage backend for the served layers.
+
+When LAYER_GEOPACKAGE=1, the ETL scripts load every layer of the layer
+index into a single GeoPackage (SQLite) file in the data directory: one
+feature table per layer with an R-tree over the feature bounds and an index
+on every property column. Each row also keeps the feature's GeoJSON
+exactly as the app serves it, so bounding box, attribute and id lookups are
+indexed SQL queries whose results are copied into the response without
+parsing.
+
+The web app opens the file read-only, with one connection per worker
+thread, and answers from it only for layers whose files have not changed
+since they were loaded. Other layers are served from their GeoJSON files.
+"""
+import os
+import re
+import json
+import math
+import sqlite3
+import struct
+import logging
+import threading
+
+from geojson_writer import quantize
+from layer_query import format_value
+from layer_store import LayerStore, encode_json
+from spatial_index import geometry_bounds
+
+logger = logging.getLogger(__name__)
+
+# Build and serve the GeoPackage (set LAYER_GEOPACKAGE=1 to enable)
+ENABLED = os.environ.get("LAYER_GEOPACKAGE") == "1"
+
+GEOPACKAGE_FILENAME = "layers.gpkg"
+
+# Layer index written by the ETL scripts
+INDEX_FILENAME = "layers.json"
+
+# Coordinates are stored as WGS 84 longitude/latitude
+SRS_ID = 4326
+
+# Columns of every feature table; properties are stored under their own names
+RESERVED_COLUMNS = ('fid', 'geom', 'feature_id', 'feature_json')
+
+# Table recording the source file versions and untyped properties of each layer
+SOURCES_TABLE = 'layer_sources'
+
+_WGS84_DEFINITION = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+    'AUTHORITY["EPSG","4326"]]'
+)
+
+_WKB_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+# SQLite integers are 64-bit
+_MAX_INTEGER = 2 ** 63 - 1
+
+
+def geopackage_path(data_dir):
+    """Return the path of the layer GeoPackage in a data directory"""
+    return os.path.join(data_dir, GEOPACKAGE_FILENAME)
+
+
+def quote(name):
+    """Quote an SQL identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _points(coords):
+    return struct.pack('<I', len(coords)) + b''.join(struct.pack('<dd', p[0], p[1]) for p in coords)
+
+
+def wkb(geometry):
+    """Encode a GeoJSON geometry as little-endian 2D WKB"""
+    gtype = geometry['type']
+    header = struct.pack('<BI', 1, _WKB_TYPES[gtype])
+    coords = geometry.get('coordinates')
+    if gtype == 'Point':
+        point = coords if coords else (math.nan, math.nan)
+        return header + struct.pack('<dd', point[0], point[1])
+    if gtype == 'LineString':
+        return header + _points(coords)
+    if gtype == 'Polygon':
+        return header + struct.pack('<I', len(coords)) + b''.join(_points(ring) for ring in coords)
+    if gtype == 'GeometryCollection':
+        members = geometry.get('geometries', [])
+    else:
+        member_type = gtype[len('Multi'):]
+        members = [{'type': member_type, 'coordinates': part} for part in coords]
+    return header + struct.pack('<I', len(members)) + b''.join(wkb(member) for member in members)
+
+
+def gpkg_geometry(geometry, bounds):
+    """Encode a GeoJSON geometry as a GeoPackage geometry blob"""
+    if bounds is None:
+        # Empty geometry: no envelope, empty flag set
+        return b'GP' + bytes([0, 0x11]) + struct.pack('<i', SRS_ID) + wkb(geometry)
+    minx, miny, maxx, maxy = bounds
+    # Flags: little-endian, XY envelope
+    header = b'GP' + bytes([0, 0x03]) + struct.pack('<i4d', SRS_ID, minx, maxx, miny, maxy)
+    return header + wkb(geometry)
+
+
+def _column_type(values):
+    # Declared type of a property column, '' if it has no values, or None
+    # if its values do not share one SQL type
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add('BOOLEAN')
+        elif isinstance(value, int):
+            if abs(value) > _MAX_INTEGER:
+                return None
+            kinds.add('INTEGER')
+        elif isinstance(value, float):
+            if not math.isfinite(value):
+                return None
+            kinds.add('REAL')
+        elif isinstance(value, str):
+            kinds.add('TEXT')
+        else:
+            return None
+    if not kinds:
+        return ''
+    if kinds == {'INTEGER', 'REAL'}:
+        return 'REAL'
+    if len(kinds) != 1:
+        return None
+    return kinds.pop()
+
+
+def _table_name(layer_id, used):
+    name = re.sub(r'\W', '_', layer_id).lower() or 'layer'
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{name}_{n}"
+    used.add(candidate)
+    return candidate
+
+
+def _create_metadata_tables(conn):
+    conn.executescript(f'''
+        PRAGMA application_id = 1196444487;
+        PRAGMA user_version = 10300;
+        CREATE TABLE gpkg_spatial_ref_sys (
+            srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+        CREATE TABLE gpkg_contents (
+            table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+            description TEXT DEFAULT '',
+            last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+            min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+            srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id));
+        CREATE TABLE gpkg_geometry_columns (
+            table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+            PRIMARY KEY (table_name, column_name));
+        CREATE TABLE gpkg_extensions (
+            table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+            definition TEXT NOT NULL, scope TEXT NOT NULL);
+        CREATE TABLE {SOURCES_TABLE} (
+            table_name TEXT NOT NULL PRIMARY KEY, filename TEXT NOT NULL UNIQUE,
+            versions TEXT NOT NULL, feature_count INTEGER NOT NULL, untyped TEXT NOT NULL);
+    ''')
+    conn.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', [
+        ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+        ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+        ('WGS 84 geodetic', SRS_ID, 'EPSG', SRS_ID, _WGS84_DEFINITION, 'longitude/latitude'),
+    ])
+
+
+def _load_layer(conn, table, filename, entry):
+    features = entry.data.get('features', [])
+    properties = [feature.get('properties') or {} for feature in features]
+    names = list(dict.fromkeys(name for props in properties for name in props))
+
+    # SQLite column names are case-insensitive
+    taken = set(RESERVED_COLUMNS)
+    columns, untyped = [], []
+    for name in names:
+        kind = _column_type(props.get(name) for props in properties)
+        if kind == '':
+            # Only nulls: no predicate can match, as if the property were absent
+            continue
+        if kind is None or name.lower() in taken:
+            untyped.append(name)
+        else:
+            taken.add(name.lower())
+            columns.append((name, kind))
+
+    definitions = ''.join(f', {quote(name)} {kind}' for name, kind in columns)
+    conn.execute(f'CREATE TABLE {quote(table)} (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom GEOMETRY, '
+                 f'feature_id TEXT NOT NULL, feature_json TEXT NOT NULL{definitions})')
+    rtree = f"rtree_{table}_geom"
+    conn.execute(f'CREATE VIRTUAL TABLE {quote(rtree)} USING rtree(id, minx, maxx, miny, maxy)')
+
+    placeholders = ', '.join('?' * (4 + len(columns)))
+    rows, boxes = [], []
+    extent = None
+    for position, feature in enumerate(features):
+        fid = position + 1
+        geometry = feature.get('geometry')
+        bounds = geometry_bounds(geometry) if geometry else None
+        if bounds is not None:
+            boxes.append((fid, bounds[0], bounds[2], bounds[1], bounds[3]))
+            extent = bounds if extent is None else (
+                min(extent[0], bounds[0]), min(extent[1], bounds[1]),
+                max(extent[2], bounds[2]), max(extent[3], bounds[3]))
+        # Features are addressed by their id, or by position when they have none
+        feature_id = feature.get('id') if feature.get('id') is not None else position
+        # Booleans are stored as 0 and 1 in BOOLEAN columns
+        values = [properties[position].get(name) for name, _ in columns]
+        values = [int(value) if isinstance(value, bool) else value for value in values]
+        rows.append([fid, gpkg_geometry(geometry, bounds) if geometry else None,
+                     json.dumps(feature_id), encode_json(feature).decode('utf-8')] + values)
+    conn.executemany(f'INSERT INTO {quote(table)} VALUES ({placeholders})', rows)
+    conn.executemany(f'INSERT INTO {quote(rtree)} VALUES (?, ?, ?, ?, ?)', boxes)
+
+    conn.execute(f'CREATE INDEX {quote(f"{table}_feature_id")} ON {quote(table)} (feature_id)')
+    for number, (name, _) in enumerate(columns):
+        conn.execute(f'CREATE INDEX {quote(f"{table}_p{number}")} ON {quote(table)} ({quote(name)})')
+
+    extent = extent or (None, None, None, None)
+    conn.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (table, 'features', filename) + tuple(extent) + (SRS_ID,))
+    conn.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)', (table, 'geom', 'GEOMETRY', SRS_ID))
+    conn.execute('INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+                 (table, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree',
+                  'write-only'))
+    versions = [[filename, *entry.version]] + [[source, *version] for source, version in entry.sources]
+    conn.execute(f'INSERT INTO {SOURCES_TABLE} VALUES (?, ?, ?, ?, ?)',
+                 (table, filename, json.dumps(versions), len(features), json.dumps(untyped)))
+    return len(features)
+
+
+def layer_filenames(data_dir):
+    """Return the filenames of the layers listed in the layer index"""
+    with open(os.path.join(data_dir, INDEX_FILENAME), 'r', encoding='utf-8') as f:
+        layers = json.load(f)
+    return [layer.get('filename') or f"{layer['id']}.geojson" for layer in layers]
+
+
+def build_geopackage(data_dir, filenames=None):
+    """Load layers (by default every layer of the layer index) into the data directory's GeoPackage
+
+    The file is written next to the old one and swapped in, so the app
+    keeps reading the old file until it is complete. Returns its path.
+    """
+    if filenames is None:
+        filenames = layer_filenames(data_dir)
+    path = geopackage_path(data_dir)
+    temp_path = f"{path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    store = LayerStore(data_dir, quantize=quantize)
+    conn = sqlite3.connect(temp_path)
+    try:
+        _create_metadata_tables(conn)
+        used = set()
+        for filename in filenames:
+            try:
+                entry = store.get(filename)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping layer {filename} in the GeoPackage: {e}")
+                continue
+            table = _table_name(os.path.splitext(os.path.basename(filename))[0], used)
+            count = _load_layer(conn, table, filename, entry)
+            logger.info(f"Loaded {count} features of {filename} into the GeoPackage")
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(temp_path, path)
+    return path
+
+
+def _text(value, is_bool):
+    # Lower-cased value as the browser stringifies it, for substring filters
+    if value is None:
+        return None
+    return format_value(bool(value) if is_bool else value).lower()
+
+
+class GeoPackageLayers:
+    """Read-only access to the layer GeoPackage, with one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (file version, {filename: layer info}) of the file last read
+        self._layers = (None, {})
+
+    def _version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _connection(self, version):
+        # Each thread keeps its connection until the file is replaced
+        cached = getattr(self._local, 'connection', None)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if cached is not None:
+            cached[1].close()
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.create_function('layer_text', 2, _text, deterministic=True)
+        self._local.connection = (version, conn)
+        return conn
+
+    def _layer_info(self, version, conn):
+        with self._lock:
+            if self._layers[0] == version:
+                return self._layers[1]
+        layers = {}
+        for table, filename, versions, count, untyped in conn.execute(
+                f'SELECT table_name, filename, versions, feature_count, untyped FROM {SOURCES_TABLE}'):
+            columns = {
+                name: kind.upper()
+                for _, name, kind, *_ in conn.execute(f'PRAGMA table_info({quote(table)})')
+                if name not in RESERVED_COLUMNS
+            }
+            layers[filename] = {
+                'table': table,
+                'versions': [(source, (mtime_ns, size)) for source, mtime_ns, size in json.loads(versions)],
+                'feature_count': count,
+                'untyped': frozenset(json.loads(untyped)),
+                'columns': columns,
+            }
+        with self._lock:
+            self._layers = (version, layers)
+        return layers
+
+    def layer(self, filename, file_version):
+        """Return a GeoPackageLayer for a layer, or None if it is missing or out of date
+
+        file_version(filename) returns the current (mtime_ns, size) of a
+        layer file, as LayerStore.file_version does.
+        """
+        version = self._version()
+        if version is None:
+            return None
+        conn = self._connection(version)
+        info = self._layer_info(version, conn).get(filename)
+        if info is None:
+            return None
+        try:
+            if any(file_version(source) != source_version for source, source_version in info['versions']):
+                return None
+        except FileNotFoundError:
+            return None
+        return GeoPackageLayer(conn, info)
+
+
+class GeoPackageLayer:
+    """Indexed queries against one layer table"""
+
+    def __init__(self, conn, info):
+        self.conn = conn
+        self.table = quote(info['table'])
+        self.rtree = quote(f"rtree_{info['table']}_geom")
+        self.feature_count = info['feature_count']
+        self.untyped = info['untyped']
+        self.columns = info['columns']
+
+    def covers(self, names):
+        """Return True if every named property can be answered from the table"""
+        return not any(name in self.untyped for name in names)
+
+    def bbox(self, xmin, ymin, xmax, ymax):
+        """Return the GeoJSON text of the features whose bounds intersect an extent"""
+        rows = self.conn.execute(
+            f'SELECT f.feature_json FROM {self.table} f JOIN {self.rtree} r ON f.fid = r.id '
+            'WHERE r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ? ORDER BY f.fid',
+            (xmax, xmin, ymax, ymin))
+        return [text for text, in rows]
+
+    def select(self, predicates):
+        """Return the GeoJSON text of the features matching every (op, property, value) predicate
+
+        Has the semantics of AttributeIndex.select.
+        """
+        clauses, params = [], []
+        for op, prop, value in predicates:
+            clause = self._clause(op, prop, value, params)
+            if clause is None:
+                return []
+            clauses.append(clause)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.conn.execute(f'SELECT feature_json FROM {self.table}{where} ORDER BY fid', params)
+        return [text for text, in rows]
+
+    def feature(self, feature_id):
+        """Return the GeoJSON text of the feature with an id (or position), or None"""
+        keys = [json.dumps(feature_id)]
+        # Ids arrive in URLs, so numeric ids come as strings
+        if isinstance(feature_id, str) and feature_id.lstrip('-').isdigit():
+            keys.append(json.dumps(int(feature_id)))
+        row = self.conn.execute(
+            f'SELECT feature_json FROM {self.table} WHERE feature_id IN ({", ".join("?" * len(keys))}) '
+            'ORDER BY fid LIMIT 1', keys).fetchone()
+        return row[0] if row else None
+
+    def _clause(self, op, prop, value, params):
+        # SQL condition for one predicate, or None if it cannot match
+        kind = self.columns.get(prop)
+        if kind is None:
+            return None
+        column = quote(prop)
+        if op in ('min', 'max'):
+            if kind not in ('INTEGER', 'REAL'):
+                return None
+            params.append(value)
+            return f"{column} >= ?" if op == 'min' else f"{column} <= ?"
+        if op == 'eq':
+            target = self._eq_value(kind, str(value))
+            if target is None:
+                return None
+            params.append(target)
+            return f"{column} = ?"
+        params.append(str(value).lower())
+        return f"instr(layer_text({column}, {int(kind == 'BOOLEAN')}), ?) > 0"
+
+    @staticmethod
+    def _eq_value(kind, text):
+        # Stored value whose formatted form is text, or None
+        if kind == 'TEXT':
+            return text
+        if kind == 'BOOLEAN':
+            return {'true': 1, 'false': 0}.get(text)
+        try:
+            number = int(text) if kind == 'INTEGER' else float(text)
+        except ValueError:
+            return None
+        return number if format_value(number) == text else None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    path = build_geopackage(os.path.join('static', 'data'))
+    logger.info(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
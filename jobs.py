@@ -0,0 +1,127 @@
+"""
+Background job runner for long-running tasks started from the API.
+
+Jobs run on a single worker thread so at most one runs at a time, and a
+job kind (e.g. "extract-mpk") can only be queued once until it finishes.
+Tasks report progress per step through the callback they are given, and
+the API exposes each job's state as a plain dict.
+"""
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for status lookups before the oldest are forgotten
+MAX_FINISHED_JOBS = 50
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class JobConflictError(RuntimeError):
+    """Raised when a job of the same kind is already queued or running"""
+
+    def __init__(self, job):
+        super().__init__(f"{job.kind} job {job.id} is already {job.status}")
+        self.job = job
+
+
+class Job:
+    """State of one background task and its steps"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.steps = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def progress(self, step, status, **details):
+        """Record the status of a step (passed to tasks as their progress callback)"""
+        with self._lock:
+            entry = self.steps.setdefault(step, {'name': step})
+            entry.update(details)
+            entry['status'] = status
+            entry['updatedAt'] = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            steps = [dict(step) for step in self.steps.values()]
+        finished = sum(1 for step in steps if step['status'] in ('done', 'failed', 'skipped'))
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+            'error': self.error,
+            'result': self.result,
+            'progress': {'finished': finished, 'total': len(steps)},
+            'steps': steps
+        }
+
+
+class JobRunner:
+    """Runs jobs one at a time on a background thread"""
+
+    def __init__(self, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, task):
+        """Queue task(progress) as a new job and return the Job
+
+        Raises JobConflictError if a job of the same kind is still active.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and job.active:
+                    raise JobConflictError(job)
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job, task)
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def get(self, job_id):
+        """Return the job with the given id, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, task):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = task(job.progress)
+            job.status = SUCCEEDED
+            logger.info(f"{job.kind} job {job.id} finished")
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            logger.error(f"{job.kind} job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,193 @@
+"""
+In-memory catalog of the layers in the data directory.
+
+The layer index comes from layers.json when it is readable, else from the
+GeoJSON files in the data directory. A background thread polls the
+modification times of the data, geometry and style files and rebuilds the
+index only when one of them changed; feature counts are computed once per
+file version with the streaming reader. Listing the layers is therefore a
+lookup, whatever the number and size of the layers.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+
+from geojson_stream import iter_features
+from layer_store import GEOMETRY_DIR, encode_json, version_time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for changed files (override with LAYER_CATALOG_POLL_SECONDS)
+POLL_INTERVAL = float(os.environ.get("LAYER_CATALOG_POLL_SECONDS", 2.0))
+
+# Layer index written by the ETL scripts
+INDEX_FILENAME = "layers.json"
+
+
+def scan_metadata(path):
+    """Count the features of a GeoJSON file and find its geometry type, streaming it from disk"""
+    feature_count = 0
+    geometry_type = None
+    for feature in iter_features(path):
+        feature_count += 1
+        if geometry_type is None and feature.get('geometry'):
+            geometry_type = feature['geometry'].get('type')
+    return {'feature_count': feature_count, 'geometry_type': geometry_type}
+
+
+class LayerCatalog:
+    """Layer index kept current by polling file modification times"""
+
+    def __init__(self, data_dir, style_dir, poll_interval=POLL_INTERVAL):
+        self.data_dir = data_dir
+        self.style_dir = style_dir
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._files = None
+        # path -> ((mtime_ns, size), metadata) for scanned GeoJSON files
+        self._metadata = {}
+        self._layers = []
+        # Ids and filenames of the indexed layers
+        self._names = frozenset()
+        self._body = b'[]'
+        self._fingerprint = None
+        self._last_modified = None
+        self._poller = None
+        self._stop = threading.Event()
+
+    def layers(self):
+        """Return the current layer index (shared; do not modify it)"""
+        self._start()
+        with self._lock:
+            return self._layers
+
+    def has_layer(self, name):
+        """Return True if name is the id or filename of an indexed layer"""
+        self._start()
+        with self._lock:
+            return name in self._names
+
+    def snapshot(self):
+        """Return the JSON-encoded index with its fingerprint and last modified time"""
+        self._start()
+        with self._lock:
+            return self._body, self._fingerprint, self._last_modified
+
+    @property
+    def fingerprint(self):
+        """Hex string identifying the current version of every watched file"""
+        self._start()
+        with self._lock:
+            return self._fingerprint
+
+    @property
+    def last_modified(self):
+        """Latest modification time of the watched files (a UTC datetime)"""
+        self._start()
+        with self._lock:
+            return self._last_modified
+
+    def refresh(self):
+        """Check the watched files now and rebuild the index if any changed"""
+        with self._refresh_lock:
+            files = self._scan_files()
+            if files == self._files:
+                return False
+            layers = self._build_layers(files)
+            body = encode_json(layers)
+            names = frozenset(layer[key] for layer in layers if isinstance(layer, dict)
+                              for key in ('id', 'filename') if isinstance(layer.get(key), str))
+            versions = sorted((path,) + version for path, version in files.items())
+            fingerprint = hashlib.sha256(repr(versions).encode('utf-8')).hexdigest()[:32]
+            last_modified = version_time(list(files.values()) or [(time.time_ns(), 0)])
+            with self._lock:
+                self._files = files
+                self._layers = layers
+                self._names = names
+                self._body = body
+                self._fingerprint = fingerprint
+                self._last_modified = last_modified
+            logger.info(f"Layer catalog refreshed: {len(layers)} layers")
+            return True
+
+    def close(self):
+        """Stop the polling thread"""
+        self._stop.set()
+
+    def _start(self):
+        # The first caller builds the index; the others wait for it
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            self.refresh()
+            poller = threading.Thread(target=self._poll, name='layer-catalog', daemon=True)
+            poller.start()
+            self._poller = poller
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing layer catalog: {e}")
+
+    def _scan_files(self):
+        # (mtime_ns, size) of every JSON file the index, styles or layers depend on
+        files = {}
+        for directory in (self.data_dir, os.path.join(self.data_dir, GEOMETRY_DIR), self.style_dir):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.endswith(('.geojson', '.json')) and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def _build_layers(self, files):
+        index_path = os.path.join(self.data_dir, INDEX_FILENAME)
+        if index_path in files:
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading layers index: {e}")
+
+        # Fall back to the GeoJSON files of the data directory
+        layers = []
+        metadata = {}
+        for path in sorted(files):
+            if os.path.dirname(path) != self.data_dir or not path.endswith('.geojson'):
+                continue
+            metadata[path] = self._file_metadata(path, files[path])
+            layer_id = os.path.splitext(os.path.basename(path))[0]
+            style_path = os.path.join(self.style_dir, f"{layer_id}_style.json")
+            layers.append({
+                'id': layer_id,
+                'name': layer_id.replace('_', ' ').title(),
+                'filename': os.path.basename(path),
+                'feature_count': metadata[path][1]['feature_count'],
+                'geometry_type': metadata[path][1]['geometry_type'],
+                'has_style': style_path in files
+            })
+        self._metadata = metadata
+        return layers
+
+    def _file_metadata(self, path, version):
+        cached = self._metadata.get(path)
+        if cached is not None and cached[0] == version:
+            return cached
+        try:
+            metadata = scan_metadata(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error counting features in {path}: {e}")
+            metadata = {'feature_count': 0, 'geometry_type': None}
+        return (version, metadata)
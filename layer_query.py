@@ -0,0 +1,167 @@
+"""
+Attribute queries against cached GeoJSON layers.
+
+An AttributeIndex is built once per layer version (see LayerStore.derive)
+and answers numeric range, equality and substring predicates without the
+client having to download and filter the whole layer.
+"""
+import bisect
+import math
+
+# Query string operators, used as "<op>.<property>=<value>"
+OPERATORS = ('min', 'max', 'eq', 'contains')
+
+
+def format_value(value):
+    """Format a property value the way the browser stringifies it"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def is_number(value):
+    """Return True for numeric (non-boolean, finite) property values"""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+
+def lookup_row(rows, feature_id):
+    """Return the row of a feature id in an id -> row mapping, or None
+
+    Ids arrive as JSON or in URLs, so numeric ids may come as strings.
+    """
+    row = rows.get(feature_id)
+    if row is None and isinstance(feature_id, str) and feature_id.lstrip('-').isdigit():
+        row = rows.get(int(feature_id))
+    return row
+
+
+def build_feature_rows(entry):
+    """Map the feature ids of a LayerStore entry to their positions
+
+    Features without an id are addressed by their position.
+    """
+    return {
+        feature.get('id') if feature.get('id') is not None else position: position
+        for position, feature in enumerate(entry.data.get('features', []))
+    }
+
+
+def parse_predicates(args):
+    """Parse "<op>.<property>=<value>" request arguments into predicates
+
+    Returns a list of (op, property, value) tuples. Raises ValueError for
+    unknown operators or non-numeric range bounds.
+    """
+    predicates = []
+    for key, value in args.items(multi=True):
+        op, sep, prop = key.partition('.')
+        if not sep:
+            continue
+        if op not in OPERATORS or not prop:
+            raise ValueError(f"Unknown filter '{key}'")
+        if op in ('min', 'max'):
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f"Filter '{key}' expects a number")
+        predicates.append((op, prop, value))
+    return predicates
+
+
+class AttributeIndex:
+    """Per-property indexes over the features of one layer
+
+    Indexes are built lazily the first time a property is queried and
+    reused for every later query against the same layer version.
+    """
+
+    def __init__(self, features):
+        self.features = features
+        self._numeric = {}
+        self._exact = {}
+        self._text = {}
+
+    def numeric(self, prop):
+        """Return (sorted values, matching feature indices) for a property"""
+        index = self._numeric.get(prop)
+        if index is None:
+            pairs = sorted(
+                (value, fid) for fid, value in self._values(prop) if is_number(value)
+            )
+            index = ([v for v, _ in pairs], [fid for _, fid in pairs])
+            self._numeric[prop] = index
+        return index
+
+    def exact(self, prop):
+        """Return a mapping of formatted value to feature indices"""
+        index = self._exact.get(prop)
+        if index is None:
+            index = {}
+            for fid, value in self._values(prop):
+                index.setdefault(format_value(value), []).append(fid)
+            self._exact[prop] = index
+        return index
+
+    def text(self, prop):
+        """Return (feature index, lower-cased value) pairs for substring scans"""
+        index = self._text.get(prop)
+        if index is None:
+            index = [(fid, format_value(value).lower()) for fid, value in self._values(prop)]
+            self._text[prop] = index
+        return index
+
+    def select(self, predicates):
+        """Return the sorted indices of features matching every predicate"""
+        # Range bounds on the same property collapse into one bisect
+        ranges = {}
+        others = []
+        for op, prop, value in predicates:
+            if op in ('min', 'max'):
+                low, high = ranges.get(prop, (-math.inf, math.inf))
+                ranges[prop] = (max(low, value), high) if op == 'min' else (low, min(high, value))
+            else:
+                others.append((op, prop, value))
+
+        matched = None
+        for prop, (low, high) in ranges.items():
+            values, fids = self.numeric(prop)
+            start = bisect.bisect_left(values, low)
+            end = bisect.bisect_right(values, high)
+            matched = self._intersect(matched, fids[start:end])
+
+        # Equality lookups are cheap, so apply them before substring scans
+        others.sort(key=lambda p: p[0] != 'eq')
+        for op, prop, value in others:
+            if op == 'eq':
+                fids = self.exact(prop).get(str(value), [])
+            else:
+                needle = str(value).lower()
+                fids = [fid for fid, text in self.text(prop)
+                        if (matched is None or fid in matched) and needle in text]
+            matched = self._intersect(matched, fids)
+            if not matched:
+                break
+
+        if matched is None:
+            return list(range(len(self.features)))
+        return sorted(matched)
+
+    def _values(self, prop):
+        for fid, feature in enumerate(self.features):
+            properties = feature.get('properties') or {}
+            value = properties.get(prop)
+            if value is not None:
+                yield fid, value
+
+    @staticmethod
+    def _intersect(matched, fids):
+        fids = set(fids)
+        return fids if matched is None else matched & fids
+
+
+def build_attribute_index(entry):
+    """Build an AttributeIndex for a LayerStore entry"""
+    return AttributeIndex(entry.data.get('features', []))
@@ -0,0 +1,162 @@
+"""
+Server-side aggregates for map reports.
+
+Each layer is converted once per version (see LayerStore.derive) into
+numpy columns, read from its columnar copy when it has a current one, so
+a report over any selection of features is a handful of vectorized
+operations on the selected rows.
+"""
+import numpy as np
+
+from layer_query import is_number, lookup_row
+
+# Cost and budget fields summed and averaged in reports
+REPORT_FIELDS = ('powerCost', 'SMWCost', 'waterCost', 'Budget', 'cost')
+
+# Service indicator scores (0-100) reported as distributions
+INDICATOR_FIELDS = ('power', 'SMW', 'waterSupply', 'housing', 'telecom', 'swage', 'OverAllIndicator')
+
+# Bin edges of the indicator distributions
+INDICATOR_BINS = (0, 20, 40, 60, 80, 100)
+
+# Properties used to group rollups, in order of preference
+DISTRICT_FIELDS = ('District_E', 'County_EN', 'neighborhood', 'ADM4_NAME')
+
+
+def _number(value):
+    return float(value) if is_number(value) else np.nan
+
+
+class LayerColumns:
+    """Columnar copy of the report fields of a layer"""
+
+    def __init__(self, ids, properties, numeric, district_field=None, districts=()):
+        # Features are addressed by their id, or by position when they have none
+        self.ids = ids
+        # properties(rows) returns the property dicts of the given rows
+        self.properties = properties
+        self.rows = {fid: position for position, fid in enumerate(ids)}
+        self.numeric = numeric
+
+        # District names become integer codes so rollups are a bincount
+        self.district_field = district_field
+        if district_field is not None:
+            names = [str(name or '') for name in districts]
+            self.district_names, self.district_codes = np.unique(names, return_inverse=True)
+        else:
+            self.district_names, self.district_codes = np.array([]), np.zeros(len(ids), dtype=np.intp)
+
+    def resolve(self, feature_ids):
+        """Map feature ids to row positions, returning (rows, missing ids)"""
+        rows, missing = [], []
+        seen = set()
+        for fid in feature_ids:
+            row = lookup_row(self.rows, fid)
+            if row is None:
+                missing.append(fid)
+            elif row not in seen:
+                seen.add(row)
+                rows.append(row)
+        return np.array(rows, dtype=np.intp), missing
+
+
+def build_layer_columns(entry):
+    """Build the report columns of a LayerStore entry"""
+    features = entry.data.get('features', [])
+    ids = [
+        feature.get('id') if feature.get('id') is not None else position
+        for position, feature in enumerate(features)
+    ]
+    properties = [feature.get('properties') or {} for feature in features]
+    numeric = {}
+    for name in REPORT_FIELDS + INDICATOR_FIELDS:
+        if any(name in props for props in properties):
+            numeric[name] = np.array([_number(props.get(name)) for props in properties], dtype=np.float64)
+    district_field = next(
+        (name for name in DISTRICT_FIELDS if any(props.get(name) for props in properties)), None)
+    districts = [props.get(district_field) for props in properties] if district_field else ()
+    return LayerColumns(ids, lambda rows: [properties[row] for row in rows], numeric, district_field, districts)
+
+
+def build_columnar_layer_columns(layer):
+    """Build the report columns of a mapped columnar layer (see columnar.ColumnarStore)"""
+    numeric = {name: layer.numeric(name) for name in REPORT_FIELDS + INDICATOR_FIELDS
+               if layer.has_property(name)}
+    district_field = next(
+        (name for name in DISTRICT_FIELDS if any(layer.values(name))), None)
+    districts = layer.values(district_field) if district_field else ()
+    return LayerColumns(layer.feature_ids(), layer.properties, numeric, district_field, districts)
+
+
+def _totals(columns, rows):
+    totals = {}
+    for name in REPORT_FIELDS:
+        column = columns.numeric.get(name)
+        if column is None:
+            continue
+        values = column[rows]
+        present = ~np.isnan(values)
+        count = int(present.sum())
+        total = float(values[present].sum())
+        totals[name] = {
+            'sum': total,
+            'mean': total / count if count else None,
+            'count': count
+        }
+    return totals
+
+
+def _indicators(columns, rows):
+    indicators = {}
+    edges = np.array(INDICATOR_BINS, dtype=np.float64)
+    for name in INDICATOR_FIELDS:
+        column = columns.numeric.get(name)
+        if column is None:
+            continue
+        values = column[rows]
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        counts, _ = np.histogram(np.clip(values, edges[0], edges[-1]), bins=edges)
+        indicators[name] = {
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'mean': float(values.mean()),
+            'median': float(np.median(values)),
+            'bins': [
+                {'min': float(low), 'max': float(high), 'count': int(count)}
+                for low, high, count in zip(edges[:-1], edges[1:], counts)
+            ]
+        }
+    return indicators
+
+
+def _districts(columns, rows):
+    if columns.district_field is None:
+        return None
+    codes = columns.district_codes[rows]
+    size = len(columns.district_names)
+    counts = np.bincount(codes, minlength=size)
+    sums = {}
+    for name in REPORT_FIELDS:
+        column = columns.numeric.get(name)
+        if column is not None:
+            sums[name] = np.bincount(codes, weights=np.nan_to_num(column[rows]), minlength=size)
+
+    result = []
+    for code in np.flatnonzero(counts):
+        result.append({
+            'name': str(columns.district_names[code]),
+            'featureCount': int(counts[code]),
+            'sums': {name: float(values[code]) for name, values in sums.items()}
+        })
+    return {'field': columns.district_field, 'rows': result}
+
+
+def summarize(columns, rows):
+    """Compute the report aggregates over the given row positions"""
+    return {
+        'totals': _totals(columns, rows),
+        'indicators': _indicators(columns, rows),
+        'districts': _districts(columns, rows)
+    }
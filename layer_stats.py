@@ -0,0 +1,79 @@
+"""
+Per-property schema and statistics for GeoJSON layers.
+
+The schema is computed once per layer version (see LayerStore.derive) so the
+frontend can build its filter controls without downloading any geometry.
+It is read off the layer's column profile (see style_inference), which the
+classification endpoint shares.
+"""
+import numpy as np
+
+from style_inference import build_layer_profile, profile_features
+
+# Number of equal-width histogram buckets for numeric properties
+HISTOGRAM_BUCKETS = 10
+
+# Largest magnitude at which every integer is exactly representable as a float
+_MAX_EXACT_INT = 2 ** 53
+
+
+def histogram(values, buckets=HISTOGRAM_BUCKETS):
+    """Return equal-width bucket edges and counts for numeric values"""
+    values = np.asarray(values)
+    # Integer values keep integer bounds
+    low, high = values.min().item(), values.max().item()
+    if low == high:
+        return {'edges': [low, high], 'counts': [len(values)]}
+    width = (high - low) / buckets
+    bucket = np.minimum(((values - low) / width).astype(np.intp), buckets - 1)
+    counts = np.bincount(bucket, minlength=buckets)
+    edges = [low + width * i for i in range(buckets)] + [high]
+    return {'edges': edges, 'counts': [int(c) for c in counts]}
+
+
+def _numbers(column):
+    # The numeric values of a column, as integers when it holds no floats
+    if float not in column.types and np.all(np.abs(column.numbers) < _MAX_EXACT_INT):
+        return column.numbers.astype(np.int64)
+    return column.numbers
+
+
+def schema_from_profile(profile):
+    """Summarise every property of a profiled layer (see style_inference.LayerProfile)"""
+    properties = []
+    for name, column in profile.columns.items():
+        prop = {
+            'name': name,
+            'type': column.kind,
+            'count': column.count,
+            # Features where the property is missing count as null too
+            'nullCount': profile.row_count - column.count,
+            'min': None,
+            'max': None,
+            'distinct': list(column.values),
+            'distinctTruncated': column.truncated,
+            'distinctCount': column.distinct_count,
+            'distinctApproximate': column.approximate,
+            'histogram': None
+        }
+        if len(column.numbers):
+            prop['histogram'] = histogram(_numbers(column))
+            prop['min'] = prop['histogram']['edges'][0]
+            prop['max'] = prop['histogram']['edges'][-1]
+        properties.append(prop)
+
+    return {
+        'featureCount': profile.row_count,
+        'geometryTypes': list(profile.geometry_types),
+        'properties': properties
+    }
+
+
+def build_schema(features):
+    """Summarise every property of a list of GeoJSON features"""
+    return schema_from_profile(profile_features(features))
+
+
+def build_layer_schema(entry):
+    """Build the schema for a LayerStore entry"""
+    return schema_from_profile(entry.derive('profile', build_layer_profile))
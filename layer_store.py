@@ -0,0 +1,225 @@
+"""
+In-memory store for the GeoJSON layers served by the Flask app.
+
+Each layer file is parsed once and kept together with its pre-encoded JSON
+response body, so repeat requests only cost a dictionary lookup. Entries are
+invalidated when the file's mtime or size changes and evicted in
+least-recently-used order once the store grows past its byte budget.
+
+Layers that share their geometry with other layers are stored without it:
+their FeatureCollection carries a "geometry_source" member naming a file in
+the geometry directory, and features are joined to it by "id" when loaded.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Default cache budget in encoded bytes (override with LAYER_CACHE_BYTES)
+DEFAULT_BUDGET_BYTES = int(os.environ.get("LAYER_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Directory (relative to the data directory) holding shared geometry stores
+GEOMETRY_DIR = "geometry"
+
+
+def encode_json(data):
+    """Encode data as compact UTF-8 JSON bytes"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def geometry_filename(source):
+    """Return the data-directory-relative filename of a geometry store"""
+    return f"{GEOMETRY_DIR}/{source}.geojson"
+
+
+def version_fingerprint(versions):
+    """Hex string identifying a list of (mtime_ns, size) file versions"""
+    return '-'.join(f"{mtime_ns:x}.{size:x}" for mtime_ns, size in versions)
+
+
+def version_time(versions):
+    """Return the latest modification time of a list of file versions as a UTC datetime"""
+    return datetime.fromtimestamp(max(mtime_ns for mtime_ns, _ in versions) / 1e9, timezone.utc)
+
+
+def join_geometry(data, geometry_data):
+    """Return a copy of an attribute-only layer with geometry joined by feature id"""
+    geometries = {
+        feature.get('id'): feature.get('geometry')
+        for feature in geometry_data.get('features', [])
+    }
+    joined = {key: value for key, value in data.items() if key != 'geometry_source'}
+    joined['features'] = [
+        dict(feature, geometry=geometries.get(feature.get('id')))
+        for feature in data.get('features', [])
+    ]
+    return joined
+
+
+class LayerEntry:
+    """A parsed layer together with its encoded response body"""
+
+    __slots__ = ('filename', 'version', 'sources', 'data', 'body', 'attributes_body', 'derived')
+
+    def __init__(self, filename, version, data, body, sources=(), attributes_body=None):
+        self.filename = filename
+        self.version = version
+        # (filename, version) of the geometry store this layer was joined with
+        self.sources = sources
+        self.data = data
+        self.body = body
+        # Attribute-only body of a shared-geometry layer, for client-side joins
+        self.attributes_body = attributes_body
+        # Structures computed from this version of the layer (indexes, stats, ...)
+        self.derived = {}
+
+    def derive(self, key, build):
+        """Return build(self), computing it once for this version of the layer"""
+        try:
+            return self.derived[key]
+        except KeyError:
+            value = build(self)
+            self.derived[key] = value
+            return value
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.attributes_body or b'')
+
+    @property
+    def versions(self):
+        return [self.version] + [version for _, version in self.sources]
+
+    @property
+    def fingerprint(self):
+        """Hex string identifying this version of the layer and its sources"""
+        return version_fingerprint(self.versions)
+
+    @property
+    def last_modified(self):
+        """Modification time of the layer or its sources, whichever is latest"""
+        return version_time(self.versions)
+
+
+class LayerStore:
+    """Process-wide LRU cache of parsed layers keyed by filename"""
+
+    def __init__(self, data_dir, budget_bytes=DEFAULT_BUDGET_BYTES, quantize=None, metrics=None):
+        self.data_dir = data_dir
+        self.budget_bytes = budget_bytes
+        # Applied to each parsed file before it is joined and encoded
+        # (geojson_writer.quantize rounds coordinates as the ETL does)
+        self.quantize = quantize
+        # Told of cache hits and misses and parse times (see metrics.RequestMetrics)
+        self.metrics = metrics
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, filename):
+        """Return the on-disk path of a layer file"""
+        return os.path.join(self.data_dir, filename)
+
+    def file_version(self, filename):
+        """Return the (mtime_ns, size) version of a layer file"""
+        stat = os.stat(self.path_for(filename))
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _is_current(self, entry, version):
+        if entry.version != version:
+            return False
+        try:
+            return all(self.file_version(source) == source_version
+                       for source, source_version in entry.sources)
+        except FileNotFoundError:
+            return False
+
+    def get(self, filename):
+        """Return the entry for filename, reloading it if the file has changed
+
+        Raises FileNotFoundError if the layer file does not exist.
+        """
+        path = self.path_for(filename)
+        version = self.file_version(filename)
+
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None and self._is_current(entry, version):
+            with self._lock:
+                if filename in self._entries:
+                    self._entries.move_to_end(filename)
+            if self.metrics is not None:
+                self.metrics.cache_lookup('layers', filename, True)
+            return entry
+
+        if self.metrics is not None:
+            self.metrics.cache_lookup('layers', filename, False)
+
+        # Parse outside the lock so one slow layer does not block the others
+        entry = self._load(filename, path, version)
+
+        with self._lock:
+            self._discard(filename)
+            if entry.size <= self.budget_bytes:
+                self._entries[filename] = entry
+                self._total_bytes += entry.size
+                self._evict()
+            else:
+                logger.warning(f"Layer {filename} ({entry.size} bytes) exceeds the cache budget, not caching")
+        return entry
+
+    def derive(self, filename, key, build):
+        """Return build(entry) for the current version of a layer, computing it once
+
+        Derived values live on the entry, so they are dropped together with it
+        when the file changes or the layer is evicted.
+        """
+        return self.get(filename).derive(key, build)
+
+    def invalidate(self, filename=None):
+        """Drop one cached layer, or all of them when filename is None"""
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+                self._total_bytes = 0
+            else:
+                self._discard(filename)
+
+    def _load(self, filename, path, version):
+        start = time.perf_counter()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if self.metrics is not None:
+            self.metrics.parse_time(filename, time.perf_counter() - start)
+        if self.quantize is not None:
+            data = self.quantize(data)
+
+        sources = ()
+        attributes_body = None
+        source = data.get('geometry_source') if isinstance(data, dict) else None
+        if source:
+            source_file = geometry_filename(source)
+            source_entry = self.get(source_file)
+            attributes_body = encode_json(data)
+            data = join_geometry(data, source_entry.data)
+            sources = ((source_file, source_entry.version),)
+
+        body = encode_json(data)
+        logger.debug(f"Loaded layer {filename} ({len(body)} bytes)")
+        return LayerEntry(filename, version, data, body, sources, attributes_body)
+
+    def _discard(self, filename):
+        old = self._entries.pop(filename, None)
+        if old is not None:
+            self._total_bytes -= old.size
+
+    def _evict(self):
+        while self._total_bytes > self.budget_bytes and self._entries:
+            filename, old = self._entries.popitem(last=False)
+            self._total_bytes -= old.size
+            logger.debug(f"Evicted layer {filename} from cache")
@@ -0,0 +1,240 @@
+"""
+Request metrics for the Flask app, exposed in the Prometheus text format.
+
+RequestMetrics times every request from before_request to after_request
+and records, per method, route and layer:
+
+    http_requests_total              requests by status
+    http_request_duration_seconds    latency histogram
+    http_response_size_bytes         body size histogram (responses of known
+                                     length; streamed bodies are not counted)
+    layer_cache_requests_total       hits and misses of the layer, columnar
+                                     and tile caches
+    layer_json_parse_seconds         time spent parsing layer files
+
+The route is the URL rule ("/api/geojson/<filename>"), so it stays bounded;
+the layer is the filename or layer id the request names when the layer
+catalog knows it, and "" otherwise, so made-up ids cannot add series.
+Bucket bounds are fixed and each label set gets its counters once, so
+recording an observation only increments them. Each metric keeps at
+most MAX_SERIES label sets; later ones are counted under "other".
+"""
+import os
+import abc
+import time
+import threading
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+
+# Latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Response size buckets in bytes, 256 B to 64 MiB
+SIZE_BUCKETS = tuple(float(256 * 4 ** power) for power in range(10))
+
+# Label sets kept per metric (override with METRICS_MAX_SERIES)
+MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", 1000))
+
+# Label value of the requests counted past MAX_SERIES
+OVERFLOW = "other"
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# View arguments naming the layer a request is for
+LAYER_ARGS = ('filename', 'layer_id', 'source')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric(abc.ABC):
+    """A named metric with one series of counters per label set"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels, max_series=MAX_SERIES):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.max_series = max_series
+        self._series = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_series(self):
+        """Return the zeroed counters of a new label set"""
+
+    @abc.abstractmethod
+    def _render_series(self, lines, labels, series):
+        """Append the exposition lines of one label set"""
+
+    def _get_series(self, labels):
+        # Called with the lock held
+        series = self._series.get(labels)
+        if series is None:
+            if len(self._series) >= self.max_series:
+                labels = (OVERFLOW,) * len(self.labels)
+                series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = self._new_series()
+        return series
+
+    def snapshot(self):
+        """Return a copy of every series, keyed by label values"""
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for labels, series in sorted(self.snapshot().items()):
+            self._render_series(lines, labels, series)
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def _new_series(self):
+        return [0]
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._get_series(labels)[0] += amount
+
+    def _render_series(self, lines, labels, series):
+        lines.append(f"{self.name}{_format_labels(self.labels, labels)} {series[0]}")
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets per label set
+
+    A series holds one count per bucket (the last for values above every
+    bound) followed by the sum of the observed values.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets, max_series=MAX_SERIES):
+        super().__init__(name, documentation, labels, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, labels, value):
+        # Buckets are upper bounds, so a value equal to one falls in it
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._get_series(labels)
+            series[index] += 1
+            series[-1] += value
+
+    def _render_series(self, lines, labels, series):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float('inf') else f'le="{float(bound)!r}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {series[-1]!r}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+
+
+def current_route():
+    """Return the URL rule of the request being handled, or "" outside of one"""
+    if not has_request_context():
+        return ''
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def request_layer():
+    """Return the layer the current request names (view argument or JSON layerId), or "" """
+    if request.endpoint == 'static':
+        return ''
+    for name in LAYER_ARGS:
+        value = (request.view_args or {}).get(name)
+        if value:
+            return value
+    if request.is_json:
+        # Parsed bodies are cached by Flask, so this does not parse again
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get('layerId'), str):
+            return data['layerId']
+    return ''
+
+
+class RequestMetrics:
+    """Per-route and per-layer request, cache and parse metrics"""
+
+    def __init__(self, known_layer=None, max_series=MAX_SERIES):
+        # Returns True for layer names that may label a series (e.g. LayerCatalog.has_layer)
+        self.known_layer = known_layer
+        self.requests = Counter(
+            'http_requests_total', 'Requests handled, by status',
+            ('method', 'route', 'layer', 'status'), max_series)
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds', 'Time from receiving a request to returning its response',
+            ('method', 'route', 'layer'), LATENCY_BUCKETS, max_series)
+        self.response_bytes = Histogram(
+            'http_response_size_bytes', 'Size of response bodies of known length',
+            ('method', 'route', 'layer'), SIZE_BUCKETS, max_series)
+        self.cache_requests = Counter(
+            'layer_cache_requests_total', 'Layer cache lookups, by cache and result',
+            ('cache', 'route', 'layer', 'result'), max_series)
+        self.parse_seconds = Histogram(
+            'layer_json_parse_seconds', 'Time spent parsing layer GeoJSON files',
+            ('route', 'layer'), LATENCY_BUCKETS, max_series)
+        self.metrics = [self.requests, self.request_seconds, self.response_bytes,
+                        self.cache_requests, self.parse_seconds]
+
+    def init_app(self, app):
+        """Time every request of a Flask app"""
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.metrics_start = time.perf_counter()
+
+    def _finish(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            # A before_request hook registered earlier answered the request
+            return response
+        elapsed = time.perf_counter() - start
+        layer = request_layer()
+        # Only known layers label a series: some routes answer any id (default
+        # styles), and arbitrary ids would use up the series of every metric
+        if layer and (self.known_layer is None or not self.known_layer(layer)):
+            layer = ''
+        labels = (request.method, current_route(), layer)
+        self.requests.inc(labels + (str(response.status_code),))
+        self.request_seconds.observe(labels, elapsed)
+        if response.content_length is not None:
+            self.response_bytes.observe(labels, response.content_length)
+        return response
+
+    def cache_lookup(self, cache, layer, hit):
+        """Count a hit or miss of a cache for a layer"""
+        self.cache_requests.inc((cache, current_route(), layer, 'hit' if hit else 'miss'))
+
+    def parse_time(self, layer, seconds):
+        """Record the time spent parsing a layer file"""
+        self.parse_seconds.observe((current_route(), layer), seconds)
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
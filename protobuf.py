@@ -0,0 +1,58 @@
+"""
+Minimal Protocol Buffers writer used by the binary tile and feature encoders.
+"""
+import struct
+
+# Wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+
+def varint(value):
+    """Encode a non-negative integer as a base-128 varint"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    """Map a signed integer onto an unsigned one (0, -1, 1, -2, ...)"""
+    return (value << 1) ^ (value >> 63)
+
+
+def key(field, wire_type):
+    return varint((field << 3) | wire_type)
+
+
+def field_varint(field, value):
+    return key(field, VARINT) + varint(value)
+
+
+def field_sint(field, value):
+    return key(field, VARINT) + varint(zigzag(value))
+
+
+def field_bytes(field, data):
+    return key(field, LENGTH_DELIMITED) + varint(len(data)) + data
+
+
+def field_string(field, text):
+    return field_bytes(field, text.encode('utf-8'))
+
+
+def field_double(field, value):
+    return key(field, FIXED64) + struct.pack('<d', value)
+
+
+def field_packed(field, values):
+    """Encode a packed repeated varint field"""
+    return field_bytes(field, b''.join(varint(v) for v in values))
+
+
+def field_packed_sint(field, values):
+    """Encode a packed repeated zigzag (sint) field"""
+    return field_bytes(field, b''.join(varint(zigzag(v)) for v in values))
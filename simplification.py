@@ -0,0 +1,272 @@
+"""
+Zoom-dependent geometry simplification for GeoJSON layers.
+
+Layers are simplified as a whole rather than feature by feature: rings and
+lines are split into arcs at the vertices where neighbouring features stop
+sharing a boundary, and each arc is simplified once. Shared borders
+therefore stay identical on both sides, so simplified layers have no gaps
+or slivers between adjacent polygons.
+
+The ingest scripts write one simplified copy of each layer per entry in
+ZOOM_LEVELS; the API picks a level from a zoom or tolerance parameter.
+"""
+import os
+import logging
+
+from compression import write_compressed
+from geobuf import write_geobuf
+from geojson_writer import write_geojson
+
+logger = logging.getLogger(__name__)
+
+# Zoom levels with a precomputed simplified copy; above the last one the
+# full-resolution layer is served
+ZOOM_LEVELS = (10, 12, 14)
+
+# Directory (relative to the data directory) holding the simplified copies
+LEVELS_DIR = "levels"
+
+# Tolerance as a fraction of a 256px tile pixel at the level's zoom
+PIXEL_TOLERANCE = 0.5
+
+
+def zoom_tolerance(zoom):
+    """Return the simplification tolerance, in degrees, for a zoom level"""
+    return 360.0 / (256 * 2 ** zoom) * PIXEL_TOLERANCE
+
+
+def douglas_peucker(points, tolerance):
+    """Douglas-Peucker simplification keeping the first and last points"""
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    sq_tolerance = tolerance * tolerance
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first][0], points[first][1]
+        bx, by = points[last][0], points[last][1]
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        max_dist, index = 0.0, 0
+        for i in range(first + 1, last):
+            px, py = points[i][0], points[i][1]
+            if length == 0:
+                dist = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+                dist = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if max_dist > sq_tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def _geometry_paths(geometry):
+    """Yield (path, is_ring) for every ring or line of a geometry"""
+    gtype = geometry.get('type') if geometry else None
+    coords = geometry.get('coordinates') if geometry else None
+    if gtype == 'Polygon':
+        for ring in coords:
+            yield ring, True
+    elif gtype == 'MultiPolygon':
+        for polygon in coords:
+            for ring in polygon:
+                yield ring, True
+    elif gtype == 'LineString':
+        yield coords, False
+    elif gtype == 'MultiLineString':
+        for line in coords:
+            yield line, False
+    elif gtype == 'GeometryCollection':
+        for member in geometry.get('geometries', []):
+            yield from _geometry_paths(member)
+
+
+class _ArcSimplifier:
+    """Simplifies paths arc by arc so shared boundaries stay shared"""
+
+    def __init__(self, features, tolerance):
+        self.tolerance = tolerance
+        self.junctions = self._find_junctions(features)
+        self.arcs = {}
+
+    @staticmethod
+    def _find_junctions(features):
+        # A vertex is a junction when the set of its neighbours differs
+        # between the paths passing through it
+        neighbours = {}
+        endpoints = set()
+        for feature in features:
+            for path, is_ring in _geometry_paths(feature.get('geometry')):
+                points = [tuple(p[:2]) for p in path]
+                if is_ring:
+                    points = points[:-1]
+                    count = len(points)
+                    for i, point in enumerate(points):
+                        neighbours.setdefault(point, set()).update(
+                            (points[i - 1], points[(i + 1) % count]))
+                elif points:
+                    endpoints.add(points[0])
+                    endpoints.add(points[-1])
+                    for i, point in enumerate(points):
+                        near = neighbours.setdefault(point, set())
+                        if i > 0:
+                            near.add(points[i - 1])
+                        if i < len(points) - 1:
+                            near.add(points[i + 1])
+        junctions = {point for point, near in neighbours.items() if len(near) > 2}
+        return junctions | endpoints
+
+    def _simplify_arc(self, arc):
+        # Shared arcs are walked in opposite directions by their two owners,
+        # so cache on a canonical orientation
+        key = tuple(arc)
+        reverse_key = key[::-1]
+        if reverse_key < key:
+            cached = self.arcs.get(reverse_key)
+            if cached is None:
+                cached = self.arcs[reverse_key] = douglas_peucker(list(reverse_key), self.tolerance)
+            return cached[::-1]
+        cached = self.arcs.get(key)
+        if cached is None:
+            cached = self.arcs[key] = douglas_peucker(list(key), self.tolerance)
+        return cached
+
+    def _split(self, points):
+        arcs = []
+        start = 0
+        for i in range(1, len(points) - 1):
+            if points[i] in self.junctions:
+                arcs.append(points[start:i + 1])
+                start = i
+        arcs.append(points[start:])
+        return arcs
+
+    def simplify_path(self, path, is_ring):
+        points = [tuple(p[:2]) for p in path]
+        if is_ring:
+            if len(points) < 4:
+                return path
+            ring = points[:-1]
+            start = next((i for i, p in enumerate(ring) if p in self.junctions), None)
+            if start is None:
+                # Without junctions, start from the smallest vertex so that
+                # identical loops (e.g. a hole and its island) agree
+                start = ring.index(min(ring))
+            ring = ring[start:] + ring[:start]
+            points = ring + ring[:1]
+        result = []
+        for arc in self._split(points):
+            simplified = self._simplify_arc(arc)
+            result.extend(simplified if not result else simplified[1:])
+        # Keep the original ring rather than collapsing it
+        if is_ring and len(result) < 4:
+            return path
+        if not is_ring and len(result) < 2:
+            return path
+        return [list(p) for p in result]
+
+    def simplify_geometry(self, geometry):
+        if not geometry:
+            return geometry
+        gtype = geometry.get('type')
+        coords = geometry.get('coordinates')
+        if gtype == 'Polygon':
+            coords = [self.simplify_path(ring, True) for ring in coords]
+        elif gtype == 'MultiPolygon':
+            coords = [[self.simplify_path(ring, True) for ring in polygon] for polygon in coords]
+        elif gtype == 'LineString':
+            coords = self.simplify_path(coords, False)
+        elif gtype == 'MultiLineString':
+            coords = [self.simplify_path(line, False) for line in coords]
+        elif gtype == 'GeometryCollection':
+            return {
+                'type': gtype,
+                'geometries': [self.simplify_geometry(g) for g in geometry.get('geometries', [])]
+            }
+        else:
+            return geometry
+        return {'type': gtype, 'coordinates': coords}
+
+
+def simplify_features(features, tolerance):
+    """Return copies of features with topology-preserving simplified geometry"""
+    simplifier = _ArcSimplifier(features, tolerance)
+    simplified = []
+    for feature in features:
+        copy = dict(feature)
+        copy['geometry'] = simplifier.simplify_geometry(feature.get('geometry'))
+        simplified.append(copy)
+    return simplified
+
+
+def has_simplifiable_geometry(features):
+    """Return True if any feature has a line or polygon geometry"""
+    for feature in features:
+        for _ in _geometry_paths(feature.get('geometry')):
+            return True
+    return False
+
+
+def level_filename(layer_id, zoom):
+    """Return the data-directory-relative filename of a simplified level"""
+    return f"{LEVELS_DIR}/{layer_id}/z{zoom}.geojson"
+
+
+def write_simplified_copies(geojson, path_for_zoom, zoom_levels=ZOOM_LEVELS):
+    """Write one simplified copy of a FeatureCollection per zoom level
+
+    path_for_zoom(zoom) gives the output path of each copy, which is also
+    written as Geobuf and precompressed (see geojson_writer). Returns the list of zoom levels written (empty for
+    point layers).
+    """
+    features = geojson.get('features', [])
+    if not has_simplifiable_geometry(features):
+        return []
+
+    written = []
+    for zoom in zoom_levels:
+        tolerance = zoom_tolerance(zoom)
+        simplified = dict(geojson)
+        simplified['features'] = simplify_features(features, tolerance)
+        path = path_for_zoom(zoom)
+        # Coordinates keep only the decimals the tolerance leaves meaningful
+        simplified = write_geojson(simplified, path, tolerance)
+        write_geobuf(simplified, path)
+        write_compressed(path)
+        written.append(zoom)
+    return written
+
+
+def write_simplified_levels(layer_id, geojson, output_dir, zoom_levels=ZOOM_LEVELS):
+    """Write one simplified copy of a layer per zoom level
+
+    Returns the list of zoom levels written (empty for point layers).
+    """
+    written = write_simplified_copies(
+        geojson, lambda zoom: os.path.join(output_dir, level_filename(layer_id, zoom)), zoom_levels)
+    if written:
+        logger.info(f"Wrote simplified levels for {layer_id}: {', '.join(f'z{z}' for z in written)}")
+    return written
+
+
+def select_level(zoom=None, tolerance=None, zoom_levels=ZOOM_LEVELS):
+    """Pick the simplified level to serve, or None for full resolution
+
+    For a zoom, the coarsest level still fine enough for that zoom is used.
+    For a tolerance in degrees, the coarsest level within it is used.
+    """
+    if zoom is not None:
+        for level in sorted(zoom_levels):
+            if level >= zoom:
+                return level
+        return None
+    if tolerance is not None:
+        within = [level for level in zoom_levels if zoom_tolerance(level) <= tolerance]
+        return min(within) if within else None
+    return None
@@ -0,0 +1,185 @@
+"""
+Packed R-tree (Sort-Tile-Recursive) over the features of a layer.
+
+The tree is built once per layer version from the feature bounding boxes
+and answers bounding box and point lookups without scanning every feature.
+Point lookups are refined with an exact point-in-polygon test.
+"""
+import math
+
+# Maximum number of children per tree node
+NODE_CAPACITY = 16
+
+
+def geometry_bounds(geometry):
+    """Return the (minx, miny, maxx, maxy) bounds of a GeoJSON geometry"""
+    xs, ys = [], []
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for part in coords:
+                walk(part)
+
+    if geometry.get('type') == 'GeometryCollection':
+        for member in geometry.get('geometries', []):
+            bounds = geometry_bounds(member)
+            if bounds:
+                xs.extend(bounds[0::2])
+                ys.extend(bounds[1::2])
+    else:
+        walk(geometry.get('coordinates') or [])
+    if not xs:
+        return None
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def build_feature_bounds(entry):
+    """Compute the bounds of every feature of a LayerStore entry"""
+    bounds = []
+    for feature in entry.data.get('features', []):
+        geometry = feature.get('geometry')
+        bounds.append(geometry_bounds(geometry) if geometry else None)
+    return bounds
+
+
+def _union(boxes):
+    return (
+        min(b[0] for b in boxes), min(b[1] for b in boxes),
+        max(b[2] for b in boxes), max(b[3] for b in boxes)
+    )
+
+
+def _str_groups(items, capacity):
+    """Group (box, payload) items into nodes using Sort-Tile-Recursive packing"""
+    node_count = math.ceil(len(items) / capacity)
+    slice_count = math.ceil(math.sqrt(node_count))
+    slice_size = slice_count * capacity
+
+    items = sorted(items, key=lambda item: item[0][0] + item[0][2])
+    groups = []
+    for start in range(0, len(items), slice_size):
+        column = sorted(items[start:start + slice_size], key=lambda item: item[0][1] + item[0][3])
+        for node_start in range(0, len(column), capacity):
+            groups.append(column[node_start:node_start + capacity])
+    return groups
+
+
+class STRTree:
+    """Static packed R-tree over a list of bounding boxes
+
+    Boxes are (minx, miny, maxx, maxy) tuples or None for items without
+    geometry; queries return the positions of matching boxes in the list.
+    """
+
+    def __init__(self, bounds, capacity=NODE_CAPACITY):
+        self.bounds = bounds
+        # Each level is a list of (box, children); leaf children are item
+        # positions, the children of upper levels are node positions in the
+        # level below. The last level holds the root.
+        self.levels = []
+
+        items = [(box, i) for i, box in enumerate(bounds) if box is not None]
+        while items:
+            level = []
+            for group in _str_groups(items, capacity):
+                level.append((_union([box for box, _ in group]), [child for _, child in group]))
+            self.levels.append(level)
+            if len(level) == 1:
+                break
+            items = [(box, i) for i, (box, _) in enumerate(level)]
+
+    def query(self, minx, miny, maxx, maxy):
+        """Return the sorted positions of items whose box intersects the given box"""
+        if not self.levels:
+            return []
+        matches = []
+        top = len(self.levels) - 1
+        stack = [(top, i) for i in range(len(self.levels[top]))]
+        while stack:
+            depth, position = stack.pop()
+            box, children = self.levels[depth][position]
+            if box[0] > maxx or box[2] < minx or box[1] > maxy or box[3] < miny:
+                continue
+            if depth == 0:
+                for child in children:
+                    b = self.bounds[child]
+                    if not (b[0] > maxx or b[2] < minx or b[1] > maxy or b[3] < miny):
+                        matches.append(child)
+            else:
+                stack.extend((depth - 1, child) for child in children)
+        matches.sort()
+        return matches
+
+    def query_point(self, x, y):
+        """Return the sorted positions of items whose box contains the point"""
+        return self.query(x, y, x, y)
+
+
+def build_spatial_index(entry):
+    """Build the STR-tree over the features of a LayerStore entry"""
+    return STRTree(build_feature_bounds(entry))
+
+
+def _ring_contains(ring, x, y):
+    # Even-odd ray casting
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _polygon_contains(rings, x, y):
+    if not rings or not _ring_contains(rings[0], x, y):
+        return False
+    return not any(_ring_contains(hole, x, y) for hole in rings[1:])
+
+
+def _segment_distance(x, y, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / length))
+    return math.hypot(x - ax - t * dx, y - ay - t * dy)
+
+
+def _line_near(line, x, y, tolerance):
+    if len(line) == 1:
+        return math.hypot(x - line[0][0], y - line[0][1]) <= tolerance
+    return any(
+        _segment_distance(x, y, a[0], a[1], b[0], b[1]) <= tolerance
+        for a, b in zip(line, line[1:])
+    )
+
+
+def geometry_contains_point(geometry, x, y, tolerance=0.0):
+    """Return True if a geometry contains the point
+
+    Polygons are tested exactly (holes excluded); points and lines match
+    when they lie within tolerance degrees of the point.
+    """
+    if not geometry:
+        return False
+    gtype = geometry.get('type')
+    coords = geometry.get('coordinates')
+    if gtype == 'Polygon':
+        return _polygon_contains(coords, x, y)
+    if gtype == 'MultiPolygon':
+        return any(_polygon_contains(polygon, x, y) for polygon in coords)
+    if gtype == 'Point':
+        return math.hypot(x - coords[0], y - coords[1]) <= tolerance
+    if gtype == 'MultiPoint':
+        return any(math.hypot(x - p[0], y - p[1]) <= tolerance for p in coords)
+    if gtype == 'LineString':
+        return _line_near(coords, x, y, tolerance)
+    if gtype == 'MultiLineString':
+        return any(_line_near(line, x, y, tolerance) for line in coords)
+    if gtype == 'GeometryCollection':
+        return any(geometry_contains_point(g, x, y, tolerance) for g in geometry.get('geometries', []))
+    return False
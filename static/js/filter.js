@@ -24,6 +24,29 @@ document.addEventListener('DOMContentLoaded', function() {
     // Store original layer data for resetting filters
     const originalLayers = {};
     
+    // Cached property schemas keyed by layer ID
+    const layerSchemas = {};
+    
+    // Fetch (once) the property schema and statistics for a layer
+    function fetchLayerSchema(layerId) {
+        if (!layerSchemas[layerId]) {
+            layerSchemas[layerId] = fetch(`/api/layers/${layerId}/schema`)
+                .then(response => response.json())
+                .then(schema => {
+                    if (schema.error) {
+                        throw new Error(schema.error);
+                    }
+                    return schema;
+                })
+                .catch(error => {
+                    // Allow a retry on the next request
+                    delete layerSchemas[layerId];
+                    throw error;
+                });
+        }
+        return layerSchemas[layerId];
+    }
+    
     // Listen for layer selection change
     layerSelect.addEventListener('change', function() {
         const layerId = this.value;
@@ -42,12 +65,9 @@ document.addEventListener('DOMContentLoaded', function() {
         propertySelect.innerHTML = '<option value="">Select a property</option>';
         
         // Fetch properties for the selected layer
-        fetch(`/api/layer-properties/${layerId}.geojson`)
-            .then(response => response.json())
-            .then(properties => {
-                if (properties.error) {
-                    throw new Error(properties.error);
-                }
+        fetchLayerSchema(layerId)
+            .then(schema => {
+                const properties = schema.properties.map(prop => prop.name);
                 
                 // Add properties to select dropdown
                 properties.sort().forEach(property => {
@@ -93,35 +113,12 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Determine property type and show appropriate filter controls
     function determinePropertyType(layerId, property) {
-        fetch(`/api/geojson/${layerId}.geojson`)
-            .then(response => response.json())
-            .then(data => {
-                // Find the first feature with this property that has a non-null value
-                let propertyValue = null;
-                let propertyType = 'string';
-                let uniqueValues = new Set();
-                
-                // Loop through features to determine property type and collect unique values
-                for (const feature of data.features) {
-                    if (feature.properties && feature.properties[property] !== undefined && feature.properties[property] !== null) {
-                        propertyValue = feature.properties[property];
-                        
-                        // Add to unique values
-                        uniqueValues.add(propertyValue);
-                        
-                        // Get property type
-                        if (typeof propertyValue === 'number') {
-                            propertyType = 'number';
-                        } else if (typeof propertyValue === 'boolean') {
-                            propertyType = 'boolean';
-                        }
-                        
-                        // If we have a non-null value, we can determine the type
-                        if (propertyValue !== null) {
-                            break;
-                        }
-                    }
-                }
+        fetchLayerSchema(layerId)
+            .then(schema => {
+                // Type, range and distinct values come precomputed from the server
+                const stats = schema.properties.find(prop => prop.name === property) || {};
+                const propertyType = stats.type || 'string';
+                const uniqueValues = stats.distinct || [];
                 
                 // Hide all filter controls first
                 filterTextControl.classList.add('d-none');
@@ -136,27 +133,13 @@ document.addEventListener('DOMContentLoaded', function() {
                     applyFilterBtn.disabled = false;
                     clearFilterBtn.disabled = false;
                     
-                    // Find min/max values if this is a numeric property
-                    let minVal = Number.MAX_VALUE;
-                    let maxVal = Number.MIN_VALUE;
-                    
-                    for (const feature of data.features) {
-                        if (feature.properties && feature.properties[property] !== undefined && feature.properties[property] !== null) {
-                            const val = Number(feature.properties[property]);
-                            if (!isNaN(val)) {
-                                minVal = Math.min(minVal, val);
-                                maxVal = Math.max(maxVal, val);
-                            }
-                        }
-                    }
-                    
                     // Set min/max inputs
-                    document.getElementById('filter-min').value = minVal;
-                    document.getElementById('filter-max').value = maxVal;
+                    document.getElementById('filter-min').value = stats.min;
+                    document.getElementById('filter-max').value = stats.max;
                     
                     // Store filter type
                     currentFilter.type = 'number';
-                } else if (uniqueValues.size <= 10) {
+                } else if (!stats.distinctTruncated && uniqueValues.length <= 10) {
                     // If there are few unique values, show a select dropdown
                     filterSelectControl.classList.remove('d-none');
                     
@@ -165,7 +148,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     filterSelect.innerHTML = '<option value="">All values</option>';
                     
                     // Add unique values as options
-                    Array.from(uniqueValues).sort().forEach(value => {
+                    uniqueValues.slice().sort().forEach(value => {
                         const option = document.createElement('option');
                         option.value = value;
                         option.textContent = value;
@@ -272,41 +255,36 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
-        // Fetch the GeoJSON data again to filter it
-        fetch(`/api/geojson/${currentFilter.layerId}.geojson`)
+        // Build the query for the server-side filter endpoint
+        const params = new URLSearchParams();
+        const property = currentFilter.property;
+        if (currentFilter.type === 'number') {
+            params.append(`min.${property}`, currentFilter.min);
+            params.append(`max.${property}`, currentFilter.max);
+        } else if (currentFilter.type === 'select') {
+            // If empty value, show all
+            if (currentFilter.value) {
+                params.append(`eq.${property}`, currentFilter.value);
+            }
+        } else if (currentFilter.value) {
+            // Text search
+            params.append(`contains.${property}`, currentFilter.value);
+        }
+        
+        // Only the matching features are sent back by the server
+        fetch(`/api/layers/${currentFilter.layerId}/features?${params.toString()}`)
             .then(response => response.json())
             .then(data => {
-                // Store original layer if not already stored
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                
+                // Keep the unfiltered layer so it can be restored without a reload
                 if (!originalLayers[currentFilter.layerId]) {
-                    originalLayers[currentFilter.layerId] = JSON.parse(JSON.stringify(data));
+                    originalLayers[currentFilter.layerId] = layerControls[currentFilter.layerId];
                 }
                 
-                // Filter the features
-                const filteredFeatures = data.features.filter(feature => {
-                    // Skip features without properties
-                    if (!feature.properties || feature.properties[currentFilter.property] === undefined || feature.properties[currentFilter.property] === null) {
-                        return false;
-                    }
-                    
-                    const propValue = feature.properties[currentFilter.property];
-                    
-                    // Apply filter based on type
-                    if (currentFilter.type === 'number') {
-                        return propValue >= currentFilter.min && propValue <= currentFilter.max;
-                    } else if (currentFilter.type === 'select') {
-                        // If empty value, show all
-                        if (!currentFilter.value) {
-                            return true;
-                        }
-                        return propValue.toString() === currentFilter.value.toString();
-                    } else {
-                        // Text search
-                        if (!currentFilter.value) {
-                            return true;
-                        }
-                        return propValue.toString().toLowerCase().includes(currentFilter.value.toLowerCase());
-                    }
-                });
+                const filteredFeatures = data.features;
                 
                 // Create filtered GeoJSON
                 const filteredGeoJSON = {
@@ -369,8 +347,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 layerControls[currentFilter.layerId] = layerGroup;
                 
                 // Show filter status
-                const featureCount = filteredFeatures.length;
-                const totalCount = data.features.length;
+                const featureCount = data.numberMatched;
+                const totalCount = data.totalFeatures;
                 
                 alert(`Filter applied: Showing ${featureCount} of ${totalCount} features.`);
             })
@@ -405,53 +383,10 @@ document.addEventListener('DOMContentLoaded', function() {
         // Remove existing filtered layer
         map.removeLayer(layerControls[currentFilter.layerId]);
         
-        // Create a new layer with original data
-        const layerGroup = L.layerGroup();
-        const geoJSONLayer = L.geoJSON(originalLayers[currentFilter.layerId], {
-            // Use the same style and options as in map.js
-            style: function(feature) {
-                return {
-                    color: '#3388ff',
-                    weight: 2,
-                    opacity: 0.7,
-                    fillOpacity: 0.5,
-                    fillColor: '#3388ff'
-                };
-            },
-            pointToLayer: function(feature, latlng) {
-                return L.circleMarker(latlng, {
-                    radius: 6,
-                    fillColor: '#ff7800',
-                    color: '#000',
-                    weight: 1,
-                    opacity: 1,
-                    fillOpacity: 0.8
-                });
-            },
-            onEachFeature: function(feature, layer) {
-                // Create popup content
-                if (feature.properties) {
-                    let popupContent = '<div class="feature-popup">';
-                    popupContent += '<h6>Feature Properties</h6>';
-                    popupContent += '<ul class="feature-properties">';
-                    
-                    Object.keys(feature.properties).forEach(key => {
-                        if (feature.properties[key] !== null && feature.properties[key] !== undefined) {
-                            popupContent += `<li><span class="property-name">${key}:</span> ${feature.properties[key]}</li>`;
-                        }
-                    });
-                    
-                    popupContent += '</ul>';
-                    popupContent += '</div>';
-                    
-                    layer.bindPopup(popupContent);
-                }
-            }
-        });
-        
-        // Add original layer to map
-        layerGroup.addLayer(geoJSONLayer);
+        // Restore the original layer group
+        const layerGroup = originalLayers[currentFilter.layerId];
         layerGroup.addTo(map);
+        delete originalLayers[currentFilter.layerId];
         
         // Update layer control
         layerControls[currentFilter.layerId] = layerGroup;
@@ -0,0 +1,265 @@
+/**
+ * Geobuf decoding for layer downloads
+ *
+ * The server sends layers as Geobuf (compact protobuf-encoded GeoJSON,
+ * see geobuf.py) to clients that ask for it. fetchGeoJSON() requests that
+ * encoding and decodes whichever encoding the server answered with.
+ */
+
+const GEOBUF_MIMETYPE = 'application/vnd.geobuf';
+
+const GEOBUF_GEOMETRY_TYPES = [
+    'Point', 'MultiPoint', 'LineString', 'MultiLineString',
+    'Polygon', 'MultiPolygon', 'GeometryCollection'
+];
+
+// Minimal protobuf reader over a Uint8Array
+class GeobufReader {
+    constructor(buffer) {
+        this.buf = buffer;
+        this.view = new DataView(buffer.buffer, buffer.byteOffset, buffer.byteLength);
+        this.pos = 0;
+    }
+
+    readVarint() {
+        let result = 0;
+        let shift = 1;
+        let byte;
+        do {
+            byte = this.buf[this.pos++];
+            result += (byte & 0x7f) * shift;
+            shift *= 128;
+        } while (byte & 0x80);
+        return result;
+    }
+
+    readSVarint() {
+        const n = this.readVarint();
+        return n % 2 === 1 ? (n + 1) / -2 : n / 2;
+    }
+
+    readDouble() {
+        const value = this.view.getFloat64(this.pos, true);
+        this.pos += 8;
+        return value;
+    }
+
+    readString() {
+        const end = this.readVarint() + this.pos;
+        const text = new TextDecoder('utf-8').decode(this.buf.subarray(this.pos, end));
+        this.pos = end;
+        return text;
+    }
+
+    readPacked(signed) {
+        const end = this.readVarint() + this.pos;
+        const values = [];
+        while (this.pos < end) {
+            values.push(signed ? this.readSVarint() : this.readVarint());
+        }
+        return values;
+    }
+
+    // Call handler(field, end) for each field of the message ending at end
+    readFields(end, handler) {
+        while (this.pos < end) {
+            const tag = this.readVarint();
+            const field = tag >> 3;
+            const start = this.pos;
+            handler(field, tag & 7);
+            if (this.pos === start) {
+                this.skip(tag & 7);
+            }
+        }
+    }
+
+    readMessage(handler) {
+        const end = this.readVarint() + this.pos;
+        this.readFields(end, handler);
+        return end;
+    }
+
+    skip(wireType) {
+        if (wireType === 0) this.readVarint();
+        else if (wireType === 1) this.pos += 8;
+        else if (wireType === 2) this.pos = this.readVarint() + this.pos;
+        else if (wireType === 5) this.pos += 4;
+        else throw new Error(`Unsupported protobuf wire type ${wireType}`);
+    }
+}
+
+/**
+ * Decode a Geobuf buffer into a GeoJSON object
+ * @param {ArrayBuffer} buffer - Geobuf bytes
+ * @returns {Object} FeatureCollection, Feature or geometry
+ */
+function decodeGeobuf(buffer) {
+    const pbf = new GeobufReader(new Uint8Array(buffer));
+    const keys = [];
+    let dimensions = 2;
+    let factor = 1e6;
+    let result = null;
+
+    function readValue() {
+        let value = null;
+        pbf.readMessage(field => {
+            if (field === 1) value = pbf.readString();
+            else if (field === 2) value = pbf.readDouble();
+            else if (field === 3) value = pbf.readVarint();
+            else if (field === 4) value = -pbf.readVarint();
+            else if (field === 5) value = Boolean(pbf.readVarint());
+            else if (field === 6) value = JSON.parse(pbf.readString());
+        });
+        return value;
+    }
+
+    function readProperties(indexes, values, target) {
+        for (let i = 0; i < indexes.length; i += 2) {
+            target[keys[indexes[i]]] = values[indexes[i + 1]];
+        }
+    }
+
+    function readLine(coords, start, count, closed) {
+        const line = [];
+        const previous = new Array(dimensions).fill(0);
+        for (let i = 0; i < count; i++) {
+            const point = [];
+            for (let d = 0; d < dimensions; d++) {
+                previous[d] += coords[start + i * dimensions + d];
+                point.push(previous[d] / factor);
+            }
+            line.push(point);
+        }
+        if (closed && line.length) {
+            line.push(line[0].slice());
+        }
+        return line;
+    }
+
+    function readLines(coords, lengths, closed) {
+        if (!lengths) {
+            return [readLine(coords, 0, coords.length / dimensions, closed)];
+        }
+        const lines = [];
+        let start = 0;
+        lengths.forEach(count => {
+            lines.push(readLine(coords, start, count, closed));
+            start += count * dimensions;
+        });
+        return lines;
+    }
+
+    function readMultiPolygon(coords, lengths) {
+        if (!lengths) {
+            return [[readLine(coords, 0, coords.length / dimensions, true)]];
+        }
+        const polygons = [];
+        let start = 0;
+        let j = 1;
+        for (let p = 0; p < lengths[0]; p++) {
+            const rings = [];
+            const ringCount = lengths[j++];
+            for (let r = 0; r < ringCount; r++) {
+                const count = lengths[j++];
+                rings.push(readLine(coords, start, count, true));
+                start += count * dimensions;
+            }
+            polygons.push(rings);
+        }
+        return polygons;
+    }
+
+    function readGeometry() {
+        const geometry = {};
+        let coords = [];
+        let lengths = null;
+        const values = [];
+        let custom = [];
+        const geometries = [];
+        pbf.readMessage(field => {
+            if (field === 1) geometry.type = GEOBUF_GEOMETRY_TYPES[pbf.readVarint()];
+            else if (field === 2) lengths = pbf.readPacked(false);
+            else if (field === 3) coords = pbf.readPacked(true);
+            else if (field === 4) geometries.push(readGeometry());
+            else if (field === 13) values.push(readValue());
+            else if (field === 15) custom = pbf.readPacked(false);
+        });
+
+        const type = geometry.type;
+        if (type === 'Point') {
+            geometry.coordinates = coords.map(n => n / factor);
+        } else if (type === 'MultiPoint' || type === 'LineString') {
+            geometry.coordinates = readLine(coords, 0, coords.length / dimensions, false);
+        } else if (type === 'MultiLineString') {
+            geometry.coordinates = readLines(coords, lengths, false);
+        } else if (type === 'Polygon') {
+            geometry.coordinates = readLines(coords, lengths, true);
+        } else if (type === 'MultiPolygon') {
+            geometry.coordinates = readMultiPolygon(coords, lengths);
+        } else if (type === 'GeometryCollection') {
+            geometry.geometries = geometries;
+        }
+        readProperties(custom, values, geometry);
+        return geometry;
+    }
+
+    function readFeature() {
+        const feature = { type: 'Feature', properties: {}, geometry: null };
+        const values = [];
+        let properties = [];
+        let custom = [];
+        pbf.readMessage(field => {
+            if (field === 1) feature.geometry = readGeometry();
+            else if (field === 11) feature.id = pbf.readString();
+            else if (field === 12) feature.id = pbf.readSVarint();
+            else if (field === 13) values.push(readValue());
+            else if (field === 14) properties = pbf.readPacked(false);
+            else if (field === 15) custom = pbf.readPacked(false);
+        });
+        readProperties(properties, values, feature.properties);
+        readProperties(custom, values, feature);
+        return feature;
+    }
+
+    function readFeatureCollection() {
+        const collection = { type: 'FeatureCollection', features: [] };
+        const values = [];
+        let custom = [];
+        pbf.readMessage(field => {
+            if (field === 1) collection.features.push(readFeature());
+            else if (field === 13) values.push(readValue());
+            else if (field === 15) custom = pbf.readPacked(false);
+        });
+        readProperties(custom, values, collection);
+        return collection;
+    }
+
+    pbf.readFields(pbf.buf.length, field => {
+        if (field === 1) keys.push(pbf.readString());
+        else if (field === 2) dimensions = pbf.readVarint();
+        else if (field === 3) factor = Math.pow(10, pbf.readVarint());
+        else if (field === 4) result = readFeatureCollection();
+        else if (field === 5) result = readFeature();
+        else if (field === 6) result = readGeometry();
+    });
+    return result;
+}
+
+/**
+ * Fetch a GeoJSON resource, preferring the Geobuf encoding
+ * @param {string} url - Layer or geometry store URL
+ * @returns {Promise<Object>} Decoded GeoJSON
+ */
+function fetchGeoJSON(url) {
+    return fetch(url, { headers: { Accept: `${GEOBUF_MIMETYPE}, application/json;q=0.9` } })
+        .then(res => {
+            if (!res.ok) {
+                throw new Error(`Request for ${url} failed with status ${res.status}`);
+            }
+            const contentType = res.headers.get('Content-Type') || '';
+            if (contentType.startsWith(GEOBUF_MIMETYPE)) {
+                return res.arrayBuffer().then(decodeGeobuf);
+            }
+            return res.json();
+        });
+}
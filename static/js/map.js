@@ -65,11 +65,19 @@ document.addEventListener('DOMContentLoaded', function() {
     const layerControls = {};
     const layerStyles = {};
     
-    // Fetch map info from the server
-    fetch('/api/map-info')
-        .then(response => response.json())
+    // Map info, the layer index, layer styles and schema summaries all
+    // arrive in one request
+    const bootstrapData = fetch('/api/bootstrap')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Bootstrap request failed with status ${response.status}`);
+            }
+            return response.json();
+        });
+    
+    bootstrapData
         .then(data => {
-            mapInfo = data;
+            mapInfo = data.mapInfo;
             
             // Update map bounds if needed
             const newBounds = [
@@ -156,10 +164,10 @@ document.addEventListener('DOMContentLoaded', function() {
     let selectedFeatures = [];
     let selectedLayer = null;
 
-    // Fetch available GeoJSON layers
-    fetch('/api/geojson-layers')
-        .then(response => response.json())
-        .then(layers => {
+    // Build the layer list from the bootstrap data
+    bootstrapData
+        .then(data => {
+            const layers = data.layers;
             const layerControlDiv = document.getElementById('layer-control');
             
             if (layers.length === 0) {
@@ -175,94 +183,82 @@ document.addEventListener('DOMContentLoaded', function() {
             // Clear loading indicator
             layerControlDiv.innerHTML = '';
             
-            // First load all the style information for each layer
-            const stylePromises = layers.map(layer => 
-                fetch(`/api/layer-style/${layer.id}`)
-                    .then(res => res.json())
-                    .then(styleInfo => {
-                        // Store the style information
-                        return { layer, styleInfo };
-                    })
-                    .catch(() => {
-                        // Generate a fallback color if style fetch fails
-                        const layerColor = getRandomColor();
-                        return { 
-                            layer, 
-                            styleInfo: {
-                                type: "default",
-                                default_style: {
-                                    color: layerColor,
-                                    fillColor: layerColor,
-                                    weight: 2,
-                                    opacity: 0.7,
-                                    fillOpacity: 0.5
-                                }
-                            } 
-                        };
-                    })
-            );
-            
-            // Process all layers after we have their styles
-            Promise.all(stylePromises)
-                .then(layersWithStyles => {
-                    // Add layers to the map
-                    layersWithStyles.forEach(({ layer, styleInfo }, index) => {
-                        // Determine a color for the layer legend
-                        let legendColor;
-                        
-                        if (styleInfo && styleInfo.default_style) {
-                            // Use fillColor for polygons and color for lines
-                            if (styleInfo.geometry_type === 'Polygon' || styleInfo.geometry_type === 'MultiPolygon') {
-                                legendColor = styleInfo.default_style.fillColor || "#3388ff";
-                            } else {
-                                legendColor = styleInfo.default_style.color || "#ff7800";
-                            }
-                        } else {
-                            // Fallback to a random color
-                            legendColor = getRandomColor();
+            // Styles come with the bootstrap data; layers without one get a random color
+            const layersWithStyles = layers.map(layer => {
+                let styleInfo = data.styles[layer.id];
+                if (!styleInfo) {
+                    const layerColor = getRandomColor();
+                    styleInfo = {
+                        type: "default",
+                        default_style: {
+                            color: layerColor,
+                            fillColor: layerColor,
+                            weight: 2,
+                            opacity: 0.7,
+                            fillOpacity: 0.5
                         }
-                        
-                        // Store the style for this layer
-                        layerStyles[layer.id] = {
-                            ...(styleInfo.default_style || {}),
-                            originalStyleInfo: styleInfo  // Store complete style info
-                        };
+                    };
+                }
+                return { layer, styleInfo };
+            });
+            
+            // Add layers to the map
+            layersWithStyles.forEach(({ layer, styleInfo }, index) => {
+                // Determine a color for the layer legend
+                let legendColor;
+                
+                if (styleInfo && styleInfo.default_style) {
+                    // Use fillColor for polygons and color for lines
+                    if (styleInfo.geometry_type === 'Polygon' || styleInfo.geometry_type === 'MultiPolygon') {
+                        legendColor = styleInfo.default_style.fillColor || "#3388ff";
+                    } else {
+                        legendColor = styleInfo.default_style.color || "#ff7800";
+                    }
+                } else {
+                    // Fallback to a random color
+                    legendColor = getRandomColor();
+                }
+                
+                // Store the style for this layer
+                layerStyles[layer.id] = {
+                    ...(styleInfo.default_style || {}),
+                    originalStyleInfo: styleInfo  // Store complete style info
+                };
 
-                        // Create layer checkbox UI
-                        const layerItem = document.createElement('div');
-                        layerItem.className = 'layer-item';
-                        layerItem.innerHTML = `
-                            <div class="form-check">
-                                <input class="form-check-input layer-checkbox" type="checkbox" 
-                                       id="layer-${layer.id}" data-layer="${layer.id}">
-                                <span class="layer-legend" style="background-color: ${legendColor};"></span>
-                                <label class="form-check-label layer-name" for="layer-${layer.id}">
-                                    ${layer.name} 
-                                    <small class="text-muted">(${layer.feature_count} features)</small>
-                                </label>
-                            </div>
-                        `;
-                        layerControlDiv.appendChild(layerItem);
-
-                        // Add to layer selector in filter panel
-                        const layerSelect = document.getElementById('layer-select');
-                        const option = document.createElement('option');
-                        option.value = layer.id;
-                        option.textContent = layer.name;
-                        layerSelect.appendChild(option);
-
-                        // Add event listener
-                        const checkbox = layerItem.querySelector(`#layer-${layer.id}`);
-                        checkbox.addEventListener('change', function() {
-                            const layerId = this.getAttribute('data-layer');
-                            toggleLayer(layerId, this.checked);
-                        });
+                // Create layer checkbox UI
+                const layerItem = document.createElement('div');
+                layerItem.className = 'layer-item';
+                layerItem.innerHTML = `
+                    <div class="form-check">
+                        <input class="form-check-input layer-checkbox" type="checkbox" 
+                               id="layer-${layer.id}" data-layer="${layer.id}">
+                        <span class="layer-legend" style="background-color: ${legendColor};"></span>
+                        <label class="form-check-label layer-name" for="layer-${layer.id}">
+                            ${layer.name} 
+                            <small class="text-muted">(${layer.feature_count} features)</small>
+                        </label>
+                    </div>
+                `;
+                layerControlDiv.appendChild(layerItem);
 
-                        // Load all layers by default
-                        checkbox.checked = true;
-                        toggleLayer(layer.id, true);
-                    });
+                // Add to layer selector in filter panel
+                const layerSelect = document.getElementById('layer-select');
+                const option = document.createElement('option');
+                option.value = layer.id;
+                option.textContent = layer.name;
+                layerSelect.appendChild(option);
+
+                // Add event listener
+                const checkbox = layerItem.querySelector(`#layer-${layer.id}`);
+                checkbox.addEventListener('change', function() {
+                    const layerId = this.getAttribute('data-layer');
+                    toggleLayer(layerId, this.checked);
                 });
+
+                // Load all layers by default
+                checkbox.checked = true;
+                toggleLayer(layer.id, true);
+            });
         })
         .catch(error => {
             console.error('Error fetching GeoJSON layers:', error);
@@ -288,15 +284,54 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Shared geometry stores, fetched once and reused by every layer that references them
+    const geometryStores = {};
+    
+    function fetchGeometryStore(source) {
+        if (!geometryStores[source]) {
+            geometryStores[source] = fetchGeoJSON(`/api/geometry/${encodeURIComponent(source)}`)
+                .then(data => {
+                    const geometries = new Map();
+                    (data.features || []).forEach(feature => geometries.set(feature.id, feature.geometry));
+                    return geometries;
+                })
+                .catch(error => {
+                    delete geometryStores[source];
+                    throw error;
+                });
+        }
+        return geometryStores[source];
+    }
+    
+    // Fetch a layer, joining attribute-only layers to their geometry store by feature id
+    function fetchLayerData(layerId) {
+        return fetchGeoJSON(`/api/geojson/${layerId}.geojson?join=0`)
+            .then(data => {
+                // Features without an id are addressed by position (see /api/generate-report)
+                (data.features || []).forEach((feature, index) => {
+                    if (feature.id === undefined || feature.id === null) {
+                        feature.id = index;
+                    }
+                });
+                if (!data.geometry_source) {
+                    return data;
+                }
+                return fetchGeometryStore(data.geometry_source).then(geometries => ({
+                    type: 'FeatureCollection',
+                    features: data.features.map(feature =>
+                        Object.assign({}, feature, { geometry: geometries.get(feature.id) || null }))
+                }));
+            });
+    }
+
     // Load GeoJSON layer data
     function loadGeoJSONLayer(layerId) {
-        // First, try to get style information for this layer
+        // Style information comes with the bootstrap data
         Promise.all([
-            fetch(`/api/geojson/${layerId}.geojson`).then(res => res.json()),
-            fetch(`/api/layer-style/${layerId}`).then(res => res.json()).catch(() => null),
-            fetch(`/api/layer-properties/${layerId}`).then(res => res.json()).catch(() => null)
+            fetchLayerData(layerId),
+            bootstrapData.then(data => data.styles[layerId] || null).catch(() => null)
         ])
-        .then(([data, styleInfo, propertyInfo]) => {
+        .then(([data, styleInfo]) => {
             // Create a new layer group for this GeoJSON
             const geoJSONLayer = L.layerGroup();
             
@@ -635,10 +670,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Handle feature selection
     function selectFeature(feature, layer, layerId) {
         // Toggle selected state
-        const featureId = feature.id || JSON.stringify(feature.properties);
+        const featureId = feature.id !== undefined ? feature.id : JSON.stringify(feature.properties);
         const alreadySelected = selectedFeatures.findIndex(f => 
-            (f.id && f.id === featureId) || 
-            JSON.stringify(f.properties) === JSON.stringify(feature.properties)
+            f.layerId === layerId && f.id === featureId
         );
         
         if (alreadySelected >= 0) {
@@ -709,8 +743,7 @@ document.addEventListener('DOMContentLoaded', function() {
             selectedFeatures.push({
                 id: featureId,
                 layerId: layerId,
-                properties: feature.properties,
-                geometry: feature.geometry
+                properties: feature.properties
             });
             
             // Remember which layer this feature belongs to
@@ -858,22 +891,54 @@ document.addEventListener('DOMContentLoaded', function() {
             mapImage = map.getRenderer(map).canvas.toDataURL();
         }
         
-        // Prepare report data
-        const reportData = {
-            title: reportTitle,
-            description: reportDescription,
-            mapImage: mapImage,
-            layerName: selectedLayer ? document.querySelector(`label[for="layer-${selectedLayer}"]`).textContent.trim() : '',
-            featureCount: selectedFeatures.length,
-            selectionType: 'Manual Selection',
-            features: selectedFeatures
-        };
+        // Aggregates are computed on the server from the IDs of the selected features
+        const layerId = selectedLayer || selectedFeatures[0].layerId;
+        const featureIds = selectedFeatures.filter(f => f.layerId === layerId).map(f => f.id);
         
-        // Encode the data to pass via URL
-        const encodedData = encodeURIComponent(JSON.stringify(reportData));
+        // A report covers one layer; say so before leaving the rest of the selection out
+        const excludedCount = selectedFeatures.length - featureIds.length;
+        if (excludedCount > 0 && !confirm(
+            `This report covers one layer (${layerId}). ${excludedCount} selected feature(s) ` +
+            `from other layers will not be included. Continue?`)) {
+            return;
+        }
         
-        // Navigate to the report page with the data
-        window.open(`/report?data=${encodedData}`, '_blank');
+        fetch('/api/generate-report', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ layerId: layerId, featureIds: featureIds })
+        })
+        .then(res => res.json())
+        .then(summary => {
+            if (summary.error) {
+                throw new Error(summary.error);
+            }
+            
+            // Prepare report data
+            const reportData = Object.assign({}, summary, {
+                title: reportTitle,
+                description: reportDescription,
+                mapImage: mapImage,
+                selectionType: 'Manual Selection'
+            });
+            
+            // Hand the report to the new page through local storage under a
+            // short id, so the URL stays small whatever the selection
+            const reportId = Date.now().toString(36) + Math.random().toString(36).slice(2, 8);
+            try {
+                localStorage.setItem(`report-${reportId}`, JSON.stringify(reportData));
+            } catch (error) {
+                // Storage is full: the map image is by far the largest part
+                console.warn('Report too large to store, leaving out the map image:', error);
+                reportData.mapImage = null;
+                localStorage.setItem(`report-${reportId}`, JSON.stringify(reportData));
+            }
+            window.open(`/report?id=${reportId}`, '_blank');
+        })
+        .catch(error => {
+            console.error('Error generating report:', error);
+            alert('An error occurred while generating the report. Please try again.');
+        });
     });
 
     // Add base layer control
@@ -881,5 +946,6 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Make the map object globally accessible
     window.homsMap = map;
+    window.layerControls = layerControls;
     window.selectedFeatures = selectedFeatures;
 });
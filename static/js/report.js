@@ -80,90 +80,8 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // Handle report creation
-    if (createReportBtn) {
-        createReportBtn.addEventListener('click', function() {
-            const selectedFeatures = window.selectedFeatures || [];
-            
-            if (selectedFeatures.length === 0) {
-                alert('Please select at least one feature on the map to include in the report.');
-                return;
-            }
-            
-            // Get report options
-            const title = document.getElementById('report-title').value || 'Homs Map Report';
-            const description = document.getElementById('report-description').value || '';
-            const includeMap = document.getElementById('include-map').checked;
-            
-            // Get the map screenshot if needed
-            let mapImage = null;
-            if (includeMap && window.homsMap) {
-                try {
-                    // Try to get map element for screenshot
-                    const mapContainer = window.homsMap.getContainer();
-                    
-                    // Use html2canvas if available, otherwise skip
-                    if (typeof html2canvas === 'function') {
-                        html2canvas(mapContainer).then(canvas => {
-                            mapImage = canvas.toDataURL('image/png');
-                            generateReport(title, description, mapImage, selectedFeatures);
-                        });
-                    } else {
-                        console.warn('html2canvas not available, skipping map screenshot');
-                        generateReport(title, description, null, selectedFeatures);
-                    }
-                } catch (e) {
-                    console.error('Error capturing map:', e);
-                    generateReport(title, description, null, selectedFeatures);
-                }
-            } else {
-                generateReport(title, description, null, selectedFeatures);
-            }
-        });
-    }
-    
-    // Generate the report with data
-    function generateReport(title, description, mapImage, features) {
-        try {
-            // Get the layer name from the first feature
-            let layerName = 'Unknown Layer';
-            if (features[0] && features[0].layerId) {
-                const layerElement = document.querySelector(`label[for="layer-${features[0].layerId}"]`);
-                if (layerElement) {
-                    layerName = layerElement.textContent.trim();
-                }
-            }
-            
-            // Build report data
-            const reportData = {
-                title: title,
-                description: description,
-                mapImage: mapImage,
-                layerName: layerName,
-                featureCount: features.length,
-                selectionType: 'Manual Selection',
-                features: features.map(feature => ({
-                    id: feature.id || 'Feature ID not available',
-                    properties: feature.properties || {}
-                }))
-            };
-            
-            // Encode the data to pass via URL
-            const encodedData = encodeURIComponent(JSON.stringify(reportData));
-            
-            // Open the report in a new window
-            window.open(`/report?data=${encodedData}`, '_blank');
-            
-            // Close the modal
-            const reportModal = bootstrap.Modal.getInstance(document.getElementById('report-modal'));
-            if (reportModal) {
-                reportModal.hide();
-            }
-        } catch (e) {
-            console.error('Error generating report:', e);
-            alert('An error occurred while generating the report. Please try again.');
-        }
-    }
+    // Report creation (server-side aggregates for the selected feature IDs)
+    // is handled in map.js, which knows the active layer
     
     // Handle print report on the report page
     const printReportBtn = document.getElementById('print-report');
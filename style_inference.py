@@ -0,0 +1,407 @@
+"""
+Column profiling and style inference for extracted layers.
+
+A profile summarises every attribute column of a layer in one pass: its
+type, non-null count, distinct values, and numeric values. Both extractors
+derive their categorical styles from it, and the web app computes it once
+per layer version for the schema and classification endpoints (see
+build_layer_profile).
+
+Layers with more than PROFILE_SAMPLE_ROWS rows are profiled from a uniform
+sample of PROFILE_SAMPLE_SIZE rows. Distinct counts then come from a
+HyperLogLog sketch over the full column, and columns that look categorical
+in the sample are recounted exactly, so style decisions do not depend on
+the sample.
+"""
+import os
+import re
+import math
+import hashlib
+import colorsys
+from collections import Counter
+
+import numpy as np
+
+from layer_query import is_number
+
+# Row count above which columns are profiled from a sample
+PROFILE_SAMPLE_ROWS = int(os.environ.get("PROFILE_SAMPLE_ROWS", 200000))
+
+# Rows drawn for the sample
+PROFILE_SAMPLE_SIZE = int(os.environ.get("PROFILE_SAMPLE_SIZE", 50000))
+
+# Distinct values kept per column
+MAX_TRACKED_VALUES = 50
+
+# HyperLogLog registers (2 ** precision); about 1.6% standard error
+HLL_PRECISION = 12
+
+# Column name words that mark a column as carrying style information
+STYLE_ATTRS = frozenset([
+    'COLOR', 'SYMBOL', 'WIDTH', 'STYLE', 'FILL', 'STROKE', 'OUTLINE',
+    'TYPE', 'CATEGORY', 'CLASS', 'CODE', 'STATUS', 'KIND', 'FUNCTION',
+    'USE', 'LEVEL', 'IMPORTANCE'
+])
+
+# Distinct values allowed in a categorical style, and in a column picked
+# for one only because it has few values
+MAX_CATEGORIES = 20
+FALLBACK_MAX_CATEGORIES = 10
+
+# Columns never picked for a style only because they have few values
+EXCLUDED_COLUMNS = ('geometry', 'shape', 'objectid', 'fid', 'id')
+
+_WORD = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+
+def infer_type(types):
+    """Infer a property type from the set of Python types seen for it"""
+    if not types:
+        return 'null'
+    if types <= {int, float}:
+        return 'number'
+    if types == {bool}:
+        return 'boolean'
+    if types == {str}:
+        return 'string'
+    return 'mixed'
+
+
+def _mix(x):
+    # splitmix64 finalizer: spreads the bits of uint64 keys
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_numbers(numbers):
+    # Equal numbers (1 and 1.0, 0.0 and -0.0) hash alike
+    return _mix((np.asarray(numbers, dtype=np.float64) + 0.0).view(np.uint64))
+
+
+def _stable_hash(value):
+    # The builtin hash() of strings is salted per process, which would make
+    # estimates vary between runs. Equal numbers (1, 1.0 and True) hash alike,
+    # as they count as one value exactly.
+    if isinstance(value, (int, float, np.number)):
+        value = float(value) + 0.0
+    return int.from_bytes(hashlib.blake2b(repr(value).encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+def _hash_objects(values):
+    return _mix(np.fromiter(map(_stable_hash, values), dtype=np.uint64, count=len(values)))
+
+
+def hyperloglog(hashes, precision=HLL_PRECISION):
+    """Estimate the number of distinct 64-bit hashes"""
+    m = 1 << precision
+    if not len(hashes):
+        return 0
+    index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    # Rank: position of the first 1-bit in the remaining bits (exact in a
+    # float64 while 64 - precision <= 52)
+    _, exponent = np.frexp(rest.astype(np.float64))
+    rank = (64 - precision) - exponent + 1
+    registers = np.zeros(m, dtype=np.int64)
+    np.maximum.at(registers, index, rank)
+
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        # Linear counting is more accurate for small cardinalities
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+class ColumnProfile:
+    """Summary of one attribute column"""
+
+    __slots__ = ('name', 'types', 'count', 'distinct_count', 'approximate', 'values', 'numbers')
+
+    def __init__(self, name, types, count, distinct_count, approximate, values, numbers):
+        self.name = name
+        # Python types of the non-null values
+        self.types = types
+        self.count = count
+        self.distinct_count = distinct_count
+        # True when distinct_count is a HyperLogLog estimate
+        self.approximate = approximate
+        # Up to MAX_TRACKED_VALUES distinct values with their counts, in
+        # order of first appearance (sample counts when approximate)
+        self.values = values
+        # Finite numeric values as float64, in row order
+        self.numbers = numbers
+
+    @property
+    def kind(self):
+        return infer_type(self.types)
+
+    @property
+    def truncated(self):
+        return self.distinct_count > len(self.values)
+
+    def categories(self):
+        """Return the distinct values, most frequent first"""
+        order = sorted(range(len(self.values)), key=list(self.values.values()).__getitem__, reverse=True)
+        keys = list(self.values)
+        return [keys[i] for i in order]
+
+
+class LayerProfile:
+    """Profiles of every attribute column of a layer, by name in order of appearance"""
+
+    def __init__(self, row_count, columns, sampled, geometry_types=()):
+        self.row_count = row_count
+        self.columns = columns
+        self.sampled = sampled
+        self.geometry_types = geometry_types
+
+
+def _first_values(counter):
+    values = {}
+    for value, count in counter.items():
+        if len(values) >= MAX_TRACKED_VALUES:
+            break
+        values[value] = count
+    return values
+
+
+def _profile_numeric(name, array, sample):
+    if array.dtype.kind == 'b':
+        values = array
+        types = {bool} if len(values) else set()
+        numbers = np.empty(0)
+    else:
+        numbers = array.astype(np.float64)
+        # Missing numbers arrive as NaN from data frames
+        present = np.isfinite(numbers)
+        numbers = numbers[present]
+        values = array[present]
+        types = ({int} if array.dtype.kind in 'iu' else {float}) if len(values) else set()
+
+    counted = values if sample is None else array[sample]
+    if sample is not None and array.dtype.kind != 'b':
+        counted = counted[np.isfinite(counted.astype(np.float64))]
+    unique, first, counts = np.unique(counted, return_index=True, return_counts=True)
+    approximate = False
+    if sample is not None:
+        if len(unique) <= MAX_TRACKED_VALUES:
+            # Few values in the sample: count them exactly
+            unique, first, counts = np.unique(values, return_index=True, return_counts=True)
+            distinct_count = len(unique)
+        else:
+            distinct_count = hyperloglog(_hash_numbers(values))
+            approximate = True
+    else:
+        distinct_count = len(unique)
+    order = np.argsort(first, kind='stable')[:MAX_TRACKED_VALUES]
+    tracked = dict(zip(unique[order].tolist(), counts[order].tolist()))
+    return ColumnProfile(name, types, int(len(values)), distinct_count, approximate, tracked, numbers)
+
+
+def _profile_objects(name, array, sample):
+    present = array != None  # noqa: E711 - elementwise comparison
+    values = array[present]
+    types = set(map(type, values))
+    if float in types:
+        # Missing values arrive as NaN from data frames
+        values = values[values == values]
+        types = set(map(type, values))
+
+    if types <= {int, float}:
+        numbers = values.astype(np.float64)
+        numbers = numbers[np.isfinite(numbers)]
+    elif types & {int, float}:
+        numbers = np.array([value for value in values if is_number(value)], dtype=np.float64)
+    else:
+        numbers = np.empty(0)
+
+    # Only hashable scalars are counted
+    if types & {dict, list}:
+        hashable = [value for value in values if not isinstance(value, (dict, list))]
+    else:
+        hashable = values
+
+    approximate = False
+    if sample is None:
+        counter = Counter(hashable)
+        distinct_count = len(counter)
+    else:
+        sampled = [value for value in array[sample]
+                   if value is not None and value == value and not isinstance(value, (dict, list))]
+        counter = Counter(sampled)
+        if len(counter) <= MAX_TRACKED_VALUES:
+            # Few values in the sample: count them exactly
+            counter = Counter(hashable)
+            distinct_count = len(counter)
+        else:
+            distinct_count = hyperloglog(_hash_objects(hashable))
+            approximate = True
+    return ColumnProfile(name, types, int(len(values)), distinct_count, approximate,
+                         _first_values(counter), numbers)
+
+
+def profile_column(name, values, sample=None):
+    """Profile one column (a list, NumPy array or pandas Series) of a layer
+
+    sample is an optional sorted array of the row positions to count
+    values from.
+    """
+    array = np.asarray(values)
+    if array.dtype.kind in 'biuf':
+        return _profile_numeric(name, array, sample)
+    if array.dtype.kind != 'O':
+        array = array.astype(object)
+    return _profile_objects(name, array, sample)
+
+
+def _sample_rows(row_count, sample_rows, sample_size):
+    if row_count <= sample_rows:
+        return None
+    # A fixed seed keeps repeated builds identical
+    rng = np.random.default_rng(0)
+    return np.sort(rng.choice(row_count, size=min(sample_size, row_count), replace=False))
+
+
+def profile_columns(columns, row_count, sample_rows=PROFILE_SAMPLE_ROWS, sample_size=PROFILE_SAMPLE_SIZE,
+                    geometry_types=()):
+    """Profile a mapping of column name to values"""
+    sample = _sample_rows(row_count, sample_rows, sample_size)
+    profiles = {name: profile_column(name, values, sample) for name, values in columns.items()}
+    return LayerProfile(row_count, profiles, sample is not None, geometry_types)
+
+
+def profile_frame(gdf, **options):
+    """Profile the attribute columns of a GeoDataFrame"""
+    geometry = gdf.geometry.name
+    columns = {name: gdf[name].to_numpy() for name in gdf.columns if name != geometry}
+    return profile_columns(columns, len(gdf), **options)
+
+
+def profile_features(features, **options):
+    """Profile the properties of a list of GeoJSON features
+
+    Properties missing from a feature count as null.
+    """
+    properties = [feature.get('properties') or {} for feature in features]
+    names = dict.fromkeys(name for props in properties for name in props)
+    columns = {}
+    for name in names:
+        columns[name] = np.fromiter((props.get(name) for props in properties), dtype=object,
+                                    count=len(properties))
+    geometry_types = sorted({
+        feature['geometry'].get('type') for feature in features if feature.get('geometry')
+    } - {None})
+    return profile_columns(columns, len(features), geometry_types=geometry_types, **options)
+
+
+def build_layer_profile(entry):
+    """Profile the properties of a LayerStore entry"""
+    return profile_features(entry.data.get('features', []))
+
+
+def name_words(name):
+    """Split a column name into upper-cased words (ROAD_TYPE, roadType -> ROAD, TYPE)"""
+    return [word.upper() for word in _WORD.findall(name)]
+
+
+def style_columns(profile, excluded=EXCLUDED_COLUMNS):
+    """Pick the columns to derive categorical styles from
+
+    Columns with a style word in their name come first; without any, columns
+    with a handful of distinct values are used instead.
+    """
+    named = [name for name in profile.columns if STYLE_ATTRS.intersection(name_words(name))]
+    if named:
+        return named
+    limit = min(FALLBACK_MAX_CATEGORIES, profile.row_count / 5)
+    return [
+        name for name, column in profile.columns.items()
+        if name.lower() not in excluded and 1 < column.distinct_count <= limit
+    ]
+
+
+def geometry_family(geometry_type):
+    """Return 'polygon', 'line' or 'point' for a geometry type, or None"""
+    return {
+        'Polygon': 'polygon', 'MultiPolygon': 'polygon',
+        'LineString': 'line', 'MultiLineString': 'line',
+        'Point': 'point', 'MultiPoint': 'point',
+    }.get(geometry_type)
+
+
+def fallback_color(geometry_type):
+    """Default layer color for a geometry type"""
+    return {
+        'polygon': '#3388ff',  # Blue for polygons
+        'line': '#ff7800',     # Orange for lines
+        'point': '#e41a1c',    # Red for points
+    }.get(geometry_family(geometry_type), '#808080')
+
+
+def default_style(geometry_type, color):
+    """Base style of a layer drawn in one color"""
+    style = {
+        "weight": 2,
+        "opacity": 1,
+        "fillOpacity": 0.5
+    }
+    family = geometry_family(geometry_type)
+    if family == 'polygon':
+        style.update(fillColor=color, color="#000000", weight=1, fillOpacity=0.7)
+    elif family == 'line':
+        style.update(color=color, weight=3)
+    elif family == 'point':
+        style.update(radius=6, fillColor=color, color="#000000", weight=1, fillOpacity=0.8)
+    return style
+
+
+def category_color(index, color_scheme=None):
+    """Color of the index-th category: from the scheme, else spread by the golden angle"""
+    if color_scheme and index < len(color_scheme):
+        return color_scheme[index]
+    hue = (index * 137.508) % 360
+    r, g, b = colorsys.hsv_to_rgb(hue / 360, 0.7, 0.9)
+    return f"#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}"
+
+
+def _value_style(geometry_type, column_name, value, index, count, color):
+    family = geometry_family(geometry_type)
+    if family == 'polygon':
+        return {"fillColor": color, "color": "#000000", "weight": 1, "fillOpacity": 0.7}
+    if family == 'line':
+        style = {"color": color}
+        # Rank-like columns also set the line width
+        if any(word in column_name.lower() for word in ('type', 'class', 'importance')):
+            if is_number(value):
+                style["weight"] = min(max(value, 1), 8)
+            else:
+                # Text categories are sized by their position in the list
+                style["weight"] = (index / count) * 5 + 1
+        return style
+    if family == 'point':
+        return {"fillColor": color, "radius": 6 + index % 4}
+    return {}
+
+
+def property_styles(profile, geometry_type, color_scheme=None, excluded=EXCLUDED_COLUMNS):
+    """Categorical styles for the style columns of a profiled layer"""
+    styles = {}
+    limit = min(MAX_CATEGORIES, profile.row_count * 0.3)
+    for name in style_columns(profile, excluded):
+        column = profile.columns[name]
+        if not 1 < column.distinct_count <= limit:
+            continue
+        categories = column.categories()
+        styles[name] = {
+            "type": "categorical",
+            "field": name,
+            "values": {
+                str(value): _value_style(geometry_type, name, value, i, len(categories),
+                                         category_color(i, color_scheme))
+                for i, value in enumerate(categories)
+            }
+        }
+    return styles
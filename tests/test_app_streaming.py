@@ -0,0 +1,71 @@
+import gzip
+import json
+
+import pytest
+
+from layer_store import GEOMETRY_DIR, LayerStore
+
+try:
+    import app as app_module
+except OSError as e:
+    # The app creates its static directories on import
+    pytest.skip(f"app cannot be imported here: {e}", allow_module_level=True)
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data), encoding='utf-8')
+
+
+def _square(x):
+    return {'type': 'Polygon', 'coordinates': [[[x, 0.0], [x + 1, 0.0], [x + 1, 1.0], [x, 0.0]]]}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A thematic layer sharing the geometry of a store, both over the budget
+    _write(tmp_path / GEOMETRY_DIR / 'neighborhoods.geojson', {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': i, 'properties': {}, 'geometry': _square(i)} for i in range(6)
+    ]})
+    # Mostly in store order, with two features swapped
+    order = [0, 1, 3, 2, 4, 5]
+    _write(tmp_path / 'housing.geojson', {'type': 'FeatureCollection', 'geometry_source': 'neighborhoods', 'features': [
+        {'type': 'Feature', 'id': i, 'properties': {'housing': i * 10}, 'geometry': None} for i in order
+    ]})
+    # Precomputed copies of the attribute-only file must not be sent as the joined layer
+    (tmp_path / 'housing.geojson.gz').write_bytes(gzip.compress((tmp_path / 'housing.geojson').read_bytes()))
+    (tmp_path / 'housing.geobuf').write_bytes(b'attribute-only')
+    monkeypatch.setattr(app_module, 'GEOJSON_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module, 'layer_store', LayerStore(str(tmp_path), budget_bytes=64))
+    return app_module.app.test_client()
+
+
+def _features(response):
+    assert response.status_code == 200
+    return json.loads(response.get_data())['features']
+
+
+def test_streamed_thematic_layer_is_joined(client):
+    features = _features(client.get('/api/geojson/housing.geojson', headers={'Accept-Encoding': 'gzip'}))
+    assert [feature['id'] for feature in features] == [0, 1, 3, 2, 4, 5]
+    for feature in features:
+        assert feature['geometry'] == _square(feature['id'])
+        assert feature['properties']['housing'] == feature['id'] * 10
+
+
+def test_streamed_geobuf_request_falls_back_to_joined_json(client):
+    response = client.get('/api/geojson/housing.geojson?format=geobuf')
+    assert response.mimetype == 'application/json'
+    assert all(feature['geometry'] for feature in _features(response))
+
+
+def test_join_0_streams_attributes_only(client):
+    features = _features(client.get('/api/geojson/housing.geojson?join=0'))
+    assert len(features) == 6
+    assert all(feature['geometry'] is None for feature in features)
+
+
+def test_geojsonseq_is_joined(client):
+    response = client.get('/api/geojson/housing.geojson?format=geojsonseq')
+    records = [json.loads(record) for record in response.get_data().split(b'\x1e') if record.strip()]
+    assert [record['geometry'] == _square(record['id']) for record in records] == [True] * 6
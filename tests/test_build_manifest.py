@@ -0,0 +1,57 @@
+import os
+
+from build_manifest import BuildManifest, hash_file, hash_settings
+
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_changed_input_is_stale(tmp_path):
+    source = tmp_path / 'input.geojson'
+    output = tmp_path / 'output.geojson'
+    _write(source, '{"features": []}')
+    _write(output, '{}')
+    manifest_path = str(tmp_path / 'manifest.json')
+    settings = hash_settings({'code': 'v1'})
+
+    manifest = BuildManifest(manifest_path, force=False)
+    sources = {str(source): hash_file(source)}
+    assert not manifest.is_fresh('layer', sources, settings)
+    manifest.record('layer', sources, settings, [str(output)])
+    manifest.save()
+
+    manifest = BuildManifest(manifest_path, force=False)
+    assert manifest.is_fresh('layer', {str(source): hash_file(source)}, settings)
+    assert not manifest.is_fresh('layer', sources, hash_settings({'code': 'v2'}))
+
+    _write(source, '{"features": [{}]}')
+    assert not manifest.is_fresh('layer', {str(source): hash_file(source)}, settings)
+
+    _write(source, '{"features": []}')
+    os.remove(output)
+    assert not manifest.is_fresh('layer', {str(source): hash_file(source)}, settings)
+
+
+def test_force_rebuilds(tmp_path):
+    manifest = BuildManifest(str(tmp_path / 'manifest.json'), force=True)
+    manifest.record('layer', {}, 'settings', [])
+    assert not manifest.is_fresh('layer', {}, 'settings')
+
+
+def test_geodatabase_edits_are_seen_by_the_next_build(tmp_path):
+    gdb = tmp_path / 'layers.gdb'
+    gdb.mkdir()
+    _write(gdb / 'a00000001.gdbtable', 'one')
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    first = BuildManifest(manifest_path, force=False)
+    digest = first.hash_gdb_source(str(gdb), 'Roads')
+    assert first.hash_gdb_source(str(gdb), 'Buildings') != digest
+
+    _write(gdb / 'a00000001.gdbtable', 'two')
+    # Memoized within a build ...
+    assert first.hash_gdb_source(str(gdb), 'Roads') == digest
+    # ... but not across builds in the same process
+    assert BuildManifest(manifest_path, force=False).hash_gdb_source(str(gdb), 'Roads') != digest
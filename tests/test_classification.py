@@ -0,0 +1,47 @@
+import itertools
+
+import numpy as np
+
+from classification import assign_classes, compute_breaks, jenks
+
+
+def _ssd(values):
+    return float(((values - values.mean()) ** 2).sum())
+
+
+def _brute_force_cost(values, k):
+    # Smallest within-class sum of squares over every split of sorted values
+    n = len(values)
+    best = np.inf
+    for cuts in itertools.combinations(range(1, n), k - 1):
+        bounds = (0,) + cuts + (n,)
+        best = min(best, sum(_ssd(values[a:b]) for a, b in zip(bounds, bounds[1:])))
+    return best
+
+
+def _cost(values, breaks):
+    classes = assign_classes(values, breaks)
+    return sum(_ssd(values[classes == c]) for c in np.unique(classes))
+
+
+def test_jenks_matches_brute_force():
+    rng = np.random.default_rng(1)
+    for trial in range(20):
+        n = int(rng.integers(4, 12))
+        values = np.sort(np.round(rng.gamma(2.0, 10.0, n), 1))
+        for k in range(1, min(5, n) + 1):
+            breaks = jenks(values, k)
+            assert len(breaks) == k + 1
+            assert breaks[0] == values[0] and breaks[-1] == values[-1]
+            assert np.isclose(_cost(values, breaks), _brute_force_cost(values, k))
+
+
+def test_jenks_separates_obvious_clusters():
+    values = np.array([1.0, 2.0, 3.0, 50.0, 51.0, 52.0, 100.0, 101.0])
+    assert compute_breaks(values, 'jenks', 3) == [1.0, 3.0, 52.0, 101.0]
+
+
+def test_breaks_ignore_missing_values():
+    values = np.array([np.nan, 4.0, 0.0, np.nan, 8.0])
+    assert compute_breaks(values, 'equal_interval', 2) == [0.0, 4.0, 8.0]
+    assert list(assign_classes(values, [0.0, 4.0, 8.0])) == [-1, 0, 0, -1, 1]
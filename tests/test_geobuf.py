@@ -0,0 +1,241 @@
+"""Round trips through geobuf.encode and an independent Geobuf v3 reader"""
+import json
+import struct
+
+import geobuf
+
+
+def _varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _fields(data):
+    # Yield (field, value) pairs; length-delimited values are returned as bytes
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 1:
+            value = struct.unpack('<d', data[pos:pos + 8])[0]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        yield field, value
+
+
+def _packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = _varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _value(data):
+    for field, value in _fields(data):
+        if field == 1:
+            return value.decode('utf-8')
+        if field == 2:
+            return value
+        if field == 3:
+            return value
+        if field == 4:
+            return -value
+        if field == 5:
+            return bool(value)
+        if field == 6:
+            return json.loads(value)
+    return None
+
+
+class _Reader:
+    """Geobuf v3 decoder following the reference implementation"""
+
+    def __init__(self, data):
+        self.keys = []
+        self.dimensions = 2
+        self.factor = 10 ** geobuf.DEFAULT_PRECISION
+        self.data = data
+
+    def decode(self):
+        body = None
+        for field, value in _fields(self.data):
+            if field == 1:
+                self.keys.append(value.decode('utf-8'))
+            elif field == 2:
+                self.dimensions = value
+            elif field == 3:
+                self.factor = 10 ** value
+            else:
+                body = (field, value)
+        field, value = body
+        if field == 4:
+            return self.collection(value)
+        if field == 5:
+            return self.feature(value)
+        return self.geometry(value)
+
+    def props(self, indexes, values, target):
+        for i in range(0, len(indexes), 2):
+            target[self.keys[indexes[i]]] = values[indexes[i + 1]]
+
+    def collection(self, data):
+        result = {'type': 'FeatureCollection', 'features': []}
+        values = []
+        for field, value in _fields(data):
+            if field == 1:
+                result['features'].append(self.feature(value))
+            elif field == 13:
+                values.append(_value(value))
+            elif field == 15:
+                self.props(_packed(value), values, result)
+        return result
+
+    def feature(self, data):
+        result = {'type': 'Feature'}
+        values = []
+        for field, value in _fields(data):
+            if field == 1:
+                result['geometry'] = self.geometry(value)
+            elif field == 11:
+                result['id'] = value.decode('utf-8')
+            elif field == 12:
+                result['id'] = _unzigzag(value)
+            elif field == 13:
+                values.append(_value(value))
+            elif field == 14:
+                self.props(_packed(value), values, result.setdefault('properties', {}))
+            elif field == 15:
+                self.props(_packed(value), values, result)
+        return result
+
+    def geometry(self, data):
+        gtype, lengths, coords, members, values = None, None, [], [], []
+        result = {}
+        for field, value in _fields(data):
+            if field == 1:
+                gtype = value
+            elif field == 2:
+                lengths = _packed(value)
+            elif field == 3:
+                coords = [_unzigzag(v) for v in _packed(value)]
+            elif field == 4:
+                members.append(self.geometry(value))
+            elif field == 13:
+                values.append(_value(value))
+            elif field == 15:
+                self.props(_packed(value), values, result)
+        name = {code: name for name, code in geobuf.GEOMETRY_TYPES.items()}[gtype]
+        result['type'] = name
+        if name == 'GeometryCollection':
+            result['geometries'] = members
+        elif name == 'Point':
+            result['coordinates'] = [c / self.factor for c in coords]
+        elif name in ('MultiPoint', 'LineString'):
+            result['coordinates'] = self.line(coords, 0, len(coords) // self.dimensions)[0]
+        elif name in ('MultiLineString', 'Polygon'):
+            closed = name == 'Polygon'
+            lengths = lengths or [len(coords) // self.dimensions]
+            lines, pos = [], 0
+            for length in lengths:
+                line, pos = self.line(coords, pos, length, closed)
+                lines.append(line)
+            result['coordinates'] = lines
+        elif name == 'MultiPolygon':
+            if lengths is None:
+                lengths = [1, 1, len(coords) // self.dimensions]
+            polygons, pos, i = [], 0, 1
+            for _ in range(lengths[0]):
+                rings = []
+                for _ in range(lengths[i]):
+                    ring, pos = self.line(coords, pos, lengths[i + 1 + len(rings)], True)
+                    rings.append(ring)
+                i += 1 + len(rings)
+                polygons.append(rings)
+            result['coordinates'] = polygons
+        return result
+
+    def line(self, coords, pos, length, closed=False):
+        points, previous = [], [0] * self.dimensions
+        for _ in range(length):
+            point = []
+            for d in range(self.dimensions):
+                previous[d] += coords[pos]
+                point.append(previous[d] / self.factor)
+                pos += 1
+            points.append(point)
+        if closed:
+            points.append(list(points[0]))
+        return points, pos
+
+
+def _decode(data):
+    return _Reader(data).decode()
+
+
+def test_feature_properties_and_custom_members_share_values():
+    feature = {
+        'type': 'Feature',
+        'id': 7,
+        'bbox': [36.5, 34.6, 36.8, 34.8],
+        'properties': {'name': 'Bab Amr', 'housing': 42.5, 'count': 3, 'deficit': -2, 'ok': True},
+        'geometry': {'type': 'Point', 'coordinates': [36.7, 34.73]},
+        'source': 'survey',
+    }
+    decoded = _decode(geobuf.encode({'type': 'FeatureCollection', 'features': [feature]}))
+    assert decoded['features'][0] == feature
+
+
+def test_mixed_dimensions_are_padded():
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'a': 1}, 'geometry': {'type': 'Point', 'coordinates': [36.7, 34.7]}},
+        {'type': 'Feature', 'properties': {'a': 2},
+         'geometry': {'type': 'LineString', 'coordinates': [[36.7, 34.7, 500.0], [36.71, 34.72, 510.5]]}},
+        {'type': 'Feature', 'properties': {'a': 3}, 'geometry': {'type': 'Point', 'coordinates': [36.8, 34.8, 12.0]}},
+    ]}
+    decoded = _decode(geobuf.encode(collection))
+    geometries = [feature['geometry'] for feature in decoded['features']]
+    assert geometries[0]['coordinates'] == [36.7, 34.7, 0.0]
+    assert geometries[1]['coordinates'] == [[36.7, 34.7, 500.0], [36.71, 34.72, 510.5]]
+    assert geometries[2]['coordinates'] == [36.8, 34.8, 12.0]
+    assert [feature['properties']['a'] for feature in decoded['features']] == [1, 2, 3]
+
+
+def test_polygons_round_trip():
+    ring = [[36.6, 34.7], [36.7, 34.7], [36.7, 34.75], [36.6, 34.7]]
+    hole = [[36.65, 34.71], [36.66, 34.72], [36.67, 34.71], [36.65, 34.71]]
+    geometries = [
+        {'type': 'Polygon', 'coordinates': [ring, hole]},
+        {'type': 'MultiPolygon', 'coordinates': [[ring]]},
+        {'type': 'MultiPolygon', 'coordinates': [[ring, hole], [ring]]},
+        {'type': 'MultiLineString', 'coordinates': [ring[:2], hole[:3]]},
+    ]
+    for geometry in geometries:
+        assert _decode(geobuf.encode(geometry)) == geometry
+
+
+def test_collection_custom_members():
+    collection = {'type': 'FeatureCollection', 'geometry_source': 'neighborhoods', 'features': [
+        {'type': 'Feature', 'id': 'a', 'properties': {'x': None}, 'geometry': None},
+    ]}
+    decoded = _decode(geobuf.encode(collection))
+    assert decoded['geometry_source'] == 'neighborhoods'
+    assert decoded['features'][0]['id'] == 'a'
+    assert decoded['features'][0]['properties'] == {'x': None}
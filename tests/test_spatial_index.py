@@ -0,0 +1,44 @@
+import numpy as np
+
+from spatial_index import STRTree, geometry_bounds
+
+
+def _intersects(box, minx, miny, maxx, maxy):
+    return not (box[0] > maxx or box[2] < minx or box[1] > maxy or box[3] < miny)
+
+
+def _random_boxes(rng, count):
+    boxes = []
+    for _ in range(count):
+        if rng.random() < 0.05:
+            boxes.append(None)
+            continue
+        x, y = rng.uniform(0, 100, 2)
+        width, height = rng.exponential(3, 2)
+        boxes.append((x, y, x + width, y + height))
+    return boxes
+
+
+def test_query_matches_linear_scan():
+    rng = np.random.default_rng(7)
+    for count, capacity in ((0, 4), (1, 4), (37, 4), (500, 8), (2000, 16)):
+        boxes = _random_boxes(rng, count)
+        tree = STRTree(boxes, capacity)
+        for _ in range(50):
+            minx, miny = rng.uniform(-10, 100, 2)
+            maxx, maxy = minx + rng.exponential(15), miny + rng.exponential(15)
+            expected = [i for i, box in enumerate(boxes)
+                        if box is not None and _intersects(box, minx, miny, maxx, maxy)]
+            assert tree.query(minx, miny, maxx, maxy) == expected
+
+
+def test_point_query_includes_box_edges():
+    boxes = [(0, 0, 1, 1), (1, 1, 2, 2), (5, 5, 6, 6), None]
+    tree = STRTree(boxes, capacity=2)
+    assert tree.query_point(1, 1) == [0, 1]
+    assert tree.query_point(3, 3) == []
+
+
+def test_geometry_bounds():
+    polygon = {'type': 'Polygon', 'coordinates': [[[0, 0], [4, 1], [2, 5], [0, 0]]]}
+    assert tuple(geometry_bounds(polygon)) == (0, 0, 4, 5)
@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+
+from update_neighborhood_layer import assign_rings, convert_esri_geometry, convert_esri_to_geojson, signed_areas
+
+
+def _square(x, y, size, clockwise):
+    ring = [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+    return ring[::-1] if clockwise else ring
+
+
+def test_signed_areas():
+    areas = signed_areas([_square(0, 0, 2, False), _square(10, 10, 1, True)])
+    assert np.allclose(areas, [4.0, -1.0])
+
+
+def test_holes_go_to_the_smallest_containing_outer_ring():
+    # An island inside a lake inside a field, next to a separate plot
+    field = _square(0, 0, 10, clockwise=True)
+    lake = _square(2, 2, 6, clockwise=False)
+    island = _square(4, 4, 2, clockwise=True)
+    pond = _square(5, 5, 0.5, clockwise=False)
+    plot = _square(20, 0, 3, clockwise=True)
+    stray = _square(30, 30, 1, clockwise=False)
+
+    polygons = assign_rings([field, lake, island, pond, plot, stray])
+
+    assert len(polygons) == 4
+    by_outer = {tuple(polygon[0][0]): polygon for polygon in polygons}
+    assert by_outer[(0, 0)][1:] == [lake[::-1]]
+    assert by_outer[(4, 4)][1:] == [pond[::-1]]
+    assert len(by_outer[(20, 0)]) == 1
+    # A hole inside no outer ring becomes a polygon of its own
+    assert by_outer[(30, 30)] == [stray]
+    # Outer rings counter-clockwise, holes clockwise (RFC 7946)
+    for polygon in polygons:
+        areas = signed_areas(polygon)
+        assert areas[0] > 0 and all(area < 0 for area in areas[1:])
+
+
+def test_counter_clockwise_only_rings_are_outer_rings():
+    rings = [_square(0, 0, 1, False), _square(5, 5, 1, False)]
+    assert assign_rings(rings) == [[rings[0]], [rings[1]]]
+
+
+def test_degenerate_rings_are_dropped():
+    assert assign_rings([[[0, 0], [1, 1], [0, 0]]]) == []
+    assert convert_esri_geometry({'rings': []}) is None
+
+
+def test_geometry_types():
+    polygon = convert_esri_geometry({'rings': [_square(0, 0, 4, True), _square(1, 1, 1, False)]})
+    assert polygon['type'] == 'Polygon' and len(polygon['coordinates']) == 2
+    multipolygon = convert_esri_geometry({'rings': [_square(0, 0, 1, True), _square(5, 5, 1, True)]})
+    assert multipolygon['type'] == 'MultiPolygon'
+    assert convert_esri_geometry({'x': 1.5, 'y': 2.5}) == {'type': 'Point', 'coordinates': [1.5, 2.5]}
+    assert convert_esri_geometry({'paths': [[[0, 0], [1, 1]]]})['type'] == 'LineString'
+
+
+def test_streamed_conversion(tmp_path):
+    source = tmp_path / 'export.json'
+    source.write_text(json.dumps({'features': [
+        {'attributes': {'ADM4_NAME': 'Al Waer'}, 'geometry': {'rings': [_square(0, 0, 1, True)]}},
+        {'attributes': {'name': 'no geometry'}},
+    ]}), encoding='utf-8')
+    output = tmp_path / 'out.geojson'
+
+    assert convert_esri_to_geojson(str(source), str(output)) == 1
+    collection = json.loads(output.read_text(encoding='utf-8'))
+    assert collection['features'][0]['properties'] == {'ADM4_NAME': 'Al Waer'}
+    assert not (tmp_path / 'out.geobuf').exists()
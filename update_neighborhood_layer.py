@@ -1,93 +1,208 @@
 #!/usr/bin/env python
 """
 Update neighborhood layer with data from test.json to ensure all the required columns are present.
+
+ESRI JSON is converted one feature at a time, so memory use stays flat
+whatever the size of the export. Polygon rings are grouped into polygons
+by orientation (ESRI outer rings are clockwise) and containment. Run with
+--batch INPUT_DIR OUTPUT_DIR to convert every .json export of a directory
+in parallel (ETL_WORKERS worker processes, default one per core).
 """
-import json
+import argparse
+import glob
+import logging
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import columnar
+import compression
+import geobuf
+import geojson_writer
+from build_manifest import BuildManifest, hash_code, hash_file, hash_settings
+from geojson_stream import iter_array
+
+# Worker processes used in batch mode (defaults to one per core)
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", 0)) or os.cpu_count() or 1
 
-def convert_esri_to_geojson(input_file, output_file):
+# Workers are spawned rather than forked, so a conversion started from a
+# multithreaded process cannot inherit locks held by its other threads
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+def neighborhood_properties(attributes):
     """
-    Convert ESRI JSON to GeoJSON format, preserving all properties.
+    Add the display properties the map uses to the attributes of a neighborhood.
     """
-    print(f"Converting {input_file} to GeoJSON format...")
-    
-    try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            esri_json = json.load(f)
-            
-        # Create GeoJSON structure
-        geojson = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-        
-        if "features" not in esri_json:
-            print("Error: Input file doesn't have features array")
-            return False
-            
-        # Process each feature
-        for feature in esri_json["features"]:
+    if "ADM4_NAME_" in attributes:
+        attributes["arabic_label"] = attributes["ADM4_NAME_"]
+    if "ADM4_NAME" in attributes:
+        attributes["neighborhood"] = attributes["ADM4_NAME"]
+    return attributes
+
+def iter_esri_features(input_file, properties=None):
+    """
+    Yield the features of an ESRI JSON file as GeoJSON features, one at a time.
+
+    Features without attributes or geometry are skipped. properties, if
+    given, is called with each feature's attributes and returns its
+    GeoJSON properties.
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for feature in iter_array(f, 'features'):
             if "attributes" not in feature or "geometry" not in feature:
                 continue
-                
-            geojson_feature = {
+            attributes = feature["attributes"] or {}
+            yield {
                 "type": "Feature",
-                "properties": feature["attributes"],
-                "geometry": convert_esri_geometry(feature["geometry"])
+                "properties": properties(attributes) if properties else attributes,
+                "geometry": convert_esri_geometry(feature["geometry"] or {})
             }
-            
-            # Add display properties for the map
-            if "ADM4_NAME_" in feature["attributes"]:
-                geojson_feature["properties"]["arabic_label"] = feature["attributes"]["ADM4_NAME_"]
-            if "ADM4_NAME" in feature["attributes"]:
-                geojson_feature["properties"]["neighborhood"] = feature["attributes"]["ADM4_NAME"]
-            if "OverAllIndicator" in feature["attributes"]:
-                geojson_feature["properties"]["OverAllIndicator"] = feature["attributes"]["OverAllIndicator"]
-                
-            geojson["features"].append(geojson_feature)
-            
+
+def convert_esri_to_geojson(input_file, output_file, properties=None, copies=False):
+    """
+    Convert ESRI JSON to GeoJSON format, preserving all properties.
+
+    Features are streamed to a temporary file that replaces the output once
+    complete, with coordinates rounded by geojson_writer, so memory use does
+    not grow with the export. With copies, the Geobuf and columnar copies
+    are written too; they are encoded from the whole collection, so only
+    then are the converted features kept in memory. Returns the number of
+    features written, or None if the conversion failed.
+    """
+    print(f"Converting {input_file} to GeoJSON format...")
+
+    try:
         # Write GeoJSON to file
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(geojson, f, ensure_ascii=False)
-            
-        print(f"Successfully converted to GeoJSON. Saved to {output_file}")
-        return True
-        
-    except Exception as e:
-        print(f"Error converting file: {e}")
-        return False
-        
+        kept = [] if copies else None
+        count = geojson_writer.write_features(iter_esri_features(input_file, properties), output_file, keep=kept)
+
+        if copies:
+            geojson = {"type": "FeatureCollection", "features": kept}
+            geobuf.write_geobuf(geojson, output_file)
+            columnar.write_arrow(geojson, output_file)
+        compression.write_compressed(output_file)
+
+        if not count:
+            print(f"Warning: no features found in {input_file}")
+        print(f"Successfully converted {count} features to GeoJSON. Saved to {output_file}")
+        return count
+
+    except (OSError, ValueError) as e:
+        print(f"Error converting {input_file}: {e}")
+        return None
+
+def output_files(output_file, copies=False):
+    """
+    Return the paths convert_esri_to_geojson() writes for an output file.
+    """
+    outputs = [output_file]
+    if copies:
+        outputs += [geobuf.geobuf_path(output_file)] + columnar.columnar_paths(output_file)
+    return outputs + compression.compressed_paths(output_file)
+
+def signed_areas(rings):
+    """
+    Return the signed area of each ring, positive when counter-clockwise.
+
+    Computed with the shoelace formula over all rings at once.
+    """
+    lengths = np.array([len(ring) for ring in rings], dtype=np.intp)
+    if not len(rings) or not lengths.all():
+        raise ValueError("Rings must have at least one point")
+    coords = np.concatenate([np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings])
+    # Centring keeps the cross products from losing precision
+    coords -= coords.mean(axis=0)
+    x, y = coords[:, 0], coords[:, 1]
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    following = np.arange(1, len(coords) + 1)
+    # The last point of each ring is followed by its first
+    following[starts + lengths - 1] = starts
+    cross = x * y[following] - x[following] * y
+    return np.add.reduceat(cross, starts) / 2
+
+def _ring_contains(ring, x, y):
+    # Even-odd ray casting over all edges of the ring at once
+    xi, yi = ring[:, 0], ring[:, 1]
+    xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+    crosses = (yi > y) != (yj > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersections = (xj - xi) * (y - yi) / (yj - yi) + xi
+    return bool(np.count_nonzero(crosses & (x < intersections)) % 2)
+
+def assign_rings(rings):
+    """
+    Group ESRI polygon rings into GeoJSON polygons.
+
+    Clockwise rings are outer rings and counter-clockwise rings are holes,
+    each assigned to the smallest outer ring that contains it. Holes inside
+    no outer ring become polygons of their own, and when no ring is
+    clockwise every ring is taken as an outer ring. Rings of fewer than
+    four points or without area are dropped. The polygons follow the
+    GeoJSON winding order: outer rings counter-clockwise, holes clockwise.
+    """
+    rings = [ring for ring in rings if len(ring) >= 4]
+    if not rings:
+        return []
+    areas = signed_areas(rings)
+    outer = areas < 0
+    if not outer.any():
+        outer = areas > 0
+
+    polygons = []
+    outer_rings = []
+    for index in np.flatnonzero(outer):
+        polygons.append([rings[index][::-1] if areas[index] < 0 else rings[index]])
+        ring = np.asarray(rings[index], dtype=np.float64)[:, :2]
+        outer_rings.append((abs(areas[index]), ring, ring.min(axis=0), ring.max(axis=0)))
+
+    # Only counter-clockwise rings remain: holes, or stray outer rings
+    for index in np.flatnonzero(~outer & (areas != 0)):
+        x, y = rings[index][0][0], rings[index][0][1]
+        containing = [
+            (area, position) for position, (area, ring, low, high) in enumerate(outer_rings)
+            if low[0] <= x <= high[0] and low[1] <= y <= high[1] and _ring_contains(ring, x, y)
+        ]
+        if containing:
+            # Holes are clockwise in GeoJSON
+            polygons[min(containing)[1]].append(rings[index][::-1])
+        else:
+            polygons.append([rings[index]])
+    return polygons
+
 def convert_esri_geometry(esri_geometry):
     """
     Convert ESRI geometry to GeoJSON geometry.
+
+    Returns None for empty or unsupported geometries.
     """
-    geojson_geometry = {}
-    
+    geojson_geometry = None
+
     if "rings" in esri_geometry:
         # Polygon or MultiPolygon
-        rings = esri_geometry["rings"]
-        
-        if len(rings) == 1:
+        polygons = assign_rings(esri_geometry["rings"])
+
+        if len(polygons) == 1:
             geojson_geometry = {
                 "type": "Polygon",
-                "coordinates": rings
+                "coordinates": polygons[0]
             }
-        else:
+        elif polygons:
             geojson_geometry = {
                 "type": "MultiPolygon",
-                "coordinates": [rings]
+                "coordinates": polygons
             }
     elif "paths" in esri_geometry:
         # LineString or MultiLineString
         paths = esri_geometry["paths"]
-        
+
         if len(paths) == 1:
             geojson_geometry = {
                 "type": "LineString",
                 "coordinates": paths[0]
             }
-        else:
+        elif paths:
             geojson_geometry = {
                 "type": "MultiLineString",
                 "coordinates": paths
@@ -98,27 +213,104 @@ def convert_esri_geometry(esri_geometry):
             "type": "MultiPoint",
             "coordinates": esri_geometry["points"]
         }
-    elif "x" in esri_geometry and "y" in esri_geometry:
+    elif esri_geometry.get("x") is not None and esri_geometry.get("y") is not None:
         # Point
         geojson_geometry = {
             "type": "Point",
             "coordinates": [esri_geometry["x"], esri_geometry["y"]]
         }
-    
+
     return geojson_geometry
 
-def main():
+def _convert_export(input_file, output_file, copies):
+    return convert_esri_to_geojson(input_file, output_file, copies=copies)
+
+def convert_directory(input_dir, output_dir, workers=None, copies=False, manifest=None):
+    """
+    Convert every ESRI JSON export (*.json) of a directory to GeoJSON in parallel.
+
+    Each export is written to output_dir under its own name with a .geojson
+    extension. Exports that are unchanged since their last conversion (see
+    build_manifest) are skipped. Returns a dict mapping each converted
+    input file to its feature count, or None where the conversion failed.
+    """
+    manifest = manifest or BuildManifest()
+    settings = hash_settings({'code': hash_code(__file__, geobuf, columnar, compression, geojson_writer),
+                              'copies': copies})
+
+    tasks = {}
+    for input_file in sorted(glob.glob(os.path.join(input_dir, "*.json"))):
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        key = f"update_neighborhood_layer/batch/{name}"
+        sources = {input_file: hash_file(input_file)}
+        if manifest.is_fresh(key, sources, settings):
+            print(f"{input_file} is up to date.")
+            continue
+        tasks[input_file] = (os.path.join(output_dir, f"{name}.geojson"), key, sources)
+
+    results = {}
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers or ETL_WORKERS, mp_context=WORKER_CONTEXT) as executor:
+            futures = {
+                executor.submit(_convert_export, input_file, output_file, copies): input_file
+                for input_file, (output_file, _, _) in tasks.items()
+            }
+            for future in as_completed(futures):
+                input_file = futures[future]
+                try:
+                    results[input_file] = future.result()
+                except Exception as e:
+                    print(f"Error converting {input_file}: {e}")
+                    results[input_file] = None
+
+    # Only record successful conversions, so failures are retried
+    for input_file, count in results.items():
+        if count is not None:
+            output_file, key, sources = tasks[input_file]
+            manifest.record(key, sources, settings, output_files(output_file, copies), info={'feature_count': count})
+    manifest.save()
+
+    converted = sum(count is not None for count in results.values())
+    print(f"Converted {converted} of {len(results)} changed exports in {input_dir}.")
+    return results
+
+def main(copies=False):
     input_file = "attached_assets/test.json"
     output_file = "static/data/neighborhood.geojson"
-    
+
     if not os.path.exists(input_file):
         print(f"Error: Input file {input_file} does not exist.")
         return
-        
-    if convert_esri_to_geojson(input_file, output_file):
+
+    # Skip the conversion when neither the ESRI JSON nor this script changed
+    manifest = BuildManifest()
+    key = "update_neighborhood_layer/neighborhood"
+    sources = {input_file: hash_file(input_file)}
+    settings = hash_settings({'code': hash_code(__file__, geobuf, columnar, compression, geojson_writer),
+                              'copies': copies})
+    if manifest.is_fresh(key, sources, settings):
+        print("Neighborhood layer is up to date.")
+        return
+
+    if convert_esri_to_geojson(input_file, output_file, neighborhood_properties, copies) is not None:
+        manifest.record(key, sources, settings, output_files(output_file, copies))
+        manifest.save()
         print("Neighborhood layer updated successfully.")
     else:
         print("Failed to update neighborhood layer.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # geojson_writer logs the size of each file written
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch", nargs=2, metavar=("INPUT_DIR", "OUTPUT_DIR"),
+                        help="convert every ESRI JSON export of INPUT_DIR to GeoJSON in OUTPUT_DIR")
+    parser.add_argument("--copies", action="store_true",
+                        help="also write the Geobuf and columnar copies (holds every feature in memory)")
+    parser.add_argument("--workers", type=int, help="worker processes in batch mode")
+    parser.add_argument("--force", action="store_true", help="convert even if up to date")
+    args = parser.parse_args()
+    if args.batch:
+        convert_directory(*args.batch, workers=args.workers, copies=args.copies)
+    else:
+        main(copies=args.copies)
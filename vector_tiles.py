@@ -0,0 +1,404 @@
+"""
+Mapbox Vector Tile (MVT) rendering and caching for GeoJSON layers.
+
+Features are projected to Web Mercator tile coordinates, clipped to the tile
+(plus a small buffer), simplified and encoded as protobuf following version 2
+of the Mapbox Vector Tile specification. Rendered tiles are cached in memory
+and on disk, keyed by the version of the source layer.
+"""
+import os
+import json
+import math
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+
+import protobuf as pb
+from simplification import douglas_peucker
+
+logger = logging.getLogger(__name__)
+
+# Tile coordinate resolution and clipping buffer, in tile units
+EXTENT = 4096
+BUFFER = 64
+
+# Douglas-Peucker tolerance in tile units (16 units = 1 pixel on a 256px tile)
+SIMPLIFY_TOLERANCE = 4
+
+MAX_ZOOM = 22
+
+# Web Mercator latitude limit
+MAX_LATITUDE = 85.0511287798
+
+# MVT geometry types and commands
+GEOM_POINT = 1
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+# In-memory tile cache budget in bytes (override with TILE_CACHE_BYTES)
+DEFAULT_TILE_CACHE_BYTES = int(os.environ.get("TILE_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+def tile_bounds(z, x, y):
+    """Return the (west, south, east, north) lon/lat bounds of a tile"""
+    n = 2 ** z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y))
+
+
+class _Projector:
+    """Projects lon/lat into the coordinate space of one tile"""
+
+    def __init__(self, z, x, y):
+        self.scale = EXTENT * (2 ** z)
+        self.dx = x * EXTENT
+        self.dy = y * EXTENT
+
+    def __call__(self, point):
+        lon, lat = point[0], max(min(point[1], MAX_LATITUDE), -MAX_LATITUDE)
+        sin_lat = math.sin(math.radians(lat))
+        px = (lon + 180.0) / 360.0 * self.scale - self.dx
+        py = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * self.scale - self.dy
+        return (px, py)
+
+
+def _clip_ring(points, low, high):
+    """Clip a closed ring to a square with Sutherland-Hodgman"""
+    for axis in (0, 1):
+        for bound, inside in ((low, lambda v: v >= low), (high, lambda v: v <= high)):
+            if not points:
+                return points
+            clipped = []
+            prev = points[-1]
+            prev_in = inside(prev[axis])
+            for point in points:
+                cur_in = inside(point[axis])
+                if cur_in != prev_in:
+                    t = (bound - prev[axis]) / (point[axis] - prev[axis])
+                    crossing = [prev[0] + (point[0] - prev[0]) * t, prev[1] + (point[1] - prev[1]) * t]
+                    crossing[axis] = bound
+                    clipped.append(tuple(crossing))
+                if cur_in:
+                    clipped.append(point)
+                prev, prev_in = point, cur_in
+            points = clipped
+    return points
+
+
+def _clip_line(points, low, high):
+    """Clip a polyline to a square, returning the parts that remain inside"""
+    parts = []
+    current = []
+    for a, b in zip(points, points[1:]):
+        # Liang-Barsky segment clipping
+        t0, t1 = 0.0, 1.0
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        visible = True
+        for p, q in ((-dx, a[0] - low), (dx, high - a[0]), (-dy, a[1] - low), (dy, high - a[1])):
+            if p == 0:
+                if q < 0:
+                    visible = False
+                    break
+            else:
+                t = q / p
+                if p < 0:
+                    t0 = max(t0, t)
+                else:
+                    t1 = min(t1, t)
+                if t0 > t1:
+                    visible = False
+                    break
+        if not visible:
+            if current:
+                parts.append(current)
+                current = []
+            continue
+        start = (a[0] + t0 * dx, a[1] + t0 * dy)
+        end = (a[0] + t1 * dx, a[1] + t1 * dy)
+        if not current:
+            current = [start]
+        current.append(end)
+        if t1 < 1.0:
+            parts.append(current)
+            current = []
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _to_ints(points):
+    """Round to integer tile coordinates, dropping repeated points"""
+    out = []
+    for x, y in points:
+        point = (int(round(x)), int(round(y)))
+        if not out or out[-1] != point:
+            out.append(point)
+    return out
+
+
+def _ring_area(ring):
+    """Surveyor's formula in tile coordinates (positive = exterior in MVT)"""
+    area = 0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        area += x1 * y2 - x2 * y1
+    return area / 2
+
+
+class _GeometryEncoder:
+    """Builds the command stream of one MVT feature"""
+
+    def __init__(self):
+        self.commands = []
+        self.cursor = (0, 0)
+
+    def _command(self, cmd, count):
+        self.commands.append((cmd & 0x7) | (count << 3))
+
+    def _points(self, points):
+        cx, cy = self.cursor
+        for x, y in points:
+            self.commands.append(pb.zigzag(x - cx))
+            self.commands.append(pb.zigzag(y - cy))
+            cx, cy = x, y
+        self.cursor = (cx, cy)
+
+    def points(self, points):
+        self._command(CMD_MOVE_TO, len(points))
+        self._points(points)
+
+    def line(self, points):
+        self._command(CMD_MOVE_TO, 1)
+        self._points(points[:1])
+        self._command(CMD_LINE_TO, len(points) - 1)
+        self._points(points[1:])
+
+    def ring(self, points):
+        self.line(points)
+        self._command(CMD_CLOSE_PATH, 1)
+
+
+def _polygon_parts(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def _line_parts(geometry):
+    if geometry['type'] == 'LineString':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def encode_geometry(geometry, project, tolerance=SIMPLIFY_TOLERANCE):
+    """Clip, simplify and encode a GeoJSON geometry for one tile
+
+    Returns (geometry type, command list), or None when nothing of the
+    geometry is left inside the tile.
+    """
+    gtype = geometry.get('type')
+    low, high = -BUFFER, EXTENT + BUFFER
+    encoder = _GeometryEncoder()
+
+    if gtype in ('Point', 'MultiPoint'):
+        coords = [geometry['coordinates']] if gtype == 'Point' else geometry['coordinates']
+        points = _to_ints(project(p) for p in coords)
+        points = [p for p in points if low <= p[0] <= high and low <= p[1] <= high]
+        if not points:
+            return None
+        encoder.points(points)
+        return GEOM_POINT, encoder.commands
+
+    if gtype in ('LineString', 'MultiLineString'):
+        for line in _line_parts(geometry):
+            projected = [project(p) for p in line]
+            for part in _clip_line(projected, low, high):
+                part = _to_ints(douglas_peucker(part, tolerance))
+                if len(part) >= 2:
+                    encoder.line(part)
+        return (GEOM_LINESTRING, encoder.commands) if encoder.commands else None
+
+    if gtype in ('Polygon', 'MultiPolygon'):
+        for polygon in _polygon_parts(geometry):
+            for index, ring in enumerate(polygon):
+                projected = [project(p) for p in ring[:-1]]
+                clipped = _clip_ring(projected, low, high)
+                if len(clipped) < 3:
+                    if index == 0:
+                        # Holes are meaningless once the exterior is gone
+                        break
+                    continue
+                clipped.append(clipped[0])
+                points = _to_ints(douglas_peucker(clipped, tolerance))
+                # MVT rings are closed implicitly by ClosePath
+                if len(points) > 1 and points[0] == points[-1]:
+                    points.pop()
+                area = _ring_area(points) if len(points) >= 3 else 0
+                if area == 0:
+                    if index == 0:
+                        break
+                    continue
+                # Exterior rings need a positive area, holes a negative one
+                if (area > 0) != (index == 0):
+                    points.reverse()
+                encoder.ring(points)
+        return (GEOM_POLYGON, encoder.commands) if encoder.commands else None
+
+    return None
+
+
+class _LayerBuilder:
+    """Accumulates features, keys and values for one MVT layer"""
+
+    def __init__(self, name):
+        self.name = name
+        self.features = []
+        self.keys = {}
+        self.values = {}
+
+    def _index(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add(self, fid, properties, geom_type, commands):
+        tags = []
+        for name, value in (properties or {}).items():
+            if value is None:
+                continue
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False)
+            tags.append(self._index(self.keys, name))
+            # Keep the type in the key so 1, 1.0 and True stay distinct values
+            tags.append(self._index(self.values, (type(value).__name__, value)))
+        self.features.append(
+            pb.field_varint(1, fid)
+            + pb.field_packed(2, tags)
+            + pb.field_varint(3, geom_type)
+            + pb.field_packed(4, commands)
+        )
+
+    @staticmethod
+    def _encode_value(kind, value):
+        if kind == 'str':
+            return pb.field_string(1, value)
+        if kind == 'bool':
+            return pb.field_varint(7, int(value))
+        if kind == 'int':
+            return pb.field_varint(5, value) if value >= 0 else pb.field_sint(6, value)
+        return pb.field_double(3, float(value))
+
+    def encode(self):
+        parts = [pb.field_varint(15, 2), pb.field_string(1, self.name)]
+        parts.extend(pb.field_bytes(2, feature) for feature in self.features)
+        parts.extend(pb.field_string(3, name) for name in self.keys)
+        parts.extend(pb.field_bytes(4, self._encode_value(*value)) for value in self.values)
+        parts.append(pb.field_varint(5, EXTENT))
+        return b''.join(parts)
+
+
+def render_tile(layer_name, features, index, z, x, y):
+    """Render the features of one layer intersecting tile z/x/y as MVT bytes
+
+    index is the layer's spatial_index.STRTree, used to find candidate features.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    # Pad the lookup window by the clipping buffer
+    pad_x = (east - west) * BUFFER / EXTENT
+    pad_y = (north - south) * BUFFER / EXTENT
+    west, south, east, north = west - pad_x, south - pad_y, east + pad_x, north + pad_y
+
+    project = _Projector(z, x, y)
+    layer = _LayerBuilder(layer_name)
+    for fid in index.query(west, south, east, north):
+        feature = features[fid]
+        encoded = encode_geometry(feature['geometry'], project)
+        if encoded:
+            layer.add(fid, feature.get('properties'), *encoded)
+
+    if not layer.features:
+        return b''
+    return pb.field_bytes(3, layer.encode())
+
+
+class TileCache:
+    """Two-level (memory + disk) cache of rendered tiles keyed by layer version"""
+
+    def __init__(self, cache_dir, budget_bytes=DEFAULT_TILE_CACHE_BYTES, metrics=None):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        # Told of cache hits and misses (see metrics.RequestMetrics)
+        self.metrics = metrics
+        self._tiles = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # Layer versions whose stale on-disk tiles have already been removed
+        self._pruned = set()
+
+    def _path(self, layer_id, version_key, z, x, y):
+        return os.path.join(self.cache_dir, layer_id, version_key, str(z), str(x), f"{y}.pbf")
+
+    def get(self, layer_id, version_key, z, x, y):
+        """Return cached tile bytes, or None if the tile has not been rendered"""
+        tile = self._lookup(layer_id, version_key, z, x, y)
+        if self.metrics is not None:
+            self.metrics.cache_lookup('tiles', layer_id, tile is not None)
+        return tile
+
+    def _lookup(self, layer_id, version_key, z, x, y):
+        key = (layer_id, version_key, z, x, y)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+        path = self._path(layer_id, version_key, z, x, y)
+        try:
+            with open(path, 'rb') as f:
+                tile = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, tile)
+        return tile
+
+    def put(self, layer_id, version_key, z, x, y, tile):
+        """Store a rendered tile in memory and on disk"""
+        self._prune_stale(layer_id, version_key)
+        path = self._path(layer_id, version_key, z, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(tile)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write tile cache file {path}: {e}")
+        self._remember((layer_id, version_key, z, x, y), tile)
+
+    def _remember(self, key, tile):
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = tile
+                self._total_bytes += len(tile)
+            while self._total_bytes > self.budget_bytes and self._tiles:
+                _, old = self._tiles.popitem(last=False)
+                self._total_bytes -= len(old)
+
+    def _prune_stale(self, layer_id, version_key):
+        """Remove on-disk tiles rendered from older versions of a layer"""
+        if (layer_id, version_key) in self._pruned:
+            return
+        self._pruned.add((layer_id, version_key))
+        layer_dir = os.path.join(self.cache_dir, layer_id)
+        if not os.path.isdir(layer_dir):
+            return
+        for name in os.listdir(layer_dir):
+            if name != version_key:
+                shutil.rmtree(os.path.join(layer_dir, name), ignore_errors=True)